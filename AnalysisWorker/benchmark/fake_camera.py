@@ -0,0 +1,106 @@
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+IMAGE_PATH = '/Render/CameraHandler.ashx'
+
+
+def load_frames(frames_dir: str) -> list:
+    """Đọc các ảnh mẫu (.jpg/.jpeg) trong thư mục, theo thứ tự tên file."""
+    frames = []
+    for name in sorted(os.listdir(frames_dir)):
+        if name.lower().endswith(('.jpg', '.jpeg')):
+            with open(os.path.join(frames_dir, name), 'rb') as f:
+                frames.append(f.read())
+    if not frames:
+        raise FileNotFoundError(f"Không có ảnh mẫu nào trong {frames_dir}")
+    return frames
+
+
+class FakeCameraServer:
+    """
+    Máy chủ HTTP giả lập cổng camera giao thông: `/` trả cookie, `/Render/CameraHandler.ashx?id=...`
+    trả lần lượt các ảnh mẫu (mỗi camera một vị trí riêng trong vòng ảnh) sau `latency_ms` mili giây.
+    Chạy trong luồng riêng nên không chiếm event loop của camera-ingest.
+    """
+
+    def __init__(self, frames: list, host: str = '127.0.0.1', port: int = 0, latency_ms: float = 0):
+        self.frames = frames
+        self.latency = latency_ms / 1000.0
+        self.served = 0
+        self._positions = defaultdict(int)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def portal_url(self) -> str:
+        return f'{self.base_url}/'
+
+    @property
+    def image_url(self) -> str:
+        # Định dạng CAMERA_IMAGE_URL của camera-ingest
+        return f'{self.base_url}{IMAGE_PATH}?id={{camera_id}}'
+
+    def next_frame(self, camera_id: str) -> bytes:
+        with self._lock:
+            position = self._positions[camera_id]
+            self._positions[camera_id] = position + 1
+            self.served += 1
+        # Lệch vị trí bắt đầu theo camera để các camera không gửi cùng một ảnh cùng lúc
+        return self.frames[(position + zlib.crc32(camera_id.encode())) % len(self.frames)]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-camera', daemon=True)
+        self._thread.start()
+        logger.info(f"📷 Máy chủ camera giả chạy tại {self.base_url} ({len(self.frames)} ảnh mẫu)")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == '/':
+                    self._send(200, b'ok', 'text/plain', {'Set-Cookie': 'ASP.NET_SessionId=benchmark; Path=/'})
+                    return
+                camera_id = parse_qs(url.query).get('id', [None])[0]
+                if url.path != IMAGE_PATH or not camera_id:
+                    self._send(404, b'not found', 'text/plain')
+                    return
+                if server.latency > 0:
+                    time.sleep(server.latency)
+                self._send(200, server.next_frame(camera_id), 'image/jpeg')
+
+            def _send(self, status: int, body: bytes, content_type: str, headers: dict = None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Không in mỗi request ra log
+                pass
+
+        return Handler
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import numpy as np
+
+# (tên công đoạn, mốc bắt đầu, mốc kết thúc) - mỗi mốc do một hàm được bọc trong run.py ghi lại theo minio_key
+STAGES = [
+    ('pull', 'fetch_start', 'fetched'),          # chờ semaphore + tải ảnh từ camera (+ lọc trùng)
+    ('upload', 'fetched', 'uploaded'),           # PUT lên MinIO
+    ('publish', 'uploaded', 'published'),        # publish tới khi có message id
+    ('queue', 'published', 'received'),          # nằm trong hàng đợi tới khi callback nhận
+    ('wait_download', 'received', 'download_start'),
+    ('download', 'download_start', 'downloaded'),
+    ('wait_decode', 'downloaded', 'decode_start'),
+    ('decode', 'decode_start', 'decoded'),
+    ('wait_infer', 'decoded', 'infer_start'),
+    ('infer', 'infer_start', 'inferred'),        # cả batch YOLO chứa ảnh này
+    ('wait_write', 'inferred', 'write_start'),
+    ('write', 'write_start', 'committed'),       # gom lô + INSERT + commit
+    ('ack', 'committed', 'acked'),               # xoá object MinIO + ACK
+    ('end_to_end', 'fetch_start', 'acked'),
+]
+
+PERCENTILES = (50, 90, 99)
+
+
+class FrameTrace:
+    """Thời điểm (time.monotonic) của từng mốc cho từng ảnh, ghi từ nhiều luồng và event loop."""
+
+    def __init__(self):
+        self._events = {}
+        self._lock = threading.Lock()
+
+    def mark(self, key: str, event: str, at: float = None):
+        at = time.monotonic() if at is None else at
+        with self._lock:
+            # Giữ lần đầu tiên: tin nhắn gửi lại không làm lệch thời gian của lần xử lý đầu
+            self._events.setdefault(key, {}).setdefault(event, at)
+
+    def mark_many(self, keys, event: str):
+        at = time.monotonic()
+        for key in keys:
+            self.mark(key, event, at)
+
+    def frames(self) -> dict:
+        with self._lock:
+            return {key: dict(events) for key, events in self._events.items()}
+
+    def pending(self) -> int:
+        """Số ảnh đã publish nhưng chưa được ACK."""
+        with self._lock:
+            return sum(1 for events in self._events.values() if 'published' in events and 'acked' not in events)
+
+
+def summarize(trace: FrameTrace, started: float, stopped: float, warmup: float) -> dict:
+    """
+    Phân vị độ trễ (ms) của từng công đoạn và throughput ổn định: số ảnh được ACK sau khi đã commit
+    trong cửa sổ [started + warmup, stopped] chia cho độ dài cửa sổ.
+    """
+    frames = [events for events in trace.frames().values() if 'fetch_start' in events]
+    window_start = started + warmup
+    window = max(stopped - window_start, 1e-9)
+
+    stages = {}
+    for name, start_event, end_event in STAGES:
+        values = np.array([
+            (events[end_event] - events[start_event]) * 1000
+            for events in frames if start_event in events and end_event in events
+        ])
+        if len(values) == 0:
+            continue
+        stages[name] = {
+            'count': int(len(values)),
+            **{f'p{p}': float(np.percentile(values, p)) for p in PERCENTILES},
+            'max': float(values.max()),
+        }
+
+    def in_window(events, event):
+        return event in events and window_start <= events[event] <= stopped
+
+    return {
+        'frames_published': sum(1 for events in frames if 'published' in events),
+        'frames_committed': sum(1 for events in frames if 'committed' in events),
+        'frames_failed': sum(1 for events in frames if 'acked' in events and 'committed' not in events),
+        'frames_unfinished': sum(1 for events in frames if 'published' in events and 'acked' not in events),
+        'offered_fps': sum(1 for events in frames if in_window(events, 'published')) / window,
+        'throughput_fps': sum(1 for events in frames if 'committed' in events and in_window(events, 'acked')) / window,
+        'stages': stages,
+    }
+
+
+def format_summary(camera_count: int, summary: dict) -> str:
+    lines = [
+        f"=== {camera_count} camera: publish {summary['frames_published']}, commit {summary['frames_committed']}, "
+        f"lỗi {summary['frames_failed']}, chưa xong {summary['frames_unfinished']} | "
+        f"đưa vào {summary['offered_fps']:.2f} ảnh/s, xử lý ổn định {summary['throughput_fps']:.2f} ảnh/s",
+        f"{'công đoạn':<14} {'số ảnh':>7} " + " ".join(f"{f'p{p} (ms)':>10}" for p in PERCENTILES) + f" {'max (ms)':>10}",
+    ]
+    for name, _, _ in STAGES:
+        stage = summary['stages'].get(name)
+        if stage is None:
+            continue
+        lines.append(
+            f"{name:<14} {stage['count']:>7} "
+            + " ".join(f"{stage[f'p{p}']:>10.1f}" for p in PERCENTILES)
+            + f" {stage['max']:>10.1f}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,101 @@
+import asyncio
+import itertools
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryMessage:
+    """Tin nhắn có giao diện giống pubsub_v1 Message mà callback của image-process dùng."""
+
+    def __init__(self, broker: 'MemoryQueue', message_id: str, data: bytes, attributes: dict):
+        self._broker = broker
+        self.message_id = message_id
+        self.data = data
+        self.attributes = attributes
+        self.delivery_attempt = 1
+        self._settled = False
+        self._lock = threading.Lock()
+
+    def _settle(self) -> bool:
+        with self._lock:
+            if self._settled:
+                return False
+            self._settled = True
+            return True
+
+    def ack(self):
+        if self._settle():
+            self._broker._release()
+
+    def nack(self):
+        if self._settle():
+            self._broker._release()
+            self._broker._redeliver(self)
+
+
+class MemoryQueue:
+    """
+    Hàng đợi trong bộ nhớ thay cho Pub/Sub khi benchmark trong một tiến trình:
+      - phía publish: `publish()` cùng chữ ký với ImagePublisher của camera-ingest
+      - phía subscribe: callback chạy trên thread pool `max_workers` luồng, tối đa `max_messages`
+        tin nhắn chưa ACK (giống FlowControl của subscriber)
+    `encode(minio_key, payload) -> (data, attributes)` quyết định định dạng tin nhắn (json / compact).
+    """
+
+    def __init__(self, encode: Callable[[str, dict], tuple]):
+        self._encode = encode
+        self._queue = queue.Queue()
+        self._ids = itertools.count(1)
+        self._in_flight = None
+        self._executor = None
+        self._thread = None
+        self.published = 0
+        self.redelivered = 0
+
+    async def publish(self, minio_key: str, camera_id: str, payload: dict) -> str:
+        data, attributes = self._encode(minio_key, payload)
+        message = MemoryMessage(self, str(next(self._ids)), data, attributes)
+        self._queue.put(message)
+        self.published += 1
+        # Nhường event loop như một lần publish thật
+        await asyncio.sleep(0)
+        return message.message_id
+
+    def subscribe(self, callback: Callable, max_workers: int, max_messages: int):
+        self._in_flight = threading.Semaphore(max_messages)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='memory-queue')
+        self._thread = threading.Thread(target=self._dispatch_loop, args=(callback,), name='memory-queue', daemon=True)
+        self._thread.start()
+        logger.info(f"Hàng đợi trong bộ nhớ: {max_workers} luồng callback, tối đa {max_messages} tin nhắn chưa ACK")
+        return self
+
+    def backlog(self) -> int:
+        return self._queue.qsize()
+
+    def _dispatch_loop(self, callback: Callable):
+        while True:
+            message = self._queue.get()
+            # Đủ max_messages tin nhắn chưa ACK thì dừng giao thêm (áp lực ngược như FlowControl)
+            self._in_flight.acquire()
+            self._executor.submit(self._run_callback, callback, message)
+
+    @staticmethod
+    def _run_callback(callback: Callable, message: MemoryMessage):
+        try:
+            callback(message)
+        except Exception as e:
+            logger.error(f"Lỗi trong callback của hàng đợi bộ nhớ: {e}")
+
+    def _release(self):
+        self._in_flight.release()
+
+    def _redeliver(self, message: MemoryMessage):
+        self.redelivered += 1
+        retry = MemoryMessage(self, message.message_id, message.data, message.attributes)
+        retry.delivery_attempt = message.delivery_attempt + 1
+        self._queue.put(retry)
@@ -0,0 +1,402 @@
+"""
+Benchmark đầu-cuối cho luồng camera -> MinIO -> hàng đợi -> YOLO -> Postgres.
+
+Chạy CameraService (camera-ingest) và callback/pipeline của image-process trong cùng một tiến trình,
+với các thành phần thay thế chạy cục bộ:
+  - máy chủ camera giả phát lại ảnh mẫu trong AnalysisWorker/predicts/
+  - hàng đợi trong bộ nhớ (--queue memory) hoặc Pub/Sub emulator (--queue emulator, cần PUBSUB_EMULATOR_HOST)
+  - MinIO và Postgres cục bộ (xem benchmark-compose.yml)
+Mỗi số camera trong --cameras được chạy --duration giây; in phân vị độ trễ từng công đoạn và throughput ổn định.
+
+    python run.py --cameras 20 100 200 --duration 60 --poll-interval 5 [--json ket_qua.json]
+
+Các biến cấu hình của hai dịch vụ (YOLO_BATCH_SIZE, PIPELINE_*, DB_BATCH_SIZE, PUBLISH_ENCODING, ...) đọc từ
+môi trường như khi chạy thật. Dữ liệu của camera benchmark (camera_id bắt đầu bằng 'bench') bị xoá khi kết thúc
+trừ khi có --keep-rows.
+"""
+import argparse
+import asyncio
+import contextlib
+import contextvars
+import importlib.util
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+
+from fake_camera import FakeCameraServer, load_frames
+from frame_trace import FrameTrace, format_summary, summarize
+from memory_queue import MemoryQueue
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKER_DIR = os.path.dirname(BENCHMARK_DIR)
+INGEST_DIR = os.path.join(WORKER_DIR, 'camera-ingest')
+PROCESS_DIR = os.path.join(WORKER_DIR, 'image-process')
+MAINTENANCE_DIR = os.path.join(WORKER_DIR, 'db-maintenance')
+FRAMES_DIR = os.path.join(WORKER_DIR, 'predicts')
+
+# camera_id không được chứa '_' vì image-process tách camera_id từ tên object
+CAMERA_PREFIX = 'bench'
+BUCKET_NAME = 'images'
+EMULATOR_TOPIC = 'benchmark-frames'
+EMULATOR_SUBSCRIPTION = 'benchmark-frames-sub'
+
+# Các cấu hình của image-process được ghi kèm kết quả để so sánh giữa các lần chạy
+PROCESS_SETTINGS = (
+    'YOLO_BATCH_SIZE', 'YOLO_BATCH_WAIT_MS', 'PIPELINE_IO_WORKERS', 'PIPELINE_DECODE_WORKERS',
+    'PIPELINE_QUEUE_SIZE', 'DB_BATCH_SIZE', 'DB_FLUSH_INTERVAL_MS', 'ROLLUP_ENABLED',
+    'SUBSCRIBER_MAX_WORKERS', 'SUBSCRIBER_MAX_MESSAGES',
+)
+
+load_dotenv(os.path.join(BENCHMARK_DIR, '.env'))
+
+logger = logging.getLogger('benchmark')
+
+# Thời điểm bắt đầu pull của task hiện tại (mỗi lần pull một camera chạy trong task riêng)
+_pull_started = contextvars.ContextVar('pull_started', default=None)
+
+
+def load_service(directory: str, name: str):
+    """
+    Nạp main.py của một dịch vụ dưới tên `name`. Các dịch vụ đều có main.py (và trùng cả handoff.py)
+    nên module cùng thư mục được gỡ khỏi sys.modules sau khi nạp; trả về (module, {tên: module cùng thư mục}).
+    """
+    sys.path.insert(0, directory)
+    cwd = os.getcwd()
+    # YOLO("best.pt") và load_dotenv() tìm file theo thư mục hiện tại
+    os.chdir(directory)
+    try:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(directory, 'main.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(cwd)
+        sys.path.remove(directory)
+
+    siblings = {}
+    for module_name, loaded in list(sys.modules.items()):
+        path = getattr(loaded, '__file__', None)
+        if path and os.path.dirname(os.path.abspath(path)) == directory:
+            siblings[module_name] = sys.modules.pop(module_name)
+    return module, siblings
+
+
+class TracedMessage:
+    """Bọc tin nhắn để ghi thời điểm ACK của các ảnh trong đó."""
+
+    def __init__(self, message, keys: list, tracer: 'Tracer'):
+        self._message = message
+        self._keys = keys
+        self._tracer = tracer
+        self.message_id = message.message_id
+        self.data = message.data
+        self.attributes = message.attributes
+
+    def ack(self):
+        self._tracer.trace.mark_many(self._keys, 'acked')
+        self._message.ack()
+
+    def nack(self):
+        self._message.nack()
+
+
+class Tracer:
+    """Bọc các hàm của camera-ingest và image-process để ghi mốc thời gian của từng ảnh vào `trace`."""
+
+    def __init__(self, process):
+        self.process = process
+        self.trace = FrameTrace()
+
+    # --- camera-ingest ---
+    def instrument_ingest(self, service):
+        pull, upload, publish = service.pull_single_camera, service.upload_minio, service.publish_image_request
+
+        async def traced_pull(session, camera_id):
+            _pull_started.set(time.monotonic())
+            return await pull(session, camera_id)
+
+        async def traced_upload(image_data: bytes, image_name: str):
+            self.trace.mark(image_name, 'fetch_start', _pull_started.get())
+            self.trace.mark(image_name, 'fetched')
+            result = await upload(image_data, image_name)
+            self.trace.mark(image_name, 'uploaded')
+            return result
+
+        async def traced_publish(minio_key: str, camera_id: str):
+            message_id = await publish(minio_key, camera_id)
+            self.trace.mark(minio_key, 'published')
+            return message_id
+
+        service.pull_single_camera = traced_pull
+        service.upload_minio = traced_upload
+        service.publish_image_request = traced_publish
+
+    # --- image-process ---
+    def callback(self, message):
+        try:
+            _, keys = self.process.decode_message(message)
+        except Exception:
+            keys = []
+        self.trace.mark_many(keys, 'received')
+        self.process.callback(TracedMessage(message, keys, self))
+
+    def download(self, job):
+        self.trace.mark(job.key, 'download_start')
+        data = self.process.download_job(job)
+        self.trace.mark(job.key, 'downloaded')
+        return data
+
+    def decode(self, job):
+        self.trace.mark(job.key, 'decode_start')
+        image = self.process.decode_job(job)
+        self.trace.mark(job.key, 'decoded')
+        return image
+
+    def infer(self, jobs: list) -> list:
+        keys = [job.key for job in jobs]
+        self.trace.mark_many(keys, 'infer_start')
+        detections = self.process.infer_jobs(jobs)
+        self.trace.mark_many(keys, 'inferred')
+        return detections
+
+    def persist(self, job):
+        self.trace.mark(job.key, 'write_start')
+        self.process.persist_job(job)
+
+    def on_committed(self, batch: list, inserted_keys: set):
+        self.trace.mark_many([row.context.key for row in batch], 'committed')
+        self.process.on_batch_committed(batch, inserted_keys)
+
+
+def configure_environment(args, camera: FakeCameraServer):
+    """Cấu hình bắt buộc cho benchmark; các cấu hình hiệu năng khác giữ nguyên từ môi trường."""
+    os.environ.update({
+        'CAMERA_PORTAL_URL': camera.portal_url,
+        'CAMERA_IMAGE_URL': camera.image_url,
+        # Chu kỳ cố định: mỗi camera đưa vào đúng 1 ảnh mỗi --poll-interval giây
+        'POLL_INTERVAL': str(args.poll_interval),
+        'POLL_MIN_INTERVAL': str(args.poll_interval),
+        'POLL_MAX_INTERVAL': str(args.poll_interval),
+        'DEDUP_ENABLED': 'true' if args.dedup else 'false',
+        'HANDOFF_MODE': 'pubsub',
+        'PIPELINE_ENABLED': 'true',
+    })
+    if args.queue == 'emulator':
+        if not os.environ.get('PUBSUB_EMULATOR_HOST'):
+            raise SystemExit("--queue emulator cần PUBSUB_EMULATOR_HOST (ví dụ localhost:8085)")
+        os.environ['PUBSUB_TOPIC_ID'] = EMULATOR_TOPIC
+    else:
+        # Chỉ cần khác rỗng để camera-ingest không bỏ qua bước publish
+        os.environ['PUBSUB_TOPIC_ID'] = 'benchmark-memory'
+
+
+def memory_encoder(publisher_module, encoding: str):
+    """Tạo tin nhắn cùng định dạng ImagePublisher (mode=frame) để callback đi đúng nhánh giải mã."""
+
+    def encode(minio_key: str, payload: dict):
+        if encoding == 'compact':
+            return (
+                publisher_module.encode_compact(BUCKET_NAME, [minio_key]),
+                {'encoding': publisher_module.COMPACT_ENCODING},
+            )
+        return json.dumps(payload).encode('utf-8'), {}
+
+    return encode
+
+
+def subscribe_emulator(process, tracer: Tracer, project_id: str):
+    from google.api_core.exceptions import AlreadyExists
+    from google.cloud import pubsub_v1
+
+    publisher = pubsub_v1.PublisherClient()
+    subscriber = pubsub_v1.SubscriberClient()
+    topic_path = publisher.topic_path(project_id, EMULATOR_TOPIC)
+    subscription_path = subscriber.subscription_path(project_id, EMULATOR_SUBSCRIPTION)
+    with contextlib.suppress(AlreadyExists):
+        publisher.create_topic(name=topic_path)
+    with contextlib.suppress(AlreadyExists):
+        subscriber.create_subscription(name=subscription_path, topic=topic_path)
+
+    # Cùng thread pool và flow control như vòng lặp subscriber của image-process
+    scheduler = pubsub_v1.subscriber.scheduler.ThreadScheduler(
+        executor=ThreadPoolExecutor(max_workers=process.SUBSCRIBER_MAX_WORKERS)
+    )
+    return subscriber.subscribe(
+        subscription_path,
+        callback=tracer.callback,
+        flow_control=pubsub_v1.types.FlowControl(max_messages=process.SUBSCRIBER_MAX_MESSAGES),
+        scheduler=scheduler,
+    )
+
+
+def start_process_side(process, tracer: Tracer):
+    """Dựng DetectionWriter + ImagePipeline giống khối __main__ của image-process, với các hàm đã bọc."""
+    if not process.minio_client.bucket_exists(BUCKET_NAME):
+        process.minio_client.make_bucket(BUCKET_NAME)
+
+    process.db_pool = process.initialize_database(process.connection_string)
+
+    # Đưa schema về đúng bản production (bảng phân vùng + rollup) trước khi ghi
+    maintenance, _ = load_service(MAINTENANCE_DIR, 'db_maintenance_main')
+    maintenance.run_once()
+
+    process.writer = process.DetectionWriter(
+        process.db_pool,
+        on_committed=tracer.on_committed,
+        on_failed=process.on_batch_failed,
+        batch_size=process.DB_BATCH_SIZE,
+        flush_interval_ms=process.DB_FLUSH_INTERVAL_MS,
+        rollup=process.ROLLUP_ENABLED,
+    ).start()
+    process.pipeline = process.ImagePipeline(
+        download=tracer.download,
+        decode=tracer.decode,
+        infer=tracer.infer,
+        persist=tracer.persist,
+        io_workers=process.PIPELINE_IO_WORKERS,
+        decode_workers=process.PIPELINE_DECODE_WORKERS,
+        batch_size=process.YOLO_BATCH_SIZE,
+        batch_wait_ms=process.YOLO_BATCH_WAIT_MS,
+        queue_size=process.PIPELINE_QUEUE_SIZE,
+        metrics_interval=process.PIPELINE_METRICS_INTERVAL,
+    ).start()
+
+
+async def run_ingest(ingest, camera_list: list, publisher, tracer: Tracer, duration: float):
+    """Chạy CameraService trong `duration` giây; trả về (thời điểm bắt đầu, thời điểm dừng)."""
+    service = ingest.CameraService(camera_list=camera_list, publisher=publisher)
+    tracer.instrument_ingest(service)
+
+    started = time.monotonic()
+    task = asyncio.create_task(service.pull_real_image())
+    await asyncio.sleep(duration)
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+    return started, time.monotonic()
+
+
+def wait_for_drain(tracer: Tracer, timeout: float):
+    """Chờ các ảnh đã publish được xử lý hết (hoặc hết thời gian chờ)."""
+    deadline = time.monotonic() + timeout
+    while tracer.trace.pending() and time.monotonic() < deadline:
+        time.sleep(0.5)
+
+
+def count_rows(process, keys: list) -> int:
+    with process.db_pool.connection() as conn:
+        return conn.execute(
+            "SELECT count(*) FROM camera_detections WHERE minio_key = ANY(%s)", (keys,)
+        ).fetchone()[0]
+
+
+def cleanup(process):
+    pattern = f'{CAMERA_PREFIX}%'
+    with process.db_pool.connection() as conn:
+        conn.execute("DELETE FROM camera_detections WHERE camera_id LIKE %s", (pattern,))
+        if conn.execute("SELECT to_regclass('camera_detection_buckets')").fetchone()[0]:
+            conn.execute("DELETE FROM camera_detection_buckets WHERE camera_id LIKE %s", (pattern,))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cameras', type=int, nargs='+', default=[20], help='số camera của từng lần chạy')
+    parser.add_argument('--duration', type=float, default=60, help='số giây pull ảnh của mỗi lần chạy')
+    parser.add_argument('--warmup', type=float, default=10, help='số giây đầu không tính vào throughput')
+    parser.add_argument('--poll-interval', type=float, default=5, help='chu kỳ pull của mỗi camera (giây, >= 1)')
+    parser.add_argument('--queue', choices=('memory', 'emulator'), default='memory')
+    parser.add_argument('--camera-latency-ms', type=float, default=0, help='độ trễ giả lập của máy chủ camera')
+    parser.add_argument('--frames-dir', default=FRAMES_DIR)
+    parser.add_argument('--drain-timeout', type=float, default=60, help='số giây chờ xử lý hết ảnh sau mỗi lần chạy')
+    parser.add_argument('--dedup', action='store_true', help='bật lọc ảnh trùng của camera-ingest')
+    parser.add_argument('--keep-rows', action='store_true', help='giữ lại dữ liệu benchmark trong CSDL')
+    parser.add_argument('--json', help='ghi kết quả ra file JSON')
+    parser.add_argument('--verbose', action='store_true', help='giữ log INFO của các dịch vụ')
+    args = parser.parse_args()
+    if args.poll_interval < 1:
+        # Tên object chỉ phân giải tới giây: hai ảnh của một camera trong cùng giây sẽ trùng key
+        parser.error('--poll-interval phải >= 1 giây')
+    return args
+
+
+def main():
+    args = parse_args()
+    camera = FakeCameraServer(load_frames(args.frames_dir), latency_ms=args.camera_latency_ms).start()
+    configure_environment(args, camera)
+
+    # camera-ingest dùng URL S3 (http://host:port), client minio của image-process dùng host:port
+    minio_url = os.environ.get('MINIO_ENDPOINT', 'http://localhost:9000')
+    if '://' not in minio_url:
+        minio_url = f'http://{minio_url}'
+    os.environ['MINIO_ENDPOINT'] = minio_url
+    ingest, ingest_modules = load_service(INGEST_DIR, 'camera_ingest_main')
+    os.environ['MINIO_ENDPOINT'] = urlparse(minio_url).netloc
+    process, _ = load_service(PROCESS_DIR, 'image_process_main')
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    tracer = Tracer(process)
+    start_process_side(process, tracer)
+
+    if args.queue == 'memory':
+        publisher = MemoryQueue(memory_encoder(ingest_modules['publisher'], ingest.PUBLISH_ENCODING))
+        publisher.subscribe(tracer.callback, process.SUBSCRIBER_MAX_WORKERS, process.SUBSCRIBER_MAX_MESSAGES)
+    else:
+        # None: CameraService tự tạo ImagePublisher, client tự kết nối emulator qua PUBSUB_EMULATOR_HOST
+        publisher = None
+        subscribe_emulator(process, tracer, ingest.PUBSUB_PROJECT_ID)
+
+    results = []
+    try:
+        for camera_count in args.cameras:
+            tracer.trace = FrameTrace()
+            camera_list = [f'{CAMERA_PREFIX}{i:05d}' for i in range(camera_count)]
+            logger.info(f"▶️ {camera_count} camera, {args.duration:.0f}s, chu kỳ {args.poll_interval:.0f}s ({args.queue})")
+
+            started, stopped = asyncio.run(run_ingest(ingest, camera_list, publisher, tracer, args.duration))
+            wait_for_drain(tracer, args.drain_timeout)
+
+            summary = summarize(tracer.trace, started, stopped, args.warmup)
+            committed = [key for key, events in tracer.trace.frames().items() if 'committed' in events]
+            summary['cameras'] = camera_count
+            summary['rows_in_db'] = count_rows(process, committed)
+            print(format_summary(camera_count, summary))
+            print(f"Dòng trong camera_detections: {summary['rows_in_db']}/{len(committed)} ảnh đã commit\n")
+            results.append(summary)
+    finally:
+        if not args.keep_rows:
+            cleanup(process)
+        camera.stop()
+
+    print(f"{'camera':>8} {'đưa vào/s':>10} {'xử lý/s':>10} {'e2e p50 (ms)':>14} {'e2e p99 (ms)':>14}")
+    for summary in results:
+        end_to_end = summary['stages'].get('end_to_end', {})
+        print(
+            f"{summary['cameras']:>8} {summary['offered_fps']:>10.2f} {summary['throughput_fps']:>10.2f} "
+            f"{end_to_end.get('p50', float('nan')):>14.1f} {end_to_end.get('p99', float('nan')):>14.1f}"
+        )
+
+    if args.json:
+        settings = {name: getattr(process, name) for name in PROCESS_SETTINGS}
+        settings.update(
+            queue=args.queue,
+            poll_interval=args.poll_interval,
+            duration=args.duration,
+            warmup=args.warmup,
+            publish_encoding=ingest.PUBLISH_ENCODING,
+            concurrency_limit=ingest.CONCURRENCY_LIMIT,
+        )
+        with open(args.json, 'w') as f:
+            json.dump({'settings': settings, 'results': results}, f, indent=2)
+        logger.info(f"Đã ghi kết quả vào {args.json}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,171 @@
+import argparse
+import hashlib
+import io
+import logging
+import os
+import threading
+from collections import Counter, defaultdict, deque
+from typing import NamedTuple, Optional
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Kích thước ảnh xám dùng cho dHash: 9x8 -> 64 bit
+DHASH_SIZE = 8
+
+
+class FrameFingerprint(NamedTuple):
+    sha1: str
+    dhash: Optional[int]
+
+
+def dhash(image_data: bytes) -> Optional[int]:
+    """Perceptual hash (dHash 64 bit) của ảnh JPEG; None nếu không giải mã được."""
+    try:
+        image = Image.open(io.BytesIO(image_data))
+        # draft() cho phép giải mã JPEG ở độ phân giải thấp (DCT scaling), rẻ hơn nhiều so với giải mã đầy đủ
+        image.draft('L', (DHASH_SIZE * 8, DHASH_SIZE * 8))
+        small = image.convert('L').resize((DHASH_SIZE + 1, DHASH_SIZE), Image.BILINEAR)
+    except Exception as err:
+        logger.warning(f'Không tính được perceptual hash: {err}')
+        return None
+
+    pixels = small.tobytes()
+    width = DHASH_SIZE + 1
+    value = 0
+    for row in range(DHASH_SIZE):
+        offset = row * width
+        for col in range(DHASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+class FrameDeduplicator:
+    """
+    Nhớ vài ảnh gần nhất của mỗi camera (SHA-1 + dHash) để bỏ các ảnh trùng hoặc gần trùng
+    trước khi upload/publish, vì endpoint camera thường trả lại đúng ảnh cũ ở các lần poll liên tiếp.
+
+    Mặc định chỉ bỏ ảnh trùng hoàn toàn (SHA-1). dHash 9x8 của cả khung hình bị nền đường tĩnh chi phối nên
+    ảnh có xe đã di chuyển vẫn có thể chỉ lệch vài bit: chỉ bật so gần trùng (`max_distance` >= 0) với
+    ngưỡng đã hiệu chuẩn cho camera bằng `python dedupe.py calibrate <thư mục ảnh>`.
+    check() chạy trong luồng riêng (asyncio.to_thread) nên trạng thái dùng chung được giữ bằng khoá.
+    """
+
+    def __init__(self, history: int = 3, max_distance: int = -1):
+        self.history = max(1, history)
+        self.max_distance = max_distance
+        self._recent = {}
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def check(self, camera_id: str, image_data: bytes):
+        """
+        Trả về (kind, fingerprint): kind là 'exact', 'near' hoặc None nếu là ảnh mới.
+        Chỉ tính dHash khi SHA-1 không trùng và so gần trùng đang bật.
+        """
+        with self._lock:
+            self.counters['checked'] += 1
+            recent = tuple(self._recent.get(camera_id, ()))
+
+        sha1 = hashlib.sha1(image_data).hexdigest()
+        if any(seen.sha1 == sha1 for seen in recent):
+            self._skipped('exact', len(image_data))
+            return 'exact', FrameFingerprint(sha1, None)
+
+        if self.max_distance < 0:
+            return None, FrameFingerprint(sha1, None)
+
+        fingerprint = FrameFingerprint(sha1, dhash(image_data))
+        if fingerprint.dhash is not None:
+            for seen in recent:
+                if seen.dhash is not None and (seen.dhash ^ fingerprint.dhash).bit_count() <= self.max_distance:
+                    self._skipped('near', len(image_data))
+                    return 'near', fingerprint
+
+        return None, fingerprint
+
+    def remember(self, camera_id: str, fingerprint: FrameFingerprint):
+        """Ghi nhớ ảnh sau khi đã upload/publish thành công."""
+        with self._lock:
+            recent = self._recent.get(camera_id)
+            if recent is None:
+                recent = self._recent[camera_id] = deque(maxlen=self.history)
+            recent.append(fingerprint)
+
+    def _skipped(self, kind: str, size: int):
+        with self._lock:
+            self.counters[f'skipped_{kind}'] += 1
+            self.counters['skipped_bytes'] += size
+
+    def stats(self) -> dict:
+        with self._lock:
+            checked = self.counters['checked']
+            skipped = self.counters['skipped_exact'] + self.counters['skipped_near']
+            return {
+                'checked': checked,
+                'skipped_exact': self.counters['skipped_exact'],
+                'skipped_near': self.counters['skipped_near'],
+                'skipped_bytes': self.counters['skipped_bytes'],
+                'skip_ratio': skipped / checked if checked else 0.0,
+            }
+
+
+def _camera_frames(directory: str) -> dict:
+    """{camera_id: [đường dẫn, ...]} theo thứ tự thời gian, từ tên file image_{camera_id}_{YYYYmmdd}_{HHMMSS}.jpeg."""
+    frames = defaultdict(list)
+    for name in sorted(os.listdir(directory)):
+        stem, ext = os.path.splitext(name)
+        if not stem.startswith('image_') or ext.lower() not in ('.jpeg', '.jpg'):
+            continue
+        camera_id = stem[len('image_'):].rsplit('_', 2)[0]
+        frames[camera_id].append(os.path.join(directory, name))
+    return frames
+
+
+def _command_calibrate(args):
+    """In phân bố khoảng cách dHash giữa các ảnh liên tiếp (khác SHA-1) của từng camera để chọn DEDUP_MAX_DISTANCE."""
+    frames = _camera_frames(args.frames)
+    if not frames:
+        raise SystemExit(f"Không có ảnh image_<camera>_<timestamp>.jpeg nào trong {args.frames}")
+
+    histogram = Counter()
+    print(f"{'camera':<26} {'cặp ảnh':>8} {'min':>5} {'p10':>5} {'p50':>5}")
+    for camera_id, paths in frames.items():
+        distances, previous = [], None
+        for path in paths:
+            with open(path, 'rb') as f:
+                data = f.read()
+            current = FrameFingerprint(hashlib.sha1(data).hexdigest(), dhash(data))
+            if previous and previous.sha1 != current.sha1 and None not in (previous.dhash, current.dhash):
+                distances.append((previous.dhash ^ current.dhash).bit_count())
+            previous = current
+        if not distances:
+            continue
+        distances.sort()
+        histogram.update(distances)
+        print(f"{camera_id:<26} {len(distances):>8} {distances[0]:>5} "
+              f"{distances[len(distances) // 10]:>5} {distances[len(distances) // 2]:>5}")
+
+    print("khoảng cách  số cặp")
+    for distance in sorted(histogram):
+        print(f"{distance:>11}  {histogram[distance]}")
+    print("Xem lại ảnh ở các khoảng cách nhỏ: DEDUP_MAX_DISTANCE phải nhỏ hơn khoảng cách của cặp ảnh "
+          "nhỏ nhất mà xe đã di chuyển.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Công cụ lọc ảnh trùng của camera-ingest')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    calibrate = commands.add_parser('calibrate', help='phân bố khoảng cách dHash giữa các ảnh liên tiếp')
+    calibrate.add_argument('frames', help='thư mục ảnh camera-ingest đã tải (image_<camera>_<timestamp>.jpeg)')
+    calibrate.set_defaults(handler=_command_calibrate)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,56 @@
+import asyncio
+import json
+import logging
+import struct
+
+logger = logging.getLogger(__name__)
+
+# Khung dữ liệu: [độ dài header (4 byte)][độ dài ảnh (4 byte)][header JSON][bytes ảnh]
+FRAME_PREFIX = struct.Struct('!II')
+
+
+class FrameHandoffClient:
+    """
+    Gửi ảnh thẳng tới image-process chạy cùng máy qua Unix domain socket,
+    bỏ qua vòng MinIO PUT -> Pub/Sub -> MinIO GET -> MinIO DELETE.
+    """
+
+    def __init__(self, socket_path: str, connect_timeout: float = 5):
+        self.socket_path = socket_path
+        self.connect_timeout = connect_timeout
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self):
+        _, self._writer = await asyncio.wait_for(
+            asyncio.open_unix_connection(self.socket_path),
+            timeout=self.connect_timeout,
+        )
+        logger.info(f"Đã kết nối tới image-process qua socket {self.socket_path}")
+
+    async def send(self, image: bytes, header: dict):
+        """Gửi một ảnh; hàng đợi phía image-process đầy thì drain() sẽ chờ (áp lực ngược)."""
+        header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+
+        # Một lock để các khung của nhiều camera không bị ghi xen kẽ vào nhau
+        async with self._lock:
+            if self._writer is None or self._writer.is_closing():
+                await self._connect()
+            try:
+                self._writer.write(FRAME_PREFIX.pack(len(header_bytes), len(image)))
+                self._writer.write(header_bytes)
+                self._writer.write(image)
+                await self._writer.drain()
+            except Exception:
+                # Kết nối hỏng: đóng lại để lần gửi sau tự kết nối lại
+                await self.close()
+                raise
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+            self._writer = None
@@ -1,14 +1,18 @@
 import asyncio
 import os
+import sys
 from datetime import datetime, UTC
-import json
 import logging
-import io
 import aiohttp
-import boto3
-from botocore.exceptions import ClientError
-from google.cloud import pubsub_v1
 from dotenv import load_dotenv
+# Module dùng chung AnalysisWorker/shared (trong Docker đã được COPY cạnh main.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+from metrics import register_snapshot, start_metrics_server, timed
+from handoff import FrameHandoffClient
+from scheduler import PollingScheduler, FRAME_ERROR, FRAME_NEW, FRAME_UNCHANGED
+from dedupe import FrameDeduplicator
+from publisher import ImagePublisher
+from s3_async import AsyncS3Client
 
 # Tải biến môi trường
 load_dotenv()
@@ -41,63 +45,147 @@ SECRET_KEY = os.getenv('MINIO_SECRET_KEY')
 AWS_REGION = 'us-east-1'
 BUCKET_NAME = 'images'
 ENDPOINT_URL = os.getenv('MINIO_ENDPOINT')
+S3_MAX_ATTEMPTS = int(os.getenv('S3_MAX_ATTEMPTS', 3))
+S3_MULTIPART_THRESHOLD_MB = int(os.getenv('S3_MULTIPART_THRESHOLD_MB', 16))
 
 PUBSUB_TOPIC_ID = os.getenv('PUBSUB_TOPIC_ID')
-CONCURRENCY_LIMIT = 20
+PUBSUB_PROJECT_ID = os.getenv('PUBSUB_PROJECT_ID', 'message-queue-479804')
+
+# Cấu hình publish: PUBLISH_MODE=frame (mỗi ảnh một tin nhắn) | round (gộp ảnh trong PUBLISH_ROUND_WINDOW giây)
+PUBLISH_MODE = os.getenv('PUBLISH_MODE', 'frame').lower()
+# PUBLISH_ENCODING=json (payload cũ) | compact (JSON rút gọn nén zlib)
+PUBLISH_ENCODING = os.getenv('PUBLISH_ENCODING', 'json').lower()
+PUBLISH_ORDERING = os.getenv('PUBLISH_ORDERING', 'false').lower() == 'true'
+PUBLISH_BATCH_MAX_MESSAGES = int(os.getenv('PUBLISH_BATCH_MAX_MESSAGES', 100))
+PUBLISH_BATCH_MAX_LATENCY = float(os.getenv('PUBLISH_BATCH_MAX_LATENCY', 0.05))
+PUBLISH_MAX_OUTSTANDING = int(os.getenv('PUBLISH_MAX_OUTSTANDING', 1000))
+PUBLISH_ROUND_WINDOW = float(os.getenv('PUBLISH_ROUND_WINDOW', 2))
+CONCURRENCY_LIMIT = int(os.getenv('CONCURRENCY_LIMIT', 20))
+
+# Nguồn ảnh camera (benchmark trỏ sang máy chủ camera giả)
+CAMERA_PORTAL_URL = os.getenv('CAMERA_PORTAL_URL', 'https://giaothong.hochiminhcity.gov.vn/')
+CAMERA_IMAGE_URL = os.getenv(
+    'CAMERA_IMAGE_URL',
+    'https://giaothong.hochiminhcity.gov.vn:8007/Render/CameraHandler.ashx?id={camera_id}'
+)
+
+# Lịch pull riêng từng camera: chu kỳ tự co giãn trong [POLL_MIN_INTERVAL, POLL_MAX_INTERVAL]
+POLL_INTERVAL = float(os.getenv('POLL_INTERVAL', 10))
+POLL_MIN_INTERVAL = float(os.getenv('POLL_MIN_INTERVAL', 5))
+POLL_MAX_INTERVAL = float(os.getenv('POLL_MAX_INTERVAL', 60))
+POLL_MAX_BACKOFF = float(os.getenv('POLL_MAX_BACKOFF', 300))
+FETCH_DEADLINE = float(os.getenv('FETCH_DEADLINE', 20))
+
+# Bỏ ảnh trùng trước khi upload (so với DEDUP_HISTORY ảnh gần nhất của mỗi camera). Mặc định chỉ bỏ ảnh trùng
+# hoàn toàn (SHA-1); so gần trùng bằng dHash bật khi DEDUP_MAX_DISTANCE >= 0, với ngưỡng hiệu chuẩn bằng
+# `python dedupe.py calibrate <thư mục ảnh>` (ngưỡng quá cao bỏ cả ảnh xe đã di chuyển)
+DEDUP_ENABLED = os.getenv('DEDUP_ENABLED', 'true').lower() == 'true'
+DEDUP_HISTORY = int(os.getenv('DEDUP_HISTORY', 3))
+DEDUP_MAX_DISTANCE = int(os.getenv('DEDUP_MAX_DISTANCE', -1))
+DEDUP_REPORT_EVERY = 100
+
+# Chế độ chuyển ảnh: 'pubsub' (MinIO + Pub/Sub) hoặc 'local' (gửi thẳng cho image-process cùng máy)
+HANDOFF_MODE = os.getenv('HANDOFF_MODE', 'pubsub').lower()
+HANDOFF_SOCKET_PATH = os.getenv('HANDOFF_SOCKET_PATH', '/run/datapolisx/frames.sock')
+# Ở chế độ 'local', có lưu bản sao ảnh lên MinIO (chạy nền, không chặn luồng chính) hay không
+ARCHIVE_TO_MINIO = os.getenv('ARCHIVE_TO_MINIO', 'false').lower() == 'true'
+
+# Endpoint Prometheus (/metrics); 0 để tắt
+METRICS_PORT = int(os.getenv('METRICS_PORT', 8001))
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class CameraService:
-    def __init__(self):
-        self.s3_client = boto3.client(
-            's3',
-            endpoint_url=ENDPOINT_URL, # Rất quan trọng khi dùng MinIO
-            region_name=AWS_REGION,
-            aws_access_key_id=ACCESS_KEY,
-            aws_secret_access_key=SECRET_KEY
+    def __init__(self, camera_list: list = None, publisher=None):
+        self.camera_list = camera_list or CAMERA_LIST
+
+        # Client S3 bất đồng bộ: pool kết nối bằng CONCURRENCY_LIMIT để khớp với semaphore
+        self.s3_client = AsyncS3Client(
+            ENDPOINT_URL, # Rất quan trọng khi dùng MinIO
+            ACCESS_KEY,
+            SECRET_KEY,
+            region=AWS_REGION,
+            pool_size=CONCURRENCY_LIMIT,
+            max_attempts=S3_MAX_ATTEMPTS,
+            multipart_threshold=S3_MULTIPART_THRESHOLD_MB * 1024 * 1024,
         )
 
-        self.pubsub_publisher = pubsub_v1.PublisherClient()
-        self.topic_path = self.pubsub_publisher.topic_path(
-            'message-queue-479804',
-            PUBSUB_TOPIC_ID
+        # publisher có thể truyền vào (ví dụ hàng đợi trong bộ nhớ của benchmark), mặc định là Pub/Sub
+        self.publisher = publisher or ImagePublisher(
+            PUBSUB_PROJECT_ID,
+            PUBSUB_TOPIC_ID,
+            BUCKET_NAME,
+            mode=PUBLISH_MODE,
+            encoding=PUBLISH_ENCODING,
+            ordering=PUBLISH_ORDERING,
+            max_messages=PUBLISH_BATCH_MAX_MESSAGES,
+            max_latency=PUBLISH_BATCH_MAX_LATENCY,
+            max_outstanding=PUBLISH_MAX_OUTSTANDING,
+            round_window=PUBLISH_ROUND_WINDOW,
         )
 
         # Semaphore để giới hạn tác vụ chạy song song (thay thế p-limit)
         self.semaphore = asyncio.Semaphore(CONCURRENCY_LIMIT)
 
+        self.deduplicator = FrameDeduplicator(DEDUP_HISTORY, DEDUP_MAX_DISTANCE) if DEDUP_ENABLED else None
+
+        self.handoff = FrameHandoffClient(HANDOFF_SOCKET_PATH) if HANDOFF_MODE == 'local' else None
+        # Giữ tham chiếu tới các task lưu trữ nền để không bị garbage collect giữa chừng
+        self.background_tasks = set()
+
     def get_current_timestamp_string(self) -> str:
         return datetime.now().strftime('%Y%m%d_%H%M%S')
 
     async def init_cookie(self, session: aiohttp.ClientSession):
         try:
             # Sử dụng aiohttp để tự động quản lý cookie (cookiejar)
-            async with session.get('https://giaothong.hochiminhcity.gov.vn/',
+            async with session.get(CAMERA_PORTAL_URL,
                                    headers={'User-Agent': 'Mozilla/5.0'}) as response:
                 response.raise_for_status()
             logger.info('Đã lấy cookie thành công')
         except Exception as err:
             logger.error(f'Lỗi lấy cookie: {err}')
 
-    async def publish_image_request(self, minio_key: str, camera_id: str) -> str:
-        """Tương đương với publishImageRequest()"""
-        if not PUBSUB_TOPIC_ID:
-            logger.warning(f"[{camera_id}] PUBSUB_TOPIC_ID không được thiết lập. Bỏ qua Pub/Sub.")
-            return "NO_TOPIC"
-
-        payload = {
+    def build_image_payload(self, minio_key: str, camera_id: str) -> dict:
+        return {
             'minio_bucket': BUCKET_NAME,
             'minio_key': minio_key,
             'camera_id': camera_id,
             'timestamp_utc': datetime.now(UTC).isoformat(),
         }
 
-        data_buffer = json.dumps(payload).encode('utf-8')
+    async def handoff_local(self, image: bytes, image_name: str, camera_id: str):
+        """Gửi ảnh thẳng cho image-process; lỗi socket thì quay về MinIO + Pub/Sub."""
+        try:
+            await self.handoff.send(image, self.build_image_payload(image_name, camera_id))
+        except Exception as err:
+            logger.error(f'[{camera_id}] Lỗi gửi ảnh qua socket, chuyển sang MinIO + Pub/Sub: {err}')
+            await self.upload_minio(image, image_name)
+            await self.publish_image_request(image_name, camera_id)
+            return
+
+        if ARCHIVE_TO_MINIO:
+            task = asyncio.create_task(self.upload_minio(image, image_name))
+            self.background_tasks.add(task)
+            task.add_done_callback(self._archive_done)
+
+    def _archive_done(self, task: asyncio.Task):
+        self.background_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f'Lưu trữ MinIO nền thất bại: {task.exception()}')
+
+    @timed('publish')
+    async def publish_image_request(self, minio_key: str, camera_id: str) -> str:
+        """Tương đương với publishImageRequest()"""
+        if not PUBSUB_TOPIC_ID:
+            logger.warning(f"[{camera_id}] PUBSUB_TOPIC_ID không được thiết lập. Bỏ qua Pub/Sub.")
+            return "NO_TOPIC"
+
+        payload = self.build_image_payload(minio_key, camera_id)
 
         try:
-            message_future = self.pubsub_publisher.publish(self.topic_path, data_buffer)
-            message_id = await asyncio.wrap_future(message_future)
+            message_id = await self.publisher.publish(minio_key, camera_id, payload)
 
             logger.info(f'[{camera_id}] Pub/Sub OK. Message ID: {message_id}')
             return message_id
@@ -105,20 +193,12 @@ class CameraService:
             logger.error(f'[{camera_id}] Lỗi khi Publish Pub/Sub: {error}')
             raise
 
-    def upload_minio(self, image_data: bytes, image_name: str):
-        """Tương đương với uploadMinio() (Đồng bộ)"""
+    @timed('upload')
+    async def upload_minio(self, image_data: bytes, image_name: str):
+        """Tương đương với uploadMinio() (Bất đồng bộ, chạy trên event loop)"""
         try:
-            # Thao tác tải lên
-            image_stream = io.BytesIO(image_data)
-
-            # SỬ DỤNG put_object VỚI stream và ContentLength
-            self.s3_client.put_object(
-                Bucket=BUCKET_NAME,
-                Key=image_name,
-                Body=image_stream,
-                ContentLength=len(image_data),
-                ContentType='image/jpeg',
-            )
+            # Thao tác tải lên (tự retry, ảnh lớn sẽ được chia multipart)
+            await self.s3_client.put_object(BUCKET_NAME, image_name, image_data, content_type='image/jpeg')
             logger.info(f"Thành công tải file {image_name} lên minio")
             return True
 
@@ -126,18 +206,35 @@ class CameraService:
             logger.error(f"❌ Lỗi khi tải file {image_name}: {e}")
             raise
 
-    async def pull_single_camera(self, session: aiohttp.ClientSession, camera_id: str) -> bool:
+    def check_duplicate(self, camera_id: str, image: bytes):
+        """
+        Trả về (kind, fingerprint); kind khác None nghĩa là ảnh trùng và nên bỏ qua.
+        Băm SHA-1/giải mã dHash tốn CPU: gọi qua asyncio.to_thread để không chặn event loop.
+        """
+        kind, fingerprint = self.deduplicator.check(camera_id, image)
+
+        stats = self.deduplicator.stats()
+        if stats['checked'] % DEDUP_REPORT_EVERY == 0:
+            logger.info(
+                f"Lọc ảnh trùng: đã kiểm tra {stats['checked']}, bỏ {stats['skipped_exact']} trùng hoàn toàn + "
+                f"{stats['skipped_near']} gần trùng ({stats['skip_ratio']:.0%}, {stats['skipped_bytes'] / 1e6:.1f} MB)"
+            )
+        return kind, fingerprint
+
+    # outcome: new / unchanged / error (giá trị trả về cho PollingScheduler)
+    @timed('pull', outcome=lambda result: result)
+    async def pull_single_camera(self, session: aiohttp.ClientSession, camera_id: str) -> str:
         """Tương đương với pullSingleCamera() (Sử dụng Semaphore để giới hạn song song)"""
         # Sử dụng semaphore để giới hạn số lượng tác vụ chạy đồng thời
         async with self.semaphore:
-            url = f'https://giaothong.hochiminhcity.gov.vn:8007/Render/CameraHandler.ashx?id={camera_id}'
+            url = CAMERA_IMAGE_URL.format(camera_id=camera_id)
 
             try:
                 async with session.get(
                         url,
                         headers={
                             'User-Agent': 'Mozilla/5.0',
-                            'Referer': 'https://giaothong.hochiminhcity.gov.vn/',
+                            'Referer': CAMERA_PORTAL_URL,
                         },
                         timeout=30  # 30 giây
                 ) as response:
@@ -147,64 +244,67 @@ class CameraService:
                         image = await response.read()
                         byte_length = len(image)
 
+                        fingerprint = None
+                        if self.deduplicator:
+                            duplicate, fingerprint = await asyncio.to_thread(self.check_duplicate, camera_id, image)
+                            if duplicate:
+                                logger.info(f'[{camera_id}] Ảnh {"trùng" if duplicate == "exact" else "gần trùng"} với lần trước, bỏ qua.')
+                                return FRAME_UNCHANGED
+
                         timestamp = self.get_current_timestamp_string()
                         image_name = f'image_{camera_id}_{timestamp}.jpeg'
 
-                        await asyncio.to_thread(self.upload_minio, image, image_name)
+                        if self.handoff:
+                            await self.handoff_local(image, image_name, camera_id)
+                        else:
+                            await self.upload_minio(image, image_name)
+
+                            # Pub/Sub
+                            await self.publish_image_request(image_name, camera_id)
 
-                        # Pub/Sub
-                        await self.publish_image_request(image_name, camera_id)
+                        # Chỉ ghi nhớ sau khi đã gửi thành công, để ảnh lỗi giữa chừng vẫn được gửi lại
+                        if fingerprint:
+                            self.deduplicator.remember(camera_id, fingerprint)
 
                         logger.info(
                             f'[{camera_id}] Pull ảnh OK: {image_name} ({byte_length} bytes)'
                         )
-                        return True
+                        return FRAME_NEW
 
                     logger.warning(
                         f'[{camera_id}] Lỗi status {response.status} khi pull ảnh.'
                     )
-                    return False
+                    return FRAME_ERROR
 
             except Exception as err:
                 logger.error(f'[{camera_id}] Pull/Upload ERROR: {err}')
-                return False
+                return FRAME_ERROR
 
     async def pull_real_image(self):
         """Tương đương với pullRealImage() (Vòng lặp chính)"""
         # Sử dụng aiohttp.ClientSession để quản lý kết nối và cookie
-        async with aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True)) as session:
+        async with aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True)) as session, self.s3_client:
             # Đảm bảo cookie đã sẵn sàng trước khi bắt đầu vòng lặp
             await self.init_cookie(session)
 
-            while True:
-                start_time = datetime.now()
-
-                # Tạo mảng các TÁC VỤ không đồng bộ
-                # Mỗi task sẽ sử dụng self.pull_single_camera() và bị giới hạn bởi self.semaphore
-                tasks = [self.pull_single_camera(session, camera_id) for camera_id in CAMERA_LIST]
-
-                logger.info(
-                    f'Bắt đầu pull {len(CAMERA_LIST)} camera với giới hạn {CONCURRENCY_LIMIT} song song...'
-                )
-
-                # Chờ TẤT CẢ các tác vụ hoàn thành (tương đương Promise.allSettled)
-                results = await asyncio.gather(*tasks, return_exceptions=False)
-
-                # Đếm số lượng thành công (kết quả là True)
-                success_count = sum(1 for result in results if result is True)
-
-                end_time = datetime.now()
-                duration = (end_time - start_time).total_seconds()
-
-                logger.info(
-                    f'Hoàn thành chu kỳ pull. Tổng: {len(CAMERA_LIST)} cam, Thành công: {success_count}. Thời gian: {duration:.2f}s'
-                )
-
-                await asyncio.sleep(10)
+            # Mỗi camera có lịch riêng; số tác vụ chạy đồng thời vẫn bị giới hạn bởi self.semaphore
+            scheduler = PollingScheduler(
+                self.camera_list,
+                lambda camera_id: self.pull_single_camera(session, camera_id),
+                base_interval=POLL_INTERVAL,
+                min_interval=POLL_MIN_INTERVAL,
+                max_interval=POLL_MAX_INTERVAL,
+                max_backoff=POLL_MAX_BACKOFF,
+                deadline=FETCH_DEADLINE,
+            )
+            await scheduler.run()
 
 
 if __name__ == '__main__':
     service = CameraService()
+    start_metrics_server(METRICS_PORT)
+    if service.deduplicator:
+        register_snapshot('dedupe', service.deduplicator.stats)
     try:
         asyncio.run(service.pull_real_image())
     except KeyboardInterrupt:
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import time
+import zlib
+
+from google.cloud import pubsub_v1
+
+logger = logging.getLogger(__name__)
+
+# Định dạng gọn: JSON {"b": bucket, "k": [minio_key, ...]} nén zlib.
+# camera_id và thời điểm chụp đã nằm trong minio_key nên không gửi lặp lại.
+COMPACT_ENCODING = 'zlib+json'
+
+
+def encode_compact(bucket: str, keys: list) -> bytes:
+    return zlib.compress(json.dumps({'b': bucket, 'k': keys}, separators=(',', ':')).encode('utf-8'))
+
+
+class ImagePublisher:
+    """
+    Lớp publish Pub/Sub với batch settings và flow control tường minh.
+    - mode='frame': mỗi ảnh một tin nhắn (có thể gắn ordering key theo camera)
+    - mode='round': gom các ảnh trong `round_window` giây thành MỘT tin nhắn
+    - encoding='json' giữ payload cũ, 'compact' dùng payload nén (image-process đọc được cả hai)
+    Nếu đặt PUBSUB_EMULATOR_HOST, client sẽ tự kết nối tới Pub/Sub emulator.
+    """
+
+    def __init__(
+            self,
+            project_id: str,
+            topic_id: str,
+            bucket: str,
+            mode: str = 'frame',
+            encoding: str = 'json',
+            ordering: bool = False,
+            max_messages: int = 100,
+            max_bytes: int = 1024 * 1024,
+            max_latency: float = 0.05,
+            max_outstanding: int = 1000,
+            round_window: float = 2.0,
+            round_max_keys: int = 100,
+    ):
+        self.bucket = bucket
+        self.mode = mode
+        self.encoding = encoding
+        self.ordering = ordering and mode == 'frame'
+        self.round_window = round_window
+        self.round_max_keys = max(1, round_max_keys)
+
+        self.client = pubsub_v1.PublisherClient(
+            batch_settings=pubsub_v1.types.BatchSettings(
+                max_messages=max_messages,
+                max_bytes=max_bytes,
+                max_latency=max_latency,
+            ),
+            publisher_options=pubsub_v1.types.PublisherOptions(
+                enable_message_ordering=self.ordering,
+                flow_control=pubsub_v1.types.PublishFlowControl(
+                    message_limit=max_outstanding,
+                    byte_limit=max_outstanding * 4096,
+                    limit_exceeded_behavior=pubsub_v1.types.LimitExceededBehavior.BLOCK,
+                ),
+            ),
+        )
+        self.topic_path = self.client.topic_path(project_id, topic_id)
+
+        # Flow control phía asyncio: chờ ở đây thay vì để client chặn cả event loop
+        self._outstanding = asyncio.Semaphore(max_outstanding)
+
+        self._round_keys = []
+        self._round_waiters = []
+        self._round_task = None
+
+    async def publish(self, minio_key: str, camera_id: str, payload: dict) -> str:
+        """Publish một ảnh; ở chế độ 'round' chờ tới khi tin nhắn gộp của vòng đó được gửi."""
+        if self.mode == 'round':
+            return await self._add_to_round(minio_key)
+
+        if self.encoding == 'compact':
+            data, attributes = encode_compact(self.bucket, [minio_key]), {'encoding': COMPACT_ENCODING}
+        else:
+            data, attributes = json.dumps(payload).encode('utf-8'), {}
+
+        ordering_key = camera_id if self.ordering else ''
+        return await self._publish(data, attributes, ordering_key)
+
+    async def _publish(self, data: bytes, attributes: dict, ordering_key: str = '') -> str:
+        async with self._outstanding:
+            future = self.client.publish(self.topic_path, data, ordering_key=ordering_key, **attributes)
+            try:
+                return await asyncio.wrap_future(future)
+            except Exception:
+                if ordering_key:
+                    # Lỗi với ordering key sẽ chặn key đó cho tới khi resume
+                    self.client.resume_publish(self.topic_path, ordering_key)
+                raise
+
+    async def _add_to_round(self, minio_key: str) -> str:
+        waiter = asyncio.get_running_loop().create_future()
+        self._round_keys.append(minio_key)
+        self._round_waiters.append(waiter)
+
+        if len(self._round_keys) >= self.round_max_keys:
+            await self._flush_round()
+        elif self._round_task is None:
+            self._round_task = asyncio.create_task(self._flush_round_later())
+
+        return await waiter
+
+    async def _flush_round_later(self):
+        await asyncio.sleep(self.round_window)
+        self._round_task = None
+        await self._flush_round()
+
+    async def _flush_round(self):
+        if self._round_task is not None and self._round_task is not asyncio.current_task():
+            self._round_task.cancel()
+            self._round_task = None
+
+        keys, waiters = self._round_keys, self._round_waiters
+        self._round_keys, self._round_waiters = [], []
+        if not keys:
+            return
+
+        # Gửi trong task riêng: pull task gọi flush bị huỷ (FETCH_DEADLINE) không được kéo theo tin nhắn của cả vòng
+        await asyncio.shield(asyncio.create_task(self._send_round(keys, waiters)))
+
+    async def _send_round(self, keys: list, waiters: list):
+        if self.encoding == 'compact':
+            data, attributes = encode_compact(self.bucket, keys), {'encoding': COMPACT_ENCODING}
+        else:
+            data = json.dumps({'minio_bucket': self.bucket, 'minio_keys': keys}).encode('utf-8')
+            attributes = {}
+
+        started = time.monotonic()
+        try:
+            message_id = await self._publish(data, attributes)
+        except BaseException as error:
+            # Kể cả khi bị huỷ (dừng dịch vụ): mọi pull task đang chờ vòng này phải được trả lời
+            cancelled = isinstance(error, asyncio.CancelledError)
+            if not cancelled:
+                logger.error(f'Lỗi khi publish tin nhắn gộp {len(keys)} ảnh: {error}')
+            for waiter in waiters:
+                if not waiter.done():
+                    if cancelled:
+                        waiter.cancel()
+                    else:
+                        waiter.set_exception(error)
+            if cancelled or not isinstance(error, Exception):
+                raise
+            return
+
+        logger.info(
+            f'Pub/Sub OK: gộp {len(keys)} ảnh ({len(data)} bytes) trong một tin nhắn {message_id} '
+            f'({(time.monotonic() - started) * 1000:.0f}ms)'
+        )
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(message_id)
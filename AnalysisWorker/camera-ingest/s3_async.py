@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import logging
+import random
+import xml.etree.ElementTree as ET
+from urllib.parse import quote
+
+import aiohttp
+from botocore.auth import S3SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.credentials import Credentials
+
+logger = logging.getLogger(__name__)
+
+S3_NS = '{http://s3.amazonaws.com/doc/2006-03-01/}'
+# S3/MinIO yêu cầu mỗi part (trừ part cuối) tối thiểu 5 MB
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class S3RequestError(Exception):
+    def __init__(self, status: int, body: str):
+        super().__init__(f'HTTP {status}: {body[:200]}')
+        self.status = status
+
+
+class AsyncS3Client:
+    """
+    Client S3/MinIO bất đồng bộ dựa trên aiohttp, ký request SigV4 bằng botocore.
+    Upload chạy trực tiếp trên event loop (không chiếm thread của executor),
+    pool kết nối có kích thước bằng giới hạn song song, có retry và multipart cho ảnh lớn.
+    """
+
+    def __init__(
+            self,
+            endpoint_url: str,
+            access_key: str,
+            secret_key: str,
+            region: str = 'us-east-1',
+            pool_size: int = 20,
+            max_attempts: int = 3,
+            multipart_threshold: int = 16 * 1024 * 1024,
+            part_size: int = 8 * 1024 * 1024,
+            timeout: float = 30,
+    ):
+        self.endpoint_url = endpoint_url.rstrip('/')
+        self.credentials = Credentials(access_key, secret_key)
+        self.region = region
+        self.pool_size = pool_size
+        self.max_attempts = max(1, max_attempts)
+        self.multipart_threshold = max(multipart_threshold, MIN_PART_SIZE)
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.session = None
+
+    async def __aenter__(self):
+        # limit = pool_size: số kết nối tới MinIO khớp với số tác vụ upload chạy song song
+        connector = aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.pool_size)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+        self.session = None
+
+    def _url(self, bucket: str, key: str, query: str = '') -> str:
+        url = f'{self.endpoint_url}/{bucket}/{quote(key)}'
+        return f'{url}?{query}' if query else url
+
+    def _sign(self, method: str, url: str, body: bytes, headers: dict) -> dict:
+        headers = dict(headers)
+        headers['X-Amz-Content-SHA256'] = hashlib.sha256(body).hexdigest()
+        request = AWSRequest(method=method, url=url, data=body, headers=headers)
+        S3SigV4Auth(self.credentials, 's3', self.region).add_auth(request)
+        return dict(request.headers.items())
+
+    async def _request(self, method: str, url: str, body: bytes = b'', headers: dict = None):
+        """Gửi một request đã ký, thử lại khi lỗi mạng/timeout/5xx. Trả về (headers, body)."""
+        for attempt in range(1, self.max_attempts + 1):
+            # Ký lại ở mỗi lần thử vì chữ ký gắn với thời điểm gửi
+            signed = self._sign(method, url, body, headers or {})
+            try:
+                async with self.session.request(method, url, data=body, headers=signed) as response:
+                    text = await response.read()
+                    if response.status < 300:
+                        return response.headers, text
+                    error = S3RequestError(response.status, text.decode('utf-8', 'replace'))
+                    if response.status < 500 and response.status != 429:
+                        raise error
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                error = err
+
+            if attempt == self.max_attempts:
+                raise error
+            delay = 0.2 * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+            logger.warning(f'S3 {method} lỗi ({error}), thử lại lần {attempt + 1} sau {delay:.2f}s')
+            await asyncio.sleep(delay)
+
+    async def put_object(self, bucket: str, key: str, data: bytes, content_type: str = 'application/octet-stream'):
+        if len(data) >= self.multipart_threshold:
+            return await self._multipart_upload(bucket, key, data, content_type)
+
+        await self._request(
+            'PUT',
+            self._url(bucket, key),
+            data,
+            {'Content-Type': content_type, 'Content-Length': str(len(data))},
+        )
+
+    async def _multipart_upload(self, bucket: str, key: str, data: bytes, content_type: str):
+        _, body = await self._request('POST', self._url(bucket, key, 'uploads'), b'', {'Content-Type': content_type})
+        upload_id = ET.fromstring(body).findtext(f'{S3_NS}UploadId')
+
+        try:
+            parts = [data[i:i + self.part_size] for i in range(0, len(data), self.part_size)]
+            etags = await asyncio.gather(*[
+                self._upload_part(bucket, key, upload_id, number, part)
+                for number, part in enumerate(parts, start=1)
+            ])
+
+            complete = ''.join(
+                f'<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>'
+                for number, etag in enumerate(etags, start=1)
+            )
+            complete_body = f'<CompleteMultipartUpload>{complete}</CompleteMultipartUpload>'.encode('utf-8')
+            await self._request(
+                'POST',
+                self._url(bucket, key, f'uploadId={quote(upload_id)}'),
+                complete_body,
+                {'Content-Type': 'application/xml'},
+            )
+            logger.info(f'Upload multipart {key}: {len(parts)} part, {len(data)} bytes')
+        except Exception:
+            # Huỷ upload dở dang để MinIO không giữ các part rác
+            try:
+                await self._request('DELETE', self._url(bucket, key, f'uploadId={quote(upload_id)}'))
+            except Exception as err:
+                logger.error(f'Không huỷ được multipart upload {key}: {err}')
+            raise
+
+    async def _upload_part(self, bucket: str, key: str, upload_id: str, number: int, part: bytes) -> str:
+        headers, _ = await self._request(
+            'PUT',
+            self._url(bucket, key, f'partNumber={number}&uploadId={quote(upload_id)}'),
+            part,
+            {'Content-Length': str(len(part))},
+        )
+        return headers['ETag']
@@ -0,0 +1,158 @@
+import asyncio
+import heapq
+import logging
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# Kết quả của một lần pull, dùng để điều chỉnh chu kỳ của từng camera
+FRAME_NEW = 'new'              # ảnh mới -> giữ/tăng tần suất
+FRAME_UNCHANGED = 'unchanged'  # ảnh giống lần trước -> giãn chu kỳ
+FRAME_ERROR = 'error'          # lỗi/timeout -> backoff theo cấp số nhân
+
+
+@dataclass
+class CameraSchedule:
+    camera_id: str
+    interval: float
+    next_run: float
+    failures: int = 0
+
+
+class PollingScheduler:
+    """
+    Lịch pull riêng cho từng camera dựa trên heap thời gian (thay cho vòng gather + sleep 10s).
+    Mỗi camera có chu kỳ, backoff khi lỗi và deadline riêng, nên một camera chậm
+    không còn kéo dài chu kỳ của các camera khác.
+    """
+
+    def __init__(
+            self,
+            camera_ids: list,
+            fetch: Callable[[str], Awaitable],
+            base_interval: float = 10,
+            min_interval: float = 5,
+            max_interval: float = 60,
+            max_backoff: float = 300,
+            deadline: float = 20,
+            report_interval: float = 60,
+    ):
+        self.fetch = fetch
+        self.base_interval = base_interval
+        self.min_interval = min(min_interval, base_interval)
+        self.max_interval = max(max_interval, base_interval)
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.report_interval = report_interval
+
+        now = time.monotonic()
+        # Rải đều lần chạy đầu tiên trong một chu kỳ để không dồn tất cả camera vào cùng một lúc
+        step = base_interval / max(1, len(camera_ids))
+        self.schedules = {
+            camera_id: CameraSchedule(camera_id, base_interval, now + i * step)
+            for i, camera_id in enumerate(camera_ids)
+        }
+        self._heap = [(s.next_run, s.camera_id) for s in self.schedules.values()]
+        heapq.heapify(self._heap)
+        self._wakeup = asyncio.Event()
+        self._tasks = set()
+
+        self._outcomes = Counter()
+        self._lag_total = 0.0
+        self._lag_count = 0
+
+    async def run(self):
+        logger.info(
+            f'Bắt đầu lịch pull cho {len(self.schedules)} camera '
+            f'(chu kỳ {self.min_interval:.0f}-{self.max_interval:.0f}s, deadline {self.deadline:.0f}s)'
+        )
+        last_report = time.monotonic()
+
+        while True:
+            now = time.monotonic()
+            if self.report_interval > 0 and now - last_report >= self.report_interval:
+                self._report()
+                last_report = now
+
+            if not self._heap:
+                # Mọi camera đang được pull, chờ một camera xong để lên lịch lại
+                await self._wait(None)
+                continue
+
+            next_run, camera_id = self._heap[0]
+            if next_run > now:
+                await self._wait(next_run - now)
+                continue
+
+            heapq.heappop(self._heap)
+            self._lag_total += now - next_run
+            self._lag_count += 1
+
+            task = asyncio.create_task(self._run_one(self.schedules[camera_id], now))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _wait(self, timeout):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run_one(self, schedule: CameraSchedule, started: float):
+        try:
+            result = await asyncio.wait_for(self.fetch(schedule.camera_id), timeout=self.deadline)
+        except asyncio.TimeoutError:
+            logger.warning(f'[{schedule.camera_id}] Quá deadline {self.deadline:.0f}s khi pull ảnh.')
+            result = FRAME_ERROR
+        except Exception as err:
+            logger.error(f'[{schedule.camera_id}] Lỗi không mong muốn khi pull: {err}')
+            result = FRAME_ERROR
+
+        outcome = self._normalize(result)
+        self._outcomes[outcome] += 1
+        delay = self._next_delay(schedule, outcome)
+
+        # Tính từ lúc BẮT ĐẦU pull để giữ tần suất ổn định, nhưng không bao giờ lên lịch vào quá khứ
+        schedule.next_run = max(started + delay, time.monotonic())
+        heapq.heappush(self._heap, (schedule.next_run, schedule.camera_id))
+        self._wakeup.set()
+
+    @staticmethod
+    def _normalize(result) -> str:
+        if result is True:
+            return FRAME_NEW
+        if result in (FRAME_NEW, FRAME_UNCHANGED, FRAME_ERROR):
+            return result
+        return FRAME_ERROR
+
+    def _next_delay(self, schedule: CameraSchedule, outcome: str) -> float:
+        if outcome == FRAME_ERROR:
+            schedule.failures += 1
+            backoff = min(self.max_backoff, schedule.interval * (2 ** schedule.failures))
+            # Thêm jitter để các camera lỗi cùng lúc không thử lại cùng lúc
+            return backoff * random.uniform(0.8, 1.2)
+
+        schedule.failures = 0
+        if outcome == FRAME_UNCHANGED:
+            schedule.interval = min(self.max_interval, schedule.interval * 1.5)
+        else:
+            schedule.interval = max(self.min_interval, schedule.interval * 0.75)
+        return schedule.interval
+
+    def _report(self):
+        mean_lag = self._lag_total / self._lag_count if self._lag_count else 0.0
+        intervals = sorted(s.interval for s in self.schedules.values()) or [0.0]
+        backing_off = sum(1 for s in self.schedules.values() if s.failures)
+        logger.info(
+            f'Lịch pull: mới={self._outcomes[FRAME_NEW]}, giống={self._outcomes[FRAME_UNCHANGED]}, '
+            f'lỗi={self._outcomes[FRAME_ERROR]}, trễ TB={mean_lag:.2f}s, '
+            f'chu kỳ {intervals[0]:.0f}-{intervals[-1]:.0f}s, đang backoff={backing_off}'
+        )
+        self._outcomes.clear()
+        self._lag_total = 0.0
+        self._lag_count = 0
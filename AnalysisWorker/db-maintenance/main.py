@@ -0,0 +1,126 @@
+import os
+import time
+import logging
+import datetime
+from pathlib import Path
+
+import psycopg
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+connection_string = os.getenv('DB_CONNECTION_STRING')
+
+MIGRATIONS_DIR = Path(os.environ.get('MIGRATIONS_DIR', Path(__file__).parent / 'migrations'))
+# Số ngày giữ lại dữ liệu camera_detections (0 = không xoá)
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', 90))
+# Tạo sẵn partition cho bao nhiêu ngày tới
+PARTITION_PRECREATE_DAYS = int(os.environ.get('PARTITION_PRECREATE_DAYS', 7))
+# Bucket 10 phút (camera_detection_buckets) được tính lại và finalize sau khi kết thúc ROLLUP_GRACE_MINUTES,
+# xét lùi ROLLUP_LOOKBACK_MINUTES (bucket cũ hơn nhận dữ liệu trễ vẫn được tính lại)
+ROLLUP_GRACE_MINUTES = int(os.environ.get('ROLLUP_GRACE_MINUTES', 10))
+ROLLUP_LOOKBACK_MINUTES = int(os.environ.get('ROLLUP_LOOKBACK_MINUTES', 60))
+MAINTENANCE_INTERVAL_MINUTES = float(os.environ.get('MAINTENANCE_INTERVAL_MINUTES', 10))
+
+# Khoá advisory để nhiều bản db-maintenance chạy cùng lúc không áp migration/xoá partition chồng nhau
+ADVISORY_LOCK_ID = 7_340_112
+
+
+def run_migrations(conn: psycopg.Connection) -> list:
+    """Áp các file migrations/*.sql chưa chạy theo thứ tự tên, mỗi file trong một transaction."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(255) PRIMARY KEY,
+            applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        )
+    """)
+
+    applied = []
+    with conn.cursor() as cur:
+        cur.execute("SELECT version FROM schema_migrations")
+        done = {row[0] for row in cur.fetchall()}
+
+    for path in sorted(MIGRATIONS_DIR.glob('*.sql')):
+        version = path.stem
+        if version in done:
+            continue
+
+        logging.info(f"⏳ Đang áp migration {version}...")
+        started = time.monotonic()
+        with conn.transaction():
+            conn.execute(path.read_text(encoding='utf-8'))
+            conn.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (version,))
+        logging.info(f"✅ Đã áp migration {version} ({time.monotonic() - started:.1f}s)")
+        applied.append(version)
+
+    return applied
+
+
+def maintain_partitions(conn: psycopg.Connection, today: datetime.date = None) -> dict:
+    """Tạo trước partition cho các ngày sắp tới và xoá partition cũ hơn RETENTION_DAYS."""
+    today = today or datetime.date.today()
+    created = 0
+    dropped = 0
+
+    with conn.transaction():
+        for offset in range(PARTITION_PRECREATE_DAYS + 1):
+            day = today + datetime.timedelta(days=offset)
+            row = conn.execute("SELECT camera_detections_ensure_partition(%s)", (day,)).fetchone()
+            created += int(row[0])
+
+        if RETENTION_DAYS > 0:
+            cutoff = today - datetime.timedelta(days=RETENTION_DAYS)
+            row = conn.execute("SELECT camera_detections_drop_partitions_before(%s)", (cutoff,)).fetchone()
+            dropped = row[0]
+
+    return {'created': created, 'dropped': dropped}
+
+
+def finalize_buckets(conn: psycopg.Connection) -> int:
+    """Tính lại từ dữ liệu thô các bucket 10 phút đã kết thúc và đánh dấu finalized."""
+    with conn.transaction():
+        row = conn.execute(
+            "SELECT camera_detection_buckets_finalize(make_interval(mins => %s), make_interval(mins => %s))",
+            (ROLLUP_GRACE_MINUTES, ROLLUP_LOOKBACK_MINUTES),
+        ).fetchone()
+    return row[0]
+
+
+def run_once():
+    # autocommit: mỗi khối conn.transaction() bên dưới là một transaction thật, không lồng vào transaction ngầm
+    with psycopg.connect(connection_string, autocommit=True) as conn:
+        conn.execute("SELECT pg_advisory_lock(%s)", (ADVISORY_LOCK_ID,))
+        try:
+            applied = run_migrations(conn)
+            if not applied:
+                logging.info("Schema đã ở phiên bản mới nhất.")
+
+            stats = maintain_partitions(conn)
+            logging.info(
+                f"🗂️ Partition camera_detections: tạo mới {stats['created']}, "
+                f"xoá {stats['dropped']} (giữ {RETENTION_DAYS or 'tất cả'} ngày)"
+            )
+
+            finalized = finalize_buckets(conn)
+            logging.info(f"📦 Đã finalize {finalized} bucket 10 phút")
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_ID,))
+
+
+if __name__ == "__main__":
+    while True:
+        try:
+            run_once()
+        except KeyboardInterrupt:
+            logging.info("Dừng db-maintenance bằng tay (Ctrl+C).")
+            break
+        except Exception as e:
+            logging.error(f"❌ LỖI BẢO TRÌ CSDL: {e}")
+
+        try:
+            time.sleep(MAINTENANCE_INTERVAL_MINUTES * 60)
+        except KeyboardInterrupt:
+            logging.info("Dừng db-maintenance bằng tay (Ctrl+C).")
+            break
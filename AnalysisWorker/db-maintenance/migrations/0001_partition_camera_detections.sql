@@ -0,0 +1,123 @@
+-- Chuyển camera_detections sang bảng phân vùng theo ngày (RANGE created_at) + index (camera_id, created_at).
+-- Mọi truy vấn đọc (validate.py, train.py, web) đều lọc theo camera_id/created_at, nên phân vùng theo ngày
+-- giúp chỉ quét các ngày liên quan và cho phép xoá dữ liệu cũ bằng DROP partition thay vì DELETE.
+--
+-- Ràng buộc UNIQUE trên bảng phân vùng phải chứa cột phân vùng, nên minio_key trở thành UNIQUE (minio_key, created_at).
+-- created_at được suy ra từ chính minio_key (camera_id_<thời điểm chụp>.jpg), nên vẫn tương đương UNIQUE (minio_key).
+
+-- 1. Đổi tên bảng cũ (nếu có và chưa phân vùng) để tạo bảng mới cùng tên
+DO $$
+BEGIN
+    IF to_regclass('public.camera_detections') IS NOT NULL
+       AND NOT EXISTS (
+           SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('public.camera_detections')
+       ) THEN
+        ALTER TABLE public.camera_detections RENAME TO camera_detections_legacy;
+        ALTER INDEX IF EXISTS public.camera_detections_pkey RENAME TO camera_detections_legacy_pkey;
+        ALTER INDEX IF EXISTS public.camera_detections_minio_key_key RENAME TO camera_detections_legacy_minio_key_key;
+    END IF;
+END $$;
+
+CREATE SEQUENCE IF NOT EXISTS public.camera_detections_id_seq AS integer;
+-- Tách sequence khỏi bảng cũ để DROP bảng cũ không xoá luôn sequence
+ALTER SEQUENCE public.camera_detections_id_seq OWNED BY NONE;
+
+-- 2. Bảng cha phân vùng
+CREATE TABLE public.camera_detections (
+    id integer NOT NULL DEFAULT nextval('public.camera_detections_id_seq'::regclass),
+    minio_key character varying(255) NOT NULL,
+    camera_id character varying(50) NOT NULL,
+    detections jsonb,
+    total_objects integer NOT NULL,
+    created_at timestamp without time zone NOT NULL,
+    CONSTRAINT camera_detections_pkey PRIMARY KEY (id, created_at),
+    CONSTRAINT camera_detections_minio_key_created_at_key UNIQUE (minio_key, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE public.camera_detections_id_seq OWNED BY public.camera_detections.id;
+
+CREATE INDEX camera_detections_camera_id_created_at_idx
+    ON public.camera_detections (camera_id, created_at);
+
+-- Partition mặc định hứng các dòng rơi ngoài các ngày đã tạo (ví dụ đồng hồ camera sai),
+-- để INSERT không bao giờ lỗi vì thiếu partition
+CREATE TABLE public.camera_detections_default PARTITION OF public.camera_detections DEFAULT;
+
+-- 3. Hàm quản lý partition, dùng bởi job retention của db-maintenance (có thể gọi tay bằng psql)
+CREATE OR REPLACE FUNCTION public.camera_detections_ensure_partition(day date) RETURNS boolean AS $$
+DECLARE
+    partition_name text := format('camera_detections_p%s', to_char(day, 'YYYYMMDD'));
+BEGIN
+    IF to_regclass(format('public.%I', partition_name)) IS NOT NULL THEN
+        RETURN false;
+    END IF;
+
+    -- Tạo bảng rời, chuyển các dòng của ngày này đang nằm ở partition mặc định sang, rồi mới ATTACH;
+    -- tạo thẳng PARTITION OF sẽ lỗi nếu partition mặc định đã có dòng thuộc khoảng này
+    EXECUTE format(
+        'CREATE TABLE public.%I (LIKE public.camera_detections INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+        partition_name
+    );
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM public.camera_detections_default
+                        WHERE created_at >= %L AND created_at < %L RETURNING *)
+         INSERT INTO public.%I SELECT * FROM moved',
+        day, day + 1, partition_name
+    );
+    EXECUTE format(
+        'ALTER TABLE public.camera_detections ATTACH PARTITION public.%I FOR VALUES FROM (%L) TO (%L)',
+        partition_name, day, day + 1
+    );
+    RETURN true;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.camera_detections_drop_partitions_before(cutoff date) RETURNS integer AS $$
+DECLARE
+    partition record;
+    dropped integer := 0;
+BEGIN
+    FOR partition IN
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = 'camera_detections'
+          AND child.relname ~ '^camera_detections_p[0-9]{8}$'
+          AND to_date(right(child.relname, 8), 'YYYYMMDD') < cutoff
+    LOOP
+        EXECUTE format('DROP TABLE public.%I', partition.relname);
+        dropped := dropped + 1;
+    END LOOP;
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 4. Tạo partition cho khoảng dữ liệu cũ + vài ngày tới, rồi chép dữ liệu cũ sang và xoá bảng cũ
+DO $$
+DECLARE
+    first_day date := current_date;
+    day date;
+BEGIN
+    IF to_regclass('public.camera_detections_legacy') IS NOT NULL THEN
+        EXECUTE 'SELECT COALESCE(MIN(created_at)::date, current_date) FROM public.camera_detections_legacy'
+            INTO first_day;
+    END IF;
+
+    FOR day IN SELECT generate_series(LEAST(first_day, current_date), current_date + 7, interval '1 day')::date LOOP
+        PERFORM public.camera_detections_ensure_partition(day);
+    END LOOP;
+
+    IF to_regclass('public.camera_detections_legacy') IS NOT NULL THEN
+        INSERT INTO public.camera_detections (id, minio_key, camera_id, detections, total_objects, created_at)
+        SELECT id, minio_key, camera_id, detections, total_objects, created_at
+        FROM public.camera_detections_legacy;
+        DROP TABLE public.camera_detections_legacy;
+    END IF;
+END $$;
+
+SELECT setval(
+    'public.camera_detections_id_seq',
+    GREATEST((SELECT COALESCE(MAX(id), 0) FROM public.camera_detections), 1),
+    (SELECT COUNT(*) > 0 FROM public.camera_detections)
+);
@@ -0,0 +1,119 @@
+-- Bảng tổng hợp 10 phút của camera_detections: train/forecast/dashboard đọc vài nghìn dòng bucket
+-- thay vì resample hàng triệu dòng thô mỗi lần.
+--   - image-process (writer.py) cộng dồn các dòng mới vào bucket ngay trong câu INSERT của lô
+--   - db-maintenance tính lại từ dữ liệu thô các bucket đã kết thúc và đánh dấu finalized
+--   - dữ liệu đến trễ vào bucket đã finalized sẽ đặt lại finalized = false để được tính lại lần sau
+
+CREATE TABLE IF NOT EXISTS public.camera_detection_buckets (
+    camera_id character varying(50) NOT NULL,
+    bucket_start timestamp without time zone NOT NULL,
+    sample_count integer NOT NULL,
+    sum_objects bigint NOT NULL,
+    max_objects integer NOT NULL,
+    mean_objects double precision GENERATED ALWAYS AS (sum_objects::double precision / NULLIF(sample_count, 0)) STORED,
+    class_counts jsonb NOT NULL DEFAULT '{}'::jsonb,
+    finalized boolean NOT NULL DEFAULT false,
+    updated_at timestamp with time zone NOT NULL DEFAULT now(),
+    CONSTRAINT camera_detection_buckets_pkey PRIMARY KEY (camera_id, bucket_start)
+);
+
+CREATE INDEX IF NOT EXISTS camera_detection_buckets_bucket_start_idx
+    ON public.camera_detection_buckets (bucket_start);
+
+-- Cộng hai object đếm theo lớp: {"car": 2} + {"car": 1, "truck": 1} = {"car": 3, "truck": 1}
+CREATE OR REPLACE FUNCTION public.jsonb_sum_counts(a jsonb, b jsonb) RETURNS jsonb AS $$
+    SELECT COALESCE(jsonb_object_agg(key, total), '{}'::jsonb)
+    FROM (
+        SELECT key, SUM(value::bigint) AS total
+        FROM (
+            SELECT * FROM jsonb_each_text(COALESCE(a, '{}'::jsonb))
+            UNION ALL
+            SELECT * FROM jsonb_each_text(COALESCE(b, '{}'::jsonb))
+        ) AS counts
+        GROUP BY key
+    ) AS summed;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE AGGREGATE public.jsonb_sum_counts_agg(jsonb) (
+    SFUNC = public.jsonb_sum_counts,
+    STYPE = jsonb,
+    INITCOND = '{}'
+);
+
+-- Tính lại (giá trị tuyệt đối) các bucket có bucket_start trong [from_ts, to_ts) từ dữ liệu thô
+CREATE OR REPLACE FUNCTION public.camera_detection_buckets_rebuild(
+    from_ts timestamp without time zone,
+    to_ts timestamp without time zone,
+    finalize boolean DEFAULT true
+) RETURNS integer AS $$
+DECLARE
+    affected integer;
+BEGIN
+    INSERT INTO public.camera_detection_buckets AS b
+        (camera_id, bucket_start, sample_count, sum_objects, max_objects, class_counts, finalized, updated_at)
+    SELECT
+        camera_id,
+        date_bin('10 minutes', created_at, TIMESTAMP '2000-01-01') AS bucket_start,
+        COUNT(*),
+        SUM(total_objects),
+        MAX(total_objects),
+        public.jsonb_sum_counts_agg(detections),
+        finalize,
+        now()
+    FROM public.camera_detections
+    WHERE created_at >= date_bin('10 minutes', from_ts, TIMESTAMP '2000-01-01')
+      AND created_at < to_ts
+    GROUP BY 1, 2
+    ON CONFLICT (camera_id, bucket_start) DO UPDATE SET
+        sample_count = EXCLUDED.sample_count,
+        sum_objects = EXCLUDED.sum_objects,
+        max_objects = EXCLUDED.max_objects,
+        class_counts = EXCLUDED.class_counts,
+        finalized = EXCLUDED.finalized,
+        updated_at = EXCLUDED.updated_at;
+    GET DIAGNOSTICS affected = ROW_COUNT;
+    RETURN affected;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Finalize các bucket đã kết thúc ít nhất `grace` trước bucket mới nhất, xét lùi tối đa `lookback`,
+-- cùng mọi bucket cũ hơn bị đặt lại finalized = false do dữ liệu đến trễ.
+-- Mốc "hiện tại" lấy theo dữ liệu (created_at là giờ địa phương của camera, không phải giờ của máy chủ CSDL)
+CREATE OR REPLACE FUNCTION public.camera_detection_buckets_finalize(
+    grace interval DEFAULT interval '10 minutes',
+    lookback interval DEFAULT interval '1 hour'
+) RETURNS integer AS $$
+DECLARE
+    cutoff timestamp without time zone;
+    affected integer;
+    late record;
+BEGIN
+    SELECT date_bin('10 minutes', MAX(bucket_start) + interval '10 minutes' - grace, TIMESTAMP '2000-01-01')
+    INTO cutoff
+    FROM public.camera_detection_buckets;
+    IF cutoff IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    affected := public.camera_detection_buckets_rebuild(cutoff - lookback, cutoff, true);
+
+    FOR late IN
+        SELECT DISTINCT bucket_start
+        FROM public.camera_detection_buckets
+        WHERE NOT finalized AND bucket_start < cutoff - lookback
+    LOOP
+        affected := affected + public.camera_detection_buckets_rebuild(
+            late.bucket_start, late.bucket_start + interval '10 minutes', true
+        );
+    END LOOP;
+    RETURN affected;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Backfill toàn bộ lịch sử hiện có, rồi finalize các bucket đã kết thúc
+SELECT public.camera_detection_buckets_rebuild(
+    (SELECT COALESCE(MIN(created_at), localtimestamp) FROM public.camera_detections),
+    'infinity',
+    false
+);
+SELECT public.camera_detection_buckets_finalize(interval '10 minutes', interval '100 years');
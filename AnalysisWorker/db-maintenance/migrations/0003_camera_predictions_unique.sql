@@ -0,0 +1,31 @@
+-- Mỗi (camera, mốc dự đoán, minutes_resample) chỉ giữ một dự đoán: image-predict (forecast_sink.py)
+-- upsert theo khoá này thay vì thêm bản trùng sau mỗi vòng dự đoán.
+
+CREATE TABLE IF NOT EXISTS public.camera_predictions (
+    id SERIAL PRIMARY KEY,
+    camera_id character varying(50) NOT NULL,
+    forecast_timestamp timestamp with time zone NOT NULL,
+    predicted_total_objects double precision NOT NULL,
+    minutes_resample smallint NOT NULL,
+    prediction_time timestamp with time zone DEFAULT now(),
+    forecast_hour smallint,
+    forecast_dayofweek smallint,
+    forecast_is_weekend boolean,
+    forecast_dayofyear smallint,
+    forecast_weekofyear smallint,
+    forecast_month smallint
+);
+
+-- Giữ bản dự đoán mới nhất (id lớn nhất) của mỗi khoá trước khi tạo unique index
+DELETE FROM public.camera_predictions p
+USING (
+    SELECT id, row_number() OVER (
+        PARTITION BY camera_id, forecast_timestamp, minutes_resample
+        ORDER BY prediction_time DESC NULLS LAST, id DESC
+    ) AS rn
+    FROM public.camera_predictions
+) ranked
+WHERE p.id = ranked.id AND ranked.rn > 1;
+
+CREATE UNIQUE INDEX IF NOT EXISTS camera_predictions_forecast_key
+    ON public.camera_predictions (camera_id, forecast_timestamp, minutes_resample);
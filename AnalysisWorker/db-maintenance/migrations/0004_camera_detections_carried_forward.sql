@@ -0,0 +1,6 @@
+-- Đánh dấu các dòng mà image-process không chạy YOLO (MOTION_GATE_ENABLED): khung hình gần như không đổi so với
+-- lần suy luận gần nhất của camera nên kết quả đó được ghi lại cho thời điểm mới.
+-- Giá trị mặc định hằng số nên ADD COLUMN chỉ đổi metadata, không ghi lại các partition hiện có.
+
+ALTER TABLE public.camera_detections
+    ADD COLUMN IF NOT EXISTS carried_forward boolean NOT NULL DEFAULT false;
@@ -0,0 +1,43 @@
+-- Tuần tự hoá việc tính lại bucket (giá trị tuyệt đối) với các lô ghi của image-process (cộng dồn).
+-- Trước đây rebuild đọc camera_detections bằng snapshot chưa thấy lô đang ghi, chờ khoá dòng bucket của lô đó
+-- rồi ghi đè tổng cũ lên -> các dòng của lô bị mất khỏi bucket vĩnh viễn.
+-- Nay mỗi lô ghi giữ khoá advisory 7340113 ở chế độ SHARED trong transaction của nó (writer.py, ROLLUP_LOCK_ID),
+-- còn rebuild lấy khoá EXCLUSIVE trước khi đọc dữ liệu thô: rebuild chờ các lô đang ghi commit xong và câu
+-- INSERT ... SELECT phía sau (snapshot mới) thấy mọi dòng đã commit; các lô sau đó cộng dồn lên kết quả rebuild.
+
+CREATE OR REPLACE FUNCTION public.camera_detection_buckets_rebuild(
+    from_ts timestamp without time zone,
+    to_ts timestamp without time zone,
+    finalize boolean DEFAULT true
+) RETURNS integer AS $$
+DECLARE
+    affected integer;
+BEGIN
+    PERFORM pg_advisory_xact_lock(7340113);
+
+    INSERT INTO public.camera_detection_buckets AS b
+        (camera_id, bucket_start, sample_count, sum_objects, max_objects, class_counts, finalized, updated_at)
+    SELECT
+        camera_id,
+        date_bin('10 minutes', created_at, TIMESTAMP '2000-01-01') AS bucket_start,
+        COUNT(*),
+        SUM(total_objects),
+        MAX(total_objects),
+        public.jsonb_sum_counts_agg(detections),
+        finalize,
+        now()
+    FROM public.camera_detections
+    WHERE created_at >= date_bin('10 minutes', from_ts, TIMESTAMP '2000-01-01')
+      AND created_at < to_ts
+    GROUP BY 1, 2
+    ON CONFLICT (camera_id, bucket_start) DO UPDATE SET
+        sample_count = EXCLUDED.sample_count,
+        sum_objects = EXCLUDED.sum_objects,
+        max_objects = EXCLUDED.max_objects,
+        class_counts = EXCLUDED.class_counts,
+        finalized = EXCLUDED.finalized,
+        updated_at = EXCLUDED.updated_at;
+    GET DIAGNOSTICS affected = ROW_COUNT;
+    RETURN affected;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,100 @@
+"""
+So sánh mô hình joblib (sklearn) với bản gọn của compact_forest:
+thời gian nạp, RSS của tiến trình sau khi nạp và độ trễ predict cho mỗi lô (một bước dự đoán của tất cả camera).
+
+    python benchmark_model.py <model.joblib> <FEATURE_ORDER.txt> [số camera mỗi lô] [số lần lặp]
+"""
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def rss_mb() -> float:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def sample_batch(feature_order, batch_size: int, seed: int = 0) -> pd.DataFrame:
+    """Lô đầu vào giống forecast_matrix: mỗi dòng một camera (one-hot), lag và đặc trưng thời gian ngẫu nhiên."""
+    rng = np.random.default_rng(seed)
+    X = np.zeros((batch_size, len(feature_order)))
+    camera_columns = [i for i, name in enumerate(feature_order) if name.startswith('cam_')]
+    for row in range(batch_size):
+        X[row, camera_columns[row % len(camera_columns)]] = 1
+    columns = {name: i for i, name in enumerate(feature_order)}
+    for lag in (1, 2, 3):
+        X[:, columns[f'total_lag_{lag}']] = rng.uniform(0, 40, batch_size)
+    X[:, columns['hour']] = rng.integers(0, 24)
+    X[:, columns['dayofweek']] = rng.integers(0, 7)
+    return pd.DataFrame(X, columns=feature_order)
+
+
+def measure(kind: str, path: str, feature_order, batch_size: int, iterations: int, results):
+    # Chạy trong tiến trình riêng để RSS và thời gian nạp không bị ảnh hưởng bởi mô hình còn lại
+    baseline = rss_mb()
+    started = time.perf_counter()
+    if kind == 'joblib':
+        import joblib
+        model = joblib.load(path)
+    else:
+        from compact_forest import CompactForest
+        model = CompactForest.load(path)
+    load_seconds = time.perf_counter() - started
+    loaded_rss = rss_mb()
+
+    X = sample_batch(feature_order, batch_size)
+    predictions = model.predict(X)
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        model.predict(X)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    results[kind] = {
+        'load_ms': load_seconds * 1000,
+        'rss_mb': loaded_rss - baseline,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'predictions': predictions.tolist(),
+    }
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import joblib
+    from compact_forest import export_compact_forest
+
+    model_path, feature_order_path = sys.argv[1:3]
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    iterations = int(sys.argv[4]) if len(sys.argv) > 4 else 200
+
+    with open(feature_order_path) as f:
+        order = [line.strip() for line in f if line.strip()]
+
+    compact_dir = tempfile.mkdtemp(prefix='compact_forest_')
+    export_compact_forest(joblib.load(model_path), order, compact_dir)
+
+    manager = multiprocessing.Manager()
+    results = manager.dict()
+    for kind, path in (('joblib', model_path), ('compact', compact_dir)):
+        process = multiprocessing.Process(target=measure, args=(kind, path, order, batch_size, iterations, results))
+        process.start()
+        process.join()
+
+    print(f"Lô {batch_size} dòng, {iterations} lần lặp")
+    print(f"{'định dạng':<10} {'nạp (ms)':>10} {'RSS (MB)':>10} {'p50 (ms)':>10} {'p99 (ms)':>10}")
+    for kind in ('joblib', 'compact'):
+        r = results[kind]
+        print(f"{kind:<10} {r['load_ms']:>10.1f} {r['rss_mb']:>10.1f} {r['p50_ms']:>10.3f} {r['p99_ms']:>10.3f}")
+
+    difference = np.abs(np.array(results['joblib']['predictions']) - np.array(results['compact']['predictions'])).max()
+    print(f"Sai khác dự đoán lớn nhất: {difference:.2e}")
@@ -0,0 +1,113 @@
+import json
+import os
+import sys
+
+import numpy as np
+
+# Các mảng của toàn bộ rừng được nối phẳng, chỉ số node là chỉ số toàn cục (đã cộng offset của từng cây)
+ARRAYS = ('left', 'right', 'feature', 'threshold', 'value', 'roots')
+META_FILE = 'meta.json'
+
+
+def export_compact_forest(model, feature_order, out_dir: str) -> str:
+    """
+    Chuyển RandomForestRegressor (sklearn) thành các mảng NumPy phẳng trong `out_dir`
+    (mỗi mảng một file .npy + meta.json) để dịch vụ dự đoán nạp bằng mmap thay cho pickle.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    lefts, rights, features, thresholds, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        is_leaf = tree.children_left == -1
+        lefts.append(np.where(is_leaf, -1, tree.children_left + offset))
+        rights.append(np.where(is_leaf, -1, tree.children_right + offset))
+        features.append(np.where(is_leaf, 0, tree.feature))
+        thresholds.append(tree.threshold)
+        values.append(tree.value[:, 0, 0])
+        roots.append(offset)
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+
+    arrays = {
+        'left': np.concatenate(lefts).astype(np.int32),
+        'right': np.concatenate(rights).astype(np.int32),
+        'feature': np.concatenate(features).astype(np.int32),
+        'threshold': np.concatenate(thresholds).astype(np.float64),
+        'value': np.concatenate(values).astype(np.float64),
+        'roots': np.asarray(roots, dtype=np.int32),
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(out_dir, f'{name}.npy'), array)
+
+    meta = {
+        'feature_order': list(feature_order),
+        'n_trees': len(roots),
+        'n_nodes': offset,
+        'max_depth': max_depth,
+    }
+    with open(os.path.join(out_dir, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return out_dir
+
+
+class CompactForest:
+    """
+    Rừng hồi quy dạng mảng phẳng: predict() duyệt tất cả cây cho tất cả dòng cùng lúc bằng NumPy
+    (số vòng lặp = độ sâu cây), không qua bước kiểm tra đầu vào của sklearn.
+    Kết quả trùng với RandomForestRegressor.predict (sai khác chỉ ở thứ tự cộng số thực).
+    """
+
+    def __init__(self, arrays: dict, meta: dict):
+        self.left = arrays['left']
+        self.right = arrays['right']
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.value = arrays['value']
+        self.roots = np.asarray(arrays['roots'])
+        self.feature_order = meta['feature_order']
+        self.n_features_in_ = len(self.feature_order)
+        self.max_depth = meta['max_depth']
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> 'CompactForest':
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        mode = 'r' if mmap else None
+        arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mode) for name in ARRAYS}
+        return cls(arrays, meta)
+
+    @property
+    def estimators_(self):
+        # Chỉ để các chỗ đang đếm số cây (len(model.estimators_)) vẫn chạy được
+        return self.roots
+
+    def predict(self, X) -> np.ndarray:
+        if hasattr(X, 'columns'):
+            X = X[self.feature_order].to_numpy()
+        # sklearn so sánh ngưỡng trên X đã ép về float32
+        X = np.asarray(X, dtype=np.float32)
+
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            left = self.left[nodes]
+            active = left != -1
+            if not active.any():
+                break
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(active, np.where(go_left, left, self.right[nodes]), nodes)
+
+        return self.value[nodes].mean(axis=1)
+
+
+if __name__ == "__main__":
+    # python compact_forest.py <model.joblib> <FEATURE_ORDER.txt> <thư mục xuất>
+    import joblib
+
+    model_path, feature_order_path, out_dir = sys.argv[1:4]
+    with open(feature_order_path) as f:
+        order = [line.strip() for line in f if line.strip()]
+    export_compact_forest(joblib.load(model_path), order, out_dir)
+    print(f"✅ Đã xuất mô hình gọn vào {out_dir}")
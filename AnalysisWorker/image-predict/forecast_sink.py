@@ -0,0 +1,131 @@
+import io
+import logging
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from train import create_time_features
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = [
+    'camera_id',
+    'forecast_timestamp',
+    'predicted_total_objects',
+    'minutes_resample',
+    'prediction_time',
+    'forecast_hour',
+    'forecast_dayofweek',
+    'forecast_is_weekend',
+    'forecast_dayofyear',
+    'forecast_weekofyear',
+    'forecast_month',
+]
+
+# Đặc trưng thời gian của create_time_features -> cột forecast_* của bảng dự đoán
+TIME_FEATURE_COLUMNS = {
+    'hour': 'forecast_hour',
+    'dayofweek': 'forecast_dayofweek',
+    'is_weekend': 'forecast_is_weekend',
+    'dayofyear': 'forecast_dayofyear',
+    'weekofyear': 'forecast_weekofyear',
+    'month': 'forecast_month',
+}
+
+# Khoá upsert, khớp unique index của db-maintenance/migrations/0003
+CONFLICT_COLUMNS = '(camera_id, forecast_timestamp, minutes_resample)'
+
+_engines = {}
+
+
+def shared_engine(connection_string: str):
+    """Một engine (pool kết nối) cho mỗi connection string, dùng lại qua các vòng dự đoán."""
+    engine = _engines.get(connection_string)
+    if engine is None:
+        engine = _engines[connection_string] = create_engine(connection_string, pool_pre_ping=True, pool_recycle=300)
+    return engine
+
+
+class ForecastSink:
+    """
+    Ghi kết quả dự đoán bằng COPY vào bảng tạm rồi INSERT ... SELECT sang bảng đích, tất cả trong
+    một transaction. Với upsert=True, dự đoán mới ghi đè dự đoán cũ cùng (camera, mốc, minutes_resample),
+    nên bảng chỉ giữ dự đoán hiện hành thay vì thêm bản trùng sau mỗi vòng (cần unique index của migration 0003).
+    """
+
+    def __init__(self, engine, table_name: str = 'camera_predictions', upsert: bool = False):
+        self.engine = engine
+        self.table_name = table_name
+        self.upsert = upsert
+
+    def build_rows(self, camera_list, timestamps, predictions, time_features, minutes_resample) -> pd.DataFrame:
+        """
+        Dựng bảng dòng (camera x bước) từ kết quả forecast_matrix, dùng lại time_features đã tính
+        cho từng bước thay vì tính lại các cột lịch cho từng dòng.
+        """
+        n_cameras, steps = len(camera_list), len(timestamps)
+        rows = pd.DataFrame({
+            'camera_id': np.repeat(np.asarray(camera_list, dtype=object), steps),
+            'forecast_timestamp': np.tile(np.asarray(timestamps, dtype='datetime64[ns]'), n_cameras),
+            'predicted_total_objects': np.asarray(predictions, dtype=np.float64).reshape(-1),
+            'minutes_resample': minutes_resample,
+            'prediction_time': datetime.now(),
+        })
+        for feature, column in TIME_FEATURE_COLUMNS.items():
+            values = time_features[feature].to_numpy()
+            rows[column] = np.tile(values, n_cameras)
+        rows['forecast_is_weekend'] = rows['forecast_is_weekend'].astype(bool)
+        return rows[COLUMNS]
+
+    def write(self, camera_list, timestamps, predictions, time_features, minutes_resample) -> int:
+        return self.write_rows(self.build_rows(camera_list, timestamps, predictions, time_features, minutes_resample))
+
+    def write_frame(self, forecasts_df: pd.DataFrame, minutes_resample: int) -> int:
+        """Ghi DataFrame định dạng cũ (index = camera_id, cột = mốc dự đoán)."""
+        timestamps = pd.to_datetime(forecasts_df.columns)
+        time_features = create_time_features(pd.DataFrame(index=timestamps))
+        return self.write(list(forecasts_df.index), timestamps, forecasts_df.to_numpy(), time_features, minutes_resample)
+
+    def write_rows(self, rows: pd.DataFrame) -> int:
+        started = time.monotonic()
+        buffer = io.StringIO()
+        rows.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+
+        columns = ', '.join(COLUMNS)
+        if self.upsert:
+            updates = ', '.join(
+                f'{column} = EXCLUDED.{column}'
+                for column in COLUMNS if column not in ('camera_id', 'forecast_timestamp', 'minutes_resample')
+            )
+            on_conflict = f'ON CONFLICT {CONFLICT_COLUMNS} DO UPDATE SET {updates}'
+        else:
+            on_conflict = ''
+
+        connection = self.engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'CREATE TEMP TABLE forecast_stage ON COMMIT DROP AS '
+                    f'SELECT {columns} FROM {self.table_name} WITH NO DATA'
+                )
+                cursor.copy_expert(f'COPY forecast_stage ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+                cursor.execute(
+                    f'INSERT INTO {self.table_name} ({columns}) '
+                    f'SELECT {columns} FROM forecast_stage {on_conflict}'
+                )
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+        logger.info(
+            f"✅ Đã {'upsert' if self.upsert else 'lưu'} {len(rows)} dự đoán vào bảng '{self.table_name}' "
+            f"bằng COPY ({(time.monotonic() - started) * 1000:.0f}ms)"
+        )
+        return len(rows)
@@ -0,0 +1,107 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from train import create_time_features
+
+logger = logging.getLogger(__name__)
+
+LAGS = [1, 2, 3]
+
+
+def step_time_features(timestamp) -> pd.DataFrame:
+    """Đặc trưng thời gian của MỘT mốc dự đoán (giống hệt create_time_features cho từng dòng)."""
+    return create_time_features(pd.DataFrame(index=[timestamp]))
+
+
+def camera_lag_matrix(historical_data_func, camera_list, num_lags=3):
+    """
+    Chuyển hàm lấy lag theo từng camera (cam_id, num_lags) -> (lags, timestamp)
+    thành ma trận lag (số camera x num_lags) dùng cho forecast_matrix.
+    """
+    lags = np.zeros((len(camera_list), num_lags), dtype=np.float64)
+    timestamp = None
+    for row, cam_id in enumerate(camera_list):
+        cam_lags, timestamp = historical_data_func(cam_id, num_lags)
+        lags[row] = cam_lags
+    return lags, timestamp
+
+
+def forecast_matrix(model, feature_order, camera_list, lags, start_timestamp, minutes, steps=3):
+    """
+    Dự đoán đệ quy cho TẤT CẢ camera cùng lúc: mỗi bước chỉ dựng một ma trận đặc trưng
+    (số camera x số feature) và gọi model.predict đúng một lần.
+
+    Trả về (timestamps, predictions[camera, bước], time_features) với time_features là
+    DataFrame đặc trưng thời gian của từng bước (index = mốc dự đoán).
+    """
+    time_step = pd.Timedelta(minutes, unit='m')
+    n_cameras = len(camera_list)
+    column_index = {name: i for i, name in enumerate(feature_order)}
+
+    lags = np.array(lags, dtype=np.float64, copy=True)
+    predictions = np.empty((n_cameras, steps), dtype=np.float64)
+
+    X = np.zeros((n_cameras, len(feature_order)), dtype=np.float64)
+    # One-hot camera: cố định qua các bước nên chỉ gán một lần.
+    # Camera không có cột cam_* (mới thêm / không có dữ liệu huấn luyện) giữ one-hot toàn 0 như trước
+    for row, cam_id in enumerate(camera_list):
+        camera_column = column_index.get(f'cam_{cam_id}')
+        if camera_column is not None:
+            X[row, camera_column] = 1
+    lag_columns = [column_index[f'total_lag_{lag}'] for lag in LAGS]
+
+    timestamps = [start_timestamp + time_step * i for i in range(1, steps + 1)]
+    time_features = pd.concat([step_time_features(ts) for ts in timestamps])
+    time_columns = [(column_index[name], name) for name in time_features.columns if name in column_index]
+
+    for step, timestamp in enumerate(timestamps):
+        for col, name in time_columns:
+            X[:, col] = time_features[name].iloc[step]
+        X[:, lag_columns] = lags[:, :len(LAGS)]
+
+        # Giữ tên cột để model (đã fit với DataFrame) không cảnh báo thiếu feature names
+        step_predictions = model.predict(pd.DataFrame(X, columns=feature_order))
+        predictions[:, step] = step_predictions
+        logger.info(
+            f"  > Dự đoán bước {step + 1} ({timestamp.strftime('%H:%M')}) cho {n_cameras} camera: "
+            f"TB {step_predictions.mean():.2f}, min {step_predictions.min():.2f}, max {step_predictions.max():.2f}"
+        )
+
+        # Cập nhật Lag hàng loạt (Recursive Step): lag_1 <- dự đoán, các lag cũ lùi một vị trí
+        lags = np.roll(lags, 1, axis=1)
+        lags[:, 0] = step_predictions
+
+    return timestamps, predictions, time_features
+
+
+def recursive_forecast_matrix(model, feature_order, camera_list, bulk_historical_func, minutes, steps=3):
+    """
+    Lấy lag hiện tại bằng bulk_historical_func(camera_list, num_lags) -> (ma trận lag, timestamp đã làm tròn)
+    rồi dự đoán; trả về nguyên kết quả của forecast_matrix (timestamps, predictions, time_features).
+    """
+    lags, start_timestamp = bulk_historical_func(camera_list, len(LAGS))
+    timestamps, predictions, time_features = forecast_matrix(
+        model, feature_order, camera_list, lags, start_timestamp, minutes, steps
+    )
+    logger.info(f"Thời gian bắt đầu dự đoán (Standard Index): {timestamps[0].strftime('%Y-%m-%d %H:%M:%S')} (Bước 1)")
+    return timestamps, predictions, time_features
+
+
+def recursive_forecast_vectorized(model, feature_order, camera_list, bulk_historical_func, minutes, steps=3):
+    """
+    Dự đoán vector hoá, trả về định dạng {camera_id: Series} (index là các mốc dự đoán).
+    bulk_historical_func(camera_list, num_lags) -> (ma trận lag, timestamp đã làm tròn).
+    """
+    if not camera_list:
+        logger.error("Lỗi: Danh sách camera (camera_list) bị trống.")
+        return {}
+
+    timestamps, predictions, _ = recursive_forecast_matrix(
+        model, feature_order, camera_list, bulk_historical_func, minutes, steps
+    )
+    return {
+        cam_id: pd.Series(predictions[row], index=timestamps)
+        for row, cam_id in enumerate(camera_list)
+    }
@@ -0,0 +1,192 @@
+import logging
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Gom dữ liệu thô thành (camera, bucket) ngay trong SQL, chỉ lấy các dòng có id mới hơn watermark
+SQL_NEW_BUCKETS = text("""
+    SELECT
+        camera_id,
+        FLOOR(EXTRACT(EPOCH FROM created_at) / :bucket_seconds)::bigint AS bucket,
+        SUM(total_objects)::float8 AS object_sum,
+        COUNT(*) AS sample_count,
+        MAX(id) AS max_id
+    FROM camera_detections
+    WHERE id > :last_id
+      AND created_at >= (SELECT MAX(created_at) FROM camera_detections) - make_interval(secs => :window_seconds)
+    GROUP BY camera_id, bucket
+""")
+
+# Đọc từ bảng tổng hợp camera_detection_buckets (db-maintenance/migrations/0002): giá trị tuyệt đối của
+# từng bucket, chỉ lấy các bucket được cập nhật sau watermark (lùi một khoảng an toàn, đọc trùng không sao)
+SQL_UPDATED_ROLLUP_BUCKETS = text("""
+    SELECT
+        camera_id,
+        FLOOR(EXTRACT(EPOCH FROM bucket_start) / :bucket_seconds)::bigint AS bucket,
+        sum_objects::float8 AS object_sum,
+        sample_count,
+        updated_at
+    FROM camera_detection_buckets
+    WHERE updated_at > CAST(:since AS timestamptz) - interval '1 minute'
+      AND bucket_start >= (SELECT MAX(bucket_start) FROM camera_detection_buckets) - make_interval(secs => :window_seconds)
+""")
+
+# Độ rộng bucket của bảng tổng hợp
+ROLLUP_BUCKET_MINUTES = 10
+
+
+class LagStateStore:
+    """
+    Giữ `window` bucket gần nhất (mặc định 10 phút) của mỗi camera trong các mảng numpy
+    dạng ring buffer: bucket id, tổng total_objects và số mẫu.
+    refresh() chỉ đọc phần thay đổi bằng một câu SQL có cửa sổ thời gian, còn lags()/lag_matrix()
+    trả kết quả đã tính sẵn cho từng camera. Hai nguồn:
+    - source='rollup': các bucket của camera_detection_buckets có updated_at mới hơn watermark
+    - source='raw': gom các dòng camera_detections có id mới hơn watermark
+
+    Lag giữ đúng ngữ nghĩa của filtered_data(): lấy bucket mới nhất có dữ liệu mà 3 bucket liền
+    trước cũng có dữ liệu, rồi trả về trung bình của 3 bucket liền trước đó [lag_1, lag_2, lag_3].
+    """
+
+    def __init__(
+            self,
+            engine,
+            minutes: int = 10,
+            num_lags: int = 3,
+            window: int = 8,
+            full_refresh_every: int = 12,
+            source: str = 'raw',
+    ):
+        self.engine = engine
+        # Bảng tổng hợp chỉ có bucket 10 phút; độ rộng khác phải gom từ dữ liệu thô
+        self.source = source if minutes == ROLLUP_BUCKET_MINUTES else 'raw'
+        self.bucket_seconds = minutes * 60
+        self.num_lags = num_lags
+        self.window = max(window, num_lags + 2)
+        # Định kỳ đọc lại toàn bộ cửa sổ để bắt các thay đổi commit muộn (id/updated_at nhỏ hơn watermark)
+        self.full_refresh_every = full_refresh_every
+
+        self.camera_rows = {}
+        self.bucket_ids = np.full((0, self.window), -1, dtype=np.int64)
+        self.sums = np.zeros((0, self.window), dtype=np.float64)
+        self.counts = np.zeros((0, self.window), dtype=np.int32)
+        self.cached_lags = np.zeros((0, num_lags), dtype=np.float64)
+        self.has_lags = np.zeros(0, dtype=bool)
+
+        self.last_id = 0
+        self.last_updated = None
+        self._refresh_count = 0
+
+    def _row_for(self, camera_id: str) -> int:
+        row = self.camera_rows.get(camera_id)
+        if row is None:
+            row = self.camera_rows[camera_id] = len(self.camera_rows)
+            self.bucket_ids = np.vstack([self.bucket_ids, np.full((1, self.window), -1, dtype=np.int64)])
+            self.sums = np.vstack([self.sums, np.zeros((1, self.window), dtype=np.float64)])
+            self.counts = np.vstack([self.counts, np.zeros((1, self.window), dtype=np.int32)])
+            self.cached_lags = np.vstack([self.cached_lags, np.zeros((1, self.num_lags), dtype=np.float64)])
+            self.has_lags = np.append(self.has_lags, False)
+        return row
+
+    def refresh(self) -> int:
+        """Đọc các dòng mới từ CSDL và cập nhật trạng thái; trả về số bucket bị thay đổi."""
+        full = self._refresh_count % self.full_refresh_every == 0
+        params = {
+            'bucket_seconds': self.bucket_seconds,
+            'window_seconds': self.bucket_seconds * self.window,
+        }
+        if self.source == 'rollup':
+            query = SQL_UPDATED_ROLLUP_BUCKETS
+            params['since'] = '-infinity' if full or self.last_updated is None else self.last_updated
+        else:
+            query = SQL_NEW_BUCKETS
+            params['last_id'] = 0 if full else self.last_id
+
+        with self.engine.connect() as conn:
+            new_buckets = pd.read_sql(query, conn, params=params)
+
+        # Chỉ xoá trạng thái cũ sau khi truy vấn thành công
+        self._refresh_count += 1
+        if full:
+            self.reset()
+
+        changed = set()
+        absolute = self.source == 'rollup'
+        for camera_id, bucket, object_sum, sample_count, marker in new_buckets.itertuples(index=False):
+            row = self._row_for(camera_id)
+            if self._add(row, int(bucket), float(object_sum), int(sample_count), absolute):
+                changed.add(row)
+            if absolute:
+                self.last_updated = marker if self.last_updated is None else max(self.last_updated, marker)
+            else:
+                self.last_id = max(self.last_id, int(marker))
+
+        for row in changed:
+            self._recompute(row)
+
+        logger.info(
+            f"Lag store {'đọc lại toàn bộ' if full else 'cập nhật'}: {len(new_buckets)} bucket mới, "
+            f"{len(changed)} camera thay đổi (nguồn: {self.source})"
+        )
+        return len(new_buckets)
+
+    def reset(self):
+        self.bucket_ids.fill(-1)
+        self.sums.fill(0)
+        self.counts.fill(0)
+        self.cached_lags.fill(0)
+        self.has_lags.fill(False)
+        self.last_id = 0
+        self.last_updated = None
+
+    def _add(self, row: int, bucket: int, object_sum: float, sample_count: int, absolute: bool = False) -> bool:
+        """Cộng dồn (dữ liệu thô) hoặc ghi đè (giá trị tuyệt đối của bảng tổng hợp) một bucket."""
+        pos = bucket % self.window
+        current = self.bucket_ids[row, pos]
+        if current == bucket and absolute:
+            self.sums[row, pos] = object_sum
+            self.counts[row, pos] = sample_count
+        elif current == bucket:
+            self.sums[row, pos] += object_sum
+            self.counts[row, pos] += sample_count
+        elif current < bucket:
+            # Ô này đang giữ bucket cũ hơn cả cửa sổ -> ghi đè
+            self.bucket_ids[row, pos] = bucket
+            self.sums[row, pos] = object_sum
+            self.counts[row, pos] = sample_count
+        else:
+            # Dữ liệu trễ đã nằm ngoài cửa sổ
+            return False
+        return True
+
+    def _means(self, row: int) -> dict:
+        valid = self.counts[row] > 0
+        return dict(zip(self.bucket_ids[row, valid].tolist(), (self.sums[row, valid] / self.counts[row, valid]).tolist()))
+
+    def _recompute(self, row: int):
+        means = self._means(row)
+        for latest in sorted(means, reverse=True):
+            previous = [latest - lag for lag in range(1, self.num_lags + 1)]
+            if all(bucket in means for bucket in previous):
+                self.cached_lags[row] = [means[bucket] for bucket in previous]
+                self.has_lags[row] = True
+                return
+        self.has_lags[row] = False
+
+    def lags(self, camera_id: str, default=None) -> np.ndarray:
+        row = self.camera_rows.get(camera_id)
+        if row is None or not self.has_lags[row]:
+            return np.zeros(self.num_lags) if default is None else np.asarray(default, dtype=np.float64)
+        return self.cached_lags[row].copy()
+
+    def lag_matrix(self, camera_list) -> np.ndarray:
+        """Ma trận lag (số camera x num_lags); camera chưa đủ dữ liệu nhận [0, 0, 0] như filtered_data()."""
+        matrix = np.zeros((len(camera_list), self.num_lags), dtype=np.float64)
+        for i, camera_id in enumerate(camera_list):
+            row = self.camera_rows.get(camera_id)
+            if row is not None and self.has_lags[row]:
+                matrix[i] = self.cached_lags[row]
+        return matrix
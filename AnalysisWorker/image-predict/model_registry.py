@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+
+import joblib
+import pandas as pd
+
+from compact_forest import CompactForest, export_compact_forest
+
+logger = logging.getLogger(__name__)
+
+MODELS_DIR = os.getenv("MODELS_DIR", "models")
+LATEST_POINTER = "latest.json"
+# compact: nạp bản mảng phẳng (mmap) nếu pointer có; joblib: nạp pickle sklearn
+MODEL_FORMAT = os.getenv("MODEL_FORMAT", "compact")
+
+
+def pointer_path(models_dir: str = MODELS_DIR) -> str:
+    return os.path.join(models_dir, LATEST_POINTER)
+
+
+def _write_atomic(path: str, content: str):
+    # Ghi file tạm rồi os.replace: dịch vụ dự đoán không bao giờ đọc phải file ghi dở
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def publish_model(model, feature_order, minutes: int, metrics: dict = None, models_dir: str = MODELS_DIR) -> dict:
+    """
+    Lưu mô hình + thứ tự feature với tên có timestamp, xuất thêm bản gọn (compact_forest),
+    rồi trỏ `latest.json` sang mô hình đó.
+    Trả về nội dung pointer vừa ghi.
+    """
+    os.makedirs(models_dir, exist_ok=True)
+    stamp = pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")
+    model_path = os.path.join(models_dir, f"global_traffic_model_{minutes}min_{stamp}.joblib")
+    feature_order_path = os.path.join(models_dir, f"FEATURE_ORDER_{stamp}.txt")
+    compact_path = os.path.join(models_dir, f"compact_{minutes}min_{stamp}")
+
+    joblib.dump(model, model_path)
+    _write_atomic(feature_order_path, "".join(f"{name}\n" for name in feature_order))
+    export_compact_forest(model, feature_order, compact_path)
+
+    pointer = {
+        "model_path": os.path.basename(model_path),
+        "feature_order_path": os.path.basename(feature_order_path),
+        "compact_path": os.path.basename(compact_path),
+        "minutes": minutes,
+        "n_estimators": len(getattr(model, "estimators_", [])),
+        "published_at": pd.Timestamp.now().isoformat(),
+        "metrics": metrics or {},
+    }
+    _write_atomic(pointer_path(models_dir), json.dumps(pointer, indent=2))
+    logger.info(f"✅ Đã publish mô hình {model_path} làm bản mới nhất ({pointer['n_estimators']} cây)")
+    return pointer
+
+
+def read_pointer(models_dir: str = MODELS_DIR):
+    try:
+        with open(pointer_path(models_dir)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def load_published(pointer: dict, models_dir: str = MODELS_DIR, model_format: str = "joblib"):
+    """Tải (model, feature_order) mà pointer trỏ tới; model_format='compact' dùng bản mảng phẳng nếu có."""
+    if model_format == "compact" and pointer.get("compact_path"):
+        model = CompactForest.load(os.path.join(models_dir, pointer["compact_path"]))
+        return model, model.feature_order
+
+    model = joblib.load(os.path.join(models_dir, pointer["model_path"]))
+    with open(os.path.join(models_dir, pointer["feature_order_path"])) as f:
+        feature_order = [line.strip() for line in f if line.strip()]
+    return model, feature_order
+
+
+class ModelWatcher:
+    """
+    Giữ mô hình đang dùng và tải lại khi `latest.json` đổi (không cần khởi động lại dịch vụ).
+    Nếu chưa có pointer thì dùng mô hình dự phòng (fallback) truyền vào; nếu tải bản mới lỗi thì giữ bản cũ.
+    """
+
+    def __init__(
+            self,
+            fallback_model=None,
+            fallback_feature_order=None,
+            models_dir: str = MODELS_DIR,
+            model_format: str = MODEL_FORMAT,
+    ):
+        self.models_dir = models_dir
+        self.model_format = model_format
+        self.model = fallback_model
+        self.feature_order = fallback_feature_order
+        self.pointer = None
+
+    def current(self):
+        pointer = read_pointer(self.models_dir)
+        if pointer is not None and pointer != self.pointer:
+            try:
+                self.model, self.feature_order = load_published(pointer, self.models_dir, self.model_format)
+                self.pointer = pointer
+                logger.info(
+                    f"🔄 Đã tải mô hình mới {pointer['model_path']} "
+                    f"(publish lúc {pointer['published_at']}, {pointer['n_estimators']} cây, định dạng {self.model_format})"
+                )
+            except Exception as e:
+                logger.error(f"⚠️ Không tải được mô hình {pointer.get('model_path')}, giữ mô hình cũ: {e}")
+
+        if self.model is None:
+            raise FileNotFoundError(f"Chưa có mô hình nào trong {pointer_path(self.models_dir)}")
+        return self.model, self.feature_order
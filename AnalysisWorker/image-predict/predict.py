@@ -1,13 +1,21 @@
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
 import os
+import sys
 import joblib
 import pandas as pd
 import numpy as np
 from train import create_time_features, CAMERA_LIST
 from datetime import datetime, timedelta
-from validate import filtered_data
+from validate import filtered_data, engine
+from lag_store import LagStateStore
+from model_registry import ModelWatcher
+from compact_forest import CompactForest
+from forecaster import recursive_forecast_matrix
+from forecast_sink import ForecastSink, shared_engine
+# Module dùng chung AnalysisWorker/shared (metrics Prometheus)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+from metrics import start_metrics_server, track
 import time
 import logging  # 👈 Import thư viện logging
 
@@ -22,7 +30,25 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 DB_CONNECTION_STRING = os.getenv("DB_CONNECTION_STRING")
-model_filename = 'global_traffic_model_10min_20251206_2025.joblib'
+# Ghi đè dự đoán cũ cùng (camera, mốc, minutes_resample) thay vì thêm bản trùng mỗi vòng. Chỉ bật khi
+# db-maintenance đã chạy migration 0003: thiếu unique index thì ON CONFLICT lỗi và không dự đoán nào được ghi
+FORECAST_UPSERT = os.getenv("FORECAST_UPSERT", "false").lower() == "true"
+# Endpoint Prometheus (/metrics); 0 để tắt
+METRICS_PORT = int(os.getenv("METRICS_PORT", 8003))
+# Mô hình dự phòng khi chưa có models/latest.json (train.py publish bản mới nhất vào đó)
+model_filename = os.getenv("MODEL_FILENAME", 'global_traffic_model_10min_20251206_2025.joblib')
+
+# Trạng thái lag giữ trong bộ nhớ, mỗi vòng dự đoán chỉ đọc thêm phần thay đổi.
+# LAG_SOURCE=raw gom từ camera_detections, LAG_SOURCE=rollup đọc bảng camera_detection_buckets
+# (cần migration 0002 của db-maintenance)
+lag_store = LagStateStore(engine, minutes=10, num_lags=3, source=os.getenv("LAG_SOURCE", "raw"))
+
+def load_model(path):
+    """Nạp mô hình: thư mục = bản gọn của compact_forest (mmap, kèm thứ tự feature), file = joblib."""
+    if os.path.isdir(path):
+        model = CompactForest.load(path)
+        return model, model.feature_order
+    return joblib.load(path), feature_order()
 
 def feature_order():
     with open("FEATURE_ORDER.txt", "r") as f:
@@ -33,65 +59,6 @@ def feature_order():
     return res
 
 
-def recursive_forecast_all(model, feature_order, camera_list, historical_data_func, minutes, steps=3):
-    forecasts = {}
-    time_step = pd.Timedelta(minutes, unit='m')
-
-    # 1. LẤY THỜI GIAN BẮT ĐẦU DỰ ĐOÁN ĐỒNG NHẤT (ĐÃ LÀM TRÒN)
-    try:
-        _, start_timestamp_floored = historical_data_func(camera_list[0], 3)
-    except IndexError:
-        logger.error("Lỗi: Danh sách camera (camera_list) bị trống.") # 👈 Dùng logger.error
-        return {}
-
-    # 2. TẠO STANDARD INDEX CHỈ MỘT LẦN
-    standard_index = [start_timestamp_floored + (time_step * i) for i in range(1, steps + 1)]
-    logger.info(f"Thời gian bắt đầu dự đoán (Standard Index): {standard_index[0].strftime('%Y-%m-%d %H:%M:%S')} (Bước 1)")
-
-
-    for cam_id in camera_list:
-        logger.info(f"\n--- Dự đoán cho Camera {cam_id} ---") # 👈 Dùng logger.info
-
-        # Lấy 3 giá trị Lag thực tế mới nhất và last_timestamp (Đã floored)
-        historical_lags, last_timestamp = historical_data_func(cam_id, 3)
-        logger.debug(f"Historical Lags cho {cam_id}: {historical_lags}") # Dùng debug cho thông tin chi tiết
-
-        current_lags = historical_lags.copy()
-        cam_forecasts = []
-
-        for i in range(1, steps + 1):
-            next_timestamp = last_timestamp + (time_step * i)
-
-            # 3. Tạo Input DataFrame (X_future)
-            X_future = pd.DataFrame(index=[next_timestamp])
-            # ... (Tạo features như cũ) ...
-
-            X_future = create_time_features(X_future)
-
-            for j, lag in enumerate([1, 2, 3]):
-                X_future[f'total_lag_{lag}'] = current_lags[j]
-
-            for cid in camera_list:
-                X_future[f'cam_{cid}'] = 1 if cid == cam_id else 0
-
-            # 4. Đảm bảo đúng thứ tự cột VÀ chuẩn bị cho mô hình
-            X_future = X_future[feature_order]
-
-            # 5. Dự đoán
-            predicted_value = model.predict(X_future)[0]
-            cam_forecasts.append(predicted_value)
-            logger.info(f"  > Dự đoán bước {i} ({next_timestamp.strftime('%H:%M')}): {predicted_value:.2f}")
-
-            # 6. Cập nhật Lag (Recursive Step)
-            current_lags = np.roll(current_lags, 1)
-            current_lags[0] = predicted_value
-
-        # 7. SỬ DỤNG STANDARD INDEX ĐỒNG NHẤT CHO TẤT CẢ SERIES
-        forecasts[cam_id] = pd.Series(cam_forecasts, index=standard_index)
-
-    return forecasts
-
-
 def get_historical_data_mock(cam_id, num_lags):
     # ... (giữ nguyên) ...
     mock_data = {
@@ -119,6 +86,13 @@ def get_historical_data_real(cam_id, num_lags):
     real_timestamp = floor_timestamp(current_time, 10)
     return np.array(data.get(cam_id, [0, 0, 0])), real_timestamp
 
+def get_historical_lags_real(camera_list, num_lags):
+    """Lấy lag của tất cả camera từ LagStateStore (cập nhật tăng dần, không quét lại toàn bộ dữ liệu)."""
+    with track('lag_refresh'):
+        lag_store.refresh()
+    real_timestamp = floor_timestamp(datetime.now(), 10)
+    return lag_store.lag_matrix(camera_list)[:, :num_lags], real_timestamp
+
 def save_forecast_results_to_db(
         forecasts_df: pd.DataFrame,
         connection_string: str,
@@ -127,33 +101,12 @@ def save_forecast_results_to_db(
 ):
     """
     Lưu kết quả dự đoán vào database, bao gồm cột minutes_resample.
+    Dùng engine chung (không tạo engine mới mỗi lần) và ghi bằng COPY qua ForecastSink.
     """
     try:
-        # ... (kết nối DB và xử lý DataFrame) ...
-        engine = create_engine(connection_string, pool_pre_ping=True, pool_recycle=300)
-
-        df_melted = forecasts_df.reset_index().rename(columns={'index': 'camera_id'})
-        df_melted = df_melted.melt(
-            id_vars=['camera_id'],
-            var_name='forecast_timestamp',
-            value_name='predicted_total_objects'
-        )
-        df_melted['forecast_timestamp'] = pd.to_datetime(df_melted['forecast_timestamp'])
-
-        df_melted['forecast_hour'] = df_melted['forecast_timestamp'].dt.hour
-        df_melted['forecast_dayofweek'] = df_melted['forecast_timestamp'].dt.dayofweek
-        df_melted['forecast_is_weekend'] = df_melted['forecast_dayofweek'].isin([5, 6]).astype(int)
-        df_melted['forecast_is_weekend'] = df_melted['forecast_is_weekend'].astype(bool)
-        df_melted['forecast_dayofyear'] = df_melted['forecast_timestamp'].dt.dayofyear
-        df_melted['forecast_weekofyear'] = df_melted['forecast_timestamp'].dt.isocalendar().week.astype(int)
-        df_melted['forecast_month'] = df_melted['forecast_timestamp'].dt.month
-
-        df_melted['minutes_resample'] = minutes_resample
-        df_melted['prediction_time'] = datetime.now()
-
-        # Lưu vào database.
-        df_melted.to_sql(table_name, engine, if_exists='append', index=False)
-        logger.info(f"✅ Đã lưu {len(df_melted)} dự đoán (Resample: {minutes_resample} phút) vào bảng '{table_name}'.") # 👈 Dùng logger.info
+        sink = ForecastSink(shared_engine(connection_string), table_name, upsert=FORECAST_UPSERT)
+        with track('forecast_write'):
+            sink.write_frame(forecasts_df, minutes_resample)
 
     except Exception as e:
         logger.error(f"❌ Lỗi khi lưu kết quả dự đoán vào DB: {e}") # 👈 Dùng logger.error
@@ -166,10 +119,12 @@ def start_scheduled_prediction_service(
         db_connection_string: str,
         minutes_resample: int,
         prediction_interval_minutes: int,
-        table_name: str = 'camera_predictions'
+        table_name: str = 'camera_predictions',
+        model_watcher: ModelWatcher = None
 ):
     """
     Khởi động dịch vụ dự đoán liên tục, căn chỉnh thời gian chạy theo minutes_resample.
+    Nếu có model_watcher, mỗi vòng lấy mô hình mới nhất (tải lại khi models/latest.json thay đổi).
     """
     steps = prediction_interval_minutes // minutes_resample
     if steps == 0:
@@ -180,28 +135,29 @@ def start_scheduled_prediction_service(
     logger.info(f"   - Dự đoán: {steps} bước ({steps * minutes_resample} phút tương lai)")
 
     interval_minutes = prediction_interval_minutes
+    forecast_sink = ForecastSink(shared_engine(db_connection_string), table_name, upsert=FORECAST_UPSERT)
     while True:
         start_time = time.time()
         current_datetime = datetime.now()
 
         try:
-            all_forecasts = recursive_forecast_all(
-                model,
-                feature_order_list,
-                camera_list,
-                get_historical_data_real,
-                minutes=minutes_resample,
-                steps=steps
-            )
-
-            # 2. Xử lý và Lưu kết quả vào Database
-            forecasts_df = pd.DataFrame(all_forecasts).T
-            save_forecast_results_to_db(
-                forecasts_df,
-                db_connection_string,
-                minutes_resample,
-                table_name
-            )
+            if model_watcher is not None:
+                model, feature_order_list = model_watcher.current()
+
+            # Dự đoán vector hoá: mỗi bước một lần model.predict cho tất cả camera
+            with track('forecast'):
+                timestamps, predictions, time_features = recursive_forecast_matrix(
+                    model,
+                    feature_order_list,
+                    camera_list,
+                    get_historical_lags_real,
+                    minutes=minutes_resample,
+                    steps=steps
+                )
+
+            # 2. Lưu kết quả vào Database (COPY + upsert, dùng lại đặc trưng thời gian đã tính)
+            with track('forecast_write'):
+                forecast_sink.write(camera_list, timestamps, predictions, time_features, minutes_resample)
 
             logger.info(f"✅ Dự đoán hoàn tất lúc {datetime.now().strftime('%H:%M:%S')}") # 👈 Dùng logger.info
 
@@ -234,11 +190,11 @@ def start_scheduled_prediction_service(
 #         final_model = joblib.load(model_filename)
 #         print(f"Mô hình '{model_filename}' đã được tải thành công.")
 #
-#         all_forecasts = recursive_forecast_all(
+#         all_forecasts = recursive_forecast_vectorized(
 #             final_model,
 #             feature_order(),
 #             CAMERA_LIST,
-#             get_historical_data_real,
+#             get_historical_lags_real,
 #             minutes=minutes_resample,
 #             steps=3
 #         )
@@ -271,11 +227,16 @@ if __name__ == "__main__":
     def historical_data_wrapper(cam_id, num_lags):
         return get_historical_data_real(cam_id, num_lags)
 
+    start_metrics_server(METRICS_PORT)
+
     try:
-        final_model = joblib.load(model_filename)
-        logger.info(f"Mô hình '{model_filename}' đã được tải thành công.") # 👈 Dùng logger.info
+        fallback_model, fallback_feature_order = None, None
+        if os.path.exists(model_filename):
+            fallback_model, fallback_feature_order = load_model(model_filename)
+            logger.info(f"Mô hình '{model_filename}' đã được tải thành công.") # 👈 Dùng logger.info
 
-        feature_order_list = feature_order()
+        model_watcher = ModelWatcher(fallback_model, fallback_feature_order)
+        final_model, feature_order_list = model_watcher.current()
 
         start_scheduled_prediction_service(
             model=final_model,
@@ -284,11 +245,12 @@ if __name__ == "__main__":
             db_connection_string=DB_CONNECTION_STRING,
             minutes_resample=minutes_resample,
             prediction_interval_minutes=prediction_interval_minutes,
-            table_name='camera_predictions'
+            table_name='camera_predictions',
+            model_watcher=model_watcher
         )
 
     except FileNotFoundError:
-        logger.error(f"Lỗi: Không tìm thấy file mô hình {model_filename}") # 👈 Dùng logger.error
+        logger.error(f"Lỗi: Không tìm thấy file mô hình {model_filename} hoặc models/latest.json") # 👈 Dùng logger.error
 
     except Exception as e:
         logger.error(f"⚠️ Lỗi khởi động dịch vụ: {e}") # 👈 Dùng logger.error
\ No newline at end of file
@@ -1,4 +1,5 @@
 import os
+import copy
 import joblib
 import pandas as pd
 import numpy as np
@@ -8,9 +9,20 @@ from dotenv import load_dotenv
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_absolute_error, mean_squared_error
 
+from model_registry import MODELS_DIR, load_published, publish_model, read_pointer
 
 load_dotenv()
 DB_CONNECTION_STRING = os.getenv("DB_CONNECTION_STRING")
+# Cache dữ liệu đã resample theo ngày (TrainingDataLoader) và số ngày lịch sử dùng để huấn luyện (trống = tất cả)
+TRAIN_CACHE_DIR = os.getenv("TRAIN_CACHE_DIR", "training_cache")
+TRAIN_HISTORY_DAYS = int(os.getenv("TRAIN_HISTORY_DAYS") or 0) or None
+# TRAIN_MODE: full (tran_ai trên toàn bộ lịch sử) | warm_start (thêm cây trên dữ liệu gần đây) | trống (chỉ tải dữ liệu)
+TRAIN_MODE = os.getenv("TRAIN_MODE", "")
+RETRAIN_RECENT_DAYS = int(os.getenv("RETRAIN_RECENT_DAYS", 7))
+RETRAIN_ADD_TREES = int(os.getenv("RETRAIN_ADD_TREES", 20))
+RETRAIN_MAX_TREES = int(os.getenv("RETRAIN_MAX_TREES", 300))
+# Chỉ publish bản warm start nếu MAE holdout không tệ hơn mô hình hiện tại quá RETRAIN_TOLERANCE (tỉ lệ)
+RETRAIN_TOLERANCE = float(os.getenv("RETRAIN_TOLERANCE", 0.0))
 
 SQL_QUERY = """
             SELECT "created_at", "total_objects", "camera_id"
@@ -77,40 +89,46 @@ def create_lagged_features(df, lags=[1, 2, 3]):
     return df
 
 
-def group_camera_id(traffic_df, minutes):
-    df_resampled_list = []
-
-    for cam_id in traffic_df['camera_id'].unique():
-        df_cam = traffic_df[traffic_df['camera_id'] == cam_id]
-        df_cam_resampled = df_cam['total_objects'].resample(f'{minutes}min').mean().to_frame()
-
-        # 1. TẠO LAG FEATURES TẠI ĐÂY (TRONG VÒNG LẶP)
-        df_cam_resampled = create_lagged_features(df_cam_resampled, lags=[1, 2, 3])
-
-        df_cam_resampled.dropna(inplace=True)  # Loại bỏ NaN của lag
-        df_cam_resampled['camera_id'] = cam_id  # Giữ lại ID camera
-        df_resampled_list.append(df_cam_resampled)
-
-    traffic_df_final = pd.concat(df_resampled_list)
+def group_camera_id(traffic_df, minutes, output_filename=None, sparse=False, lags=[1, 2, 3]):
+    """
+    Resample từng camera về `minutes` phút, tạo lag, one-hot camera và đặc trưng thời gian.
+    Chỉ dùng MỘT groupby(camera_id).resample và shift theo nhóm thay cho vòng lặp lọc từng camera
+    (O(số camera x số dòng)); thứ tự cột giữ nguyên như cũ nên khớp với FEATURE_ORDER.txt.
+    - output_filename: ghi kết quả ra CSV nếu được truyền (mặc định không ghi)
+    - sparse: cột one-hot camera dạng sparse, tiết kiệm bộ nhớ khi có hàng trăm camera
+    """
+    camera_ids = traffic_df['camera_id'].astype('category')
+
+    # 1. Resample theo từng camera (mỗi camera trên khoảng thời gian của riêng nó, như vòng lặp cũ)
+    resampled = (
+        traffic_df['total_objects']
+        .groupby(camera_ids, observed=True)
+        .resample(f'{minutes}min')
+        .mean()
+    )
+
+    # 2. TẠO LAG FEATURES: shift trong từng camera để lag không tràn sang camera khác
+    by_camera = resampled.groupby(level='camera_id', observed=True)
+    traffic_df_final = resampled.to_frame('total_objects')
+    for lag in lags:
+        traffic_df_final[f'total_lag_{lag}'] = by_camera.shift(lag)
+    traffic_df_final.dropna(inplace=True)  # Loại bỏ NaN của lag
 
-    # ⭐ DÒNG LỆNH CẦN BỔ SUNG: Sắp xếp lại theo Index (là cột created_at)
-    traffic_df_final.sort_index(inplace=True)
+    # Sắp xếp theo thời gian (rồi theo camera để thứ tự ổn định)
+    traffic_df_final = traffic_df_final.reset_index().sort_values(['created_at', 'camera_id'], kind='stable')
+    traffic_df_final.set_index('created_at', inplace=True)
 
-    # 2. Tạo One-Hot Encoding VÀ Time Features (Sau khi gộp)
-    df_ohe = pd.get_dummies(traffic_df_final['camera_id'], prefix='cam')
-    traffic_df_final = pd.concat([traffic_df_final, df_ohe], axis=1)
-    traffic_df_final.drop('camera_id', axis=1, inplace=True)
+    # 3. One-Hot Encoding từ mã category (chỉ các camera có dữ liệu) VÀ Time Features
+    cameras = traffic_df_final['camera_id'].cat.remove_unused_categories()
+    df_ohe = pd.get_dummies(cameras, prefix='cam', sparse=sparse)
+    traffic_df_final = pd.concat([traffic_df_final.drop(columns='camera_id'), df_ohe], axis=1)
 
     traffic_df_final = create_time_features(traffic_df_final)
 
-    # Do đã tạo lag trước, chỉ cần xử lý NaN còn sót (nếu có)
-    # traffic_df_final.dropna(inplace=True)
-
-
-    # --- XUẤT RA CSV ---
-    output_filename = 'traffic_df_final.csv'
-    traffic_df_final.to_csv(output_filename, index=True, mode='w')
-    print(f"\n✅ Dữ liệu đã xử lý được lưu vào file: **{output_filename}**")
+    # --- XUẤT RA CSV (tuỳ chọn) ---
+    if output_filename:
+        traffic_df_final.to_csv(output_filename, index=True, mode='w')
+        print(f"\n✅ Dữ liệu đã xử lý được lưu vào file: **{output_filename}**")
 
     print("5 hàng đầu tiên sau khi xử lý (Kiểm tra Lag Features và thứ tự thời gian):")
     # Kiểm tra xem các cột lag có giá trị không
@@ -118,7 +136,7 @@ def group_camera_id(traffic_df, minutes):
 
     return traffic_df_final
 
-def tran_ai(traffic_df, minutes):
+def tran_ai(traffic_df, minutes, publish=True):
     # Tạo DataFrame đã xử lý
     traffic_df_time = group_camera_id(traffic_df, minutes)
 
@@ -194,23 +212,115 @@ def tran_ai(traffic_df, minutes):
 
     print(f"\n✅ Mô hình đã được lưu thành công tại: {model_filename}")
 
-    return model
-
-
-traffic_df = fetch_data_from_postgres(DB_CONNECTION_STRING, SQL_QUERY)
+    if publish:
+        # Trỏ models/latest.json sang mô hình này để dịch vụ dự đoán tự tải lại
+        publish_model(model, list(FEATURE_ORDER), minutes, {
+            'mode': 'full',
+            'holdout_mae': float(mae_global),
+            'holdout_rmse': float(rmse_global),
+        })
 
-if not traffic_df.empty:
-    # print("\n--- 5 Hàng Dữ liệu Đầu tiên ---")
-    # print(traffic_df.head())
-    # print(f"\nTổng số hàng dữ liệu: {len(traffic_df)}")
-
-    # traffic_df = create_time_features(traffic_df)
-    # print("DataFrame sau khi thêm đặc trưng thời gian:")
-    # print(traffic_df.head())
-
-    # group_camera_id(traffic_df, 5)
-    # final_model = tran_ai(traffic_df, 10)
-    # print("\nQuá trình Huấn luyện Mô hình Đa Camera đã hoàn tất.")
-    pass
+    return model
 
 
+def retrain_warm_start(
+        traffic_df,
+        minutes,
+        add_trees=RETRAIN_ADD_TREES,
+        max_trees=RETRAIN_MAX_TREES,
+        holdout_fraction=0.1,
+        tolerance=RETRAIN_TOLERANCE,
+        models_dir=MODELS_DIR,
+):
+    """
+    Huấn luyện tăng dần: lấy mô hình đang publish, thêm `add_trees` cây (warm_start) học trên
+    `traffic_df` (dữ liệu gần đây), bỏ các cây cũ nhất nếu vượt `max_trees`.
+    Bản mới chỉ được publish nếu MAE trên phần holdout (cuối khoảng thời gian) không tệ hơn
+    mô hình hiện tại quá `tolerance`. Chưa có mô hình nào thì huấn luyện đầy đủ bằng tran_ai().
+    """
+    pointer = read_pointer(models_dir)
+    if pointer is None:
+        print("Chưa có mô hình nào được publish, chuyển sang huấn luyện đầy đủ (tran_ai).")
+        return tran_ai(traffic_df, minutes)
+
+    base_model, feature_order = load_published(pointer, models_dir)
+    features = group_camera_id(traffic_df, minutes)
+
+    # Mô hình không có cột cho camera mới: bỏ các dòng đó (cần huấn luyện đầy đủ để thêm camera)
+    unknown_cams = [col for col in features.columns if col.startswith('cam_') and col not in feature_order]
+    if unknown_cams:
+        print(f"⚠️ Bỏ qua {len(unknown_cams)} camera chưa có trong mô hình: {unknown_cams}")
+        features = features[~features[unknown_cams].any(axis=1)]
+
+    X = features.reindex(columns=feature_order, fill_value=False)
+    y = features['total_objects']
+
+    split_index = int(len(X) * (1 - holdout_fraction))
+    X_train, y_train = X.iloc[:split_index], y.iloc[:split_index]
+    X_test, y_test = X.iloc[split_index:], y.iloc[split_index:]
+    if X_train.empty or X_test.empty:
+        print("Không đủ dữ liệu gần đây để huấn luyện tăng dần.")
+        return base_model
+
+    candidate = copy.deepcopy(base_model)
+    candidate.set_params(warm_start=True, n_estimators=len(base_model.estimators_) + add_trees)
+    print(f"\nBắt đầu warm start: thêm {add_trees} cây trên {len(X_train)} dòng (từ {X_train.index.min()})...")
+    candidate.fit(X_train, y_train)
+
+    if len(candidate.estimators_) > max_trees:
+        # Giữ cửa sổ trượt các cây mới nhất để mô hình không phình mãi sau mỗi lần huấn luyện
+        candidate.estimators_ = candidate.estimators_[-max_trees:]
+        candidate.n_estimators = len(candidate.estimators_)
+
+    base_mae = mean_absolute_error(y_test, base_model.predict(X_test))
+    candidate_mae = mean_absolute_error(y_test, candidate.predict(X_test))
+    promoted = candidate_mae <= base_mae * (1 + tolerance)
+
+    print(f"\n--- Kết quả holdout ({len(X_test)} dòng, đến {X_test.index.max()}) ---")
+    print(f"Mô hình hiện tại: MAE={base_mae:.3f} | Bản warm start: MAE={candidate_mae:.3f}")
+
+    if not promoted:
+        print("❌ Bản warm start không tốt hơn, giữ nguyên mô hình hiện tại.")
+        return base_model
+
+    publish_model(candidate, feature_order, minutes, {
+        'mode': 'warm_start',
+        'holdout_mae': float(candidate_mae),
+        'previous_holdout_mae': float(base_mae),
+        'base_model': pointer['model_path'],
+    }, models_dir)
+    return candidate
+
+
+if __name__ == "__main__":
+    import logging
+
+    # Tải theo từng ngày bằng COPY + cache thay cho fetch_data_from_postgres(DB_CONNECTION_STRING, SQL_QUERY)
+    # (đọc cả bảng vào một DataFrame). Chỉ chạy khi gọi trực tiếp, không chạy khi predict/validate import module này.
+    from training_data import TrainingDataLoader
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    loader = TrainingDataLoader(DB_CONNECTION_STRING, minutes=10, cache_dir=TRAIN_CACHE_DIR)
+
+    if TRAIN_MODE == 'warm_start':
+        # Chỉ cần vài ngày gần nhất: nhanh hơn nhiều so với huấn luyện lại toàn bộ lịch sử
+        retrain_warm_start(loader.load(RETRAIN_RECENT_DAYS), 10)
+        raise SystemExit(0)
+
+    traffic_df = loader.load(TRAIN_HISTORY_DAYS)
+    if TRAIN_MODE == 'full' and not traffic_df.empty:
+        tran_ai(traffic_df, 10)
+
+    if not traffic_df.empty:
+        # print("\n--- 5 Hàng Dữ liệu Đầu tiên ---")
+        # print(traffic_df.head())
+        # print(f"\nTổng số hàng dữ liệu: {len(traffic_df)}")
+
+        # traffic_df = create_time_features(traffic_df)
+        # print("DataFrame sau khi thêm đặc trưng thời gian:")
+        # print(traffic_df.head())
+
+        # group_camera_id(traffic_df, 5)
+        # final_model = tran_ai(traffic_df, 10)
+        # print("\nQuá trình Huấn luyện Mô hình Đa Camera đã hoàn tất.")
+        pass
@@ -0,0 +1,132 @@
+import datetime
+import io
+import logging
+import os
+import time
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+logger = logging.getLogger(__name__)
+
+# Mỗi ngày một lần COPY: bộ nhớ đỉnh chỉ bằng dữ liệu thô của MỘT ngày (~170k dòng) thay vì toàn bộ bảng
+SQL_COPY_DAY = """
+    COPY (
+        SELECT "created_at", "camera_id", "total_objects"
+        FROM camera_detections
+        WHERE "created_at" >= '{start}' AND "created_at" < '{end}'
+    ) TO STDOUT WITH (FORMAT csv)
+"""
+
+SQL_TIME_RANGE = 'SELECT MIN("created_at"), MAX("created_at") FROM camera_detections'
+
+RAW_DTYPES = {'camera_id': 'category', 'total_objects': 'int16'}
+
+
+def resample_chunk(raw: pd.DataFrame, minutes: int) -> pd.DataFrame:
+    """
+    Trung bình total_objects theo (camera, bucket `minutes` phút) của một chunk dữ liệu thô.
+    Trả về DataFrame index = created_at (đầu bucket), cột camera_id (category) và total_objects (float32),
+    đúng định dạng group_camera_id/tran_ai nhận vào (resample lại cho ra cùng giá trị).
+    """
+    if raw.empty:
+        return pd.DataFrame(
+            {'camera_id': pd.Series(dtype='category'), 'total_objects': pd.Series(dtype='float32')},
+            index=pd.DatetimeIndex([], name='created_at'),
+        )
+
+    buckets = raw['created_at'].dt.floor(f'{minutes}min')
+    resampled = (
+        raw.groupby([raw['camera_id'], buckets], observed=True)['total_objects']
+        .mean()
+        .astype('float32')
+        .reset_index()
+        .set_index('created_at')
+        .sort_index()
+    )
+    resampled['camera_id'] = resampled['camera_id'].astype('category')
+    return resampled
+
+
+class TrainingDataLoader:
+    """
+    Tải dữ liệu huấn luyện theo từng ngày bằng COPY ... TO STDOUT, resample ngay khi mỗi ngày về,
+    và lưu cache các ngày đã xong trong `cache_dir` để lần huấn luyện sau chỉ tải những ngày mới.
+    Ngày cuối cùng (có thể còn đang nhận dữ liệu) luôn được tải lại và không lưu cache.
+    """
+
+    def __init__(self, connection_string: str, minutes: int = 10, cache_dir: str = 'training_cache'):
+        self.engine = create_engine(connection_string, pool_pre_ping=True, pool_recycle=300)
+        self.minutes = minutes
+        self.cache_dir = os.path.join(cache_dir, f'{minutes}min')
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _cache_path(self, day: datetime.date) -> str:
+        return os.path.join(self.cache_dir, f'{day.isoformat()}.pkl')
+
+    def time_range(self):
+        with self.engine.connect() as conn:
+            first, last = conn.exec_driver_sql(SQL_TIME_RANGE).fetchone()
+        return first, last
+
+    def fetch_day(self, day: datetime.date) -> pd.DataFrame:
+        """COPY dữ liệu thô của một ngày với dtype gọn (camera_id category, total_objects int16)."""
+        buffer = io.BytesIO()
+        sql = SQL_COPY_DAY.format(start=day.isoformat(), end=(day + datetime.timedelta(days=1)).isoformat())
+
+        connection = self.engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.copy_expert(sql, buffer)
+        finally:
+            connection.close()
+
+        buffer.seek(0)
+        return pd.read_csv(
+            buffer,
+            names=['created_at', 'camera_id', 'total_objects'],
+            dtype=RAW_DTYPES,
+            parse_dates=['created_at'],
+        )
+
+    def load_day(self, day: datetime.date, cacheable: bool) -> pd.DataFrame:
+        path = self._cache_path(day)
+        if cacheable and os.path.exists(path):
+            return pd.read_pickle(path)
+
+        resampled = resample_chunk(self.fetch_day(day), self.minutes)
+        if cacheable:
+            # Ghi file tạm rồi đổi tên để cache không bao giờ chứa file ghi dở
+            resampled.to_pickle(f'{path}.tmp')
+            os.replace(f'{path}.tmp', path)
+        return resampled
+
+    def load(self, history_days: int = None) -> pd.DataFrame:
+        """Trả về dữ liệu đã resample của toàn bộ lịch sử (hoặc `history_days` ngày gần nhất)."""
+        started = time.monotonic()
+        first, last = self.time_range()
+        if first is None:
+            logger.warning("Bảng camera_detections chưa có dữ liệu.")
+            return resample_chunk(pd.DataFrame(), self.minutes)
+
+        first_day, last_day = first.date(), last.date()
+        if history_days:
+            first_day = max(first_day, last_day - datetime.timedelta(days=history_days - 1))
+
+        chunks = []
+        fetched = 0
+        day = first_day
+        while day <= last_day:
+            cacheable = day < last_day
+            if not (cacheable and os.path.exists(self._cache_path(day))):
+                fetched += 1
+            chunks.append(self.load_day(day, cacheable))
+            day += datetime.timedelta(days=1)
+
+        result = pd.concat(chunks)
+        result['camera_id'] = result['camera_id'].astype('category')
+        logger.info(
+            f"Đã tải {len(chunks)} ngày ({fetched} ngày từ CSDL, {len(chunks) - fetched} ngày từ cache): "
+            f"{len(result)} bucket {self.minutes} phút trong {time.monotonic() - started:.1f}s"
+        )
+        return result
@@ -109,11 +109,19 @@ def transform_to_lag_dictionary(df_latest_cams: pd.DataFrame) -> dict:
 
     return remove_prefix_from_keys(lag_dict)
 
-traffic_df = get_historical_data(3, 10, engine)
-group_camera_id(traffic_df, 10)
-df = pd.read_csv('traffic_df_final.csv')
+def load_latest_lag_frame(minutes_resample=10, num_lags=3):
+    """Truy vấn cửa sổ gần nhất và tạo lag; trả thẳng DataFrame thay vì ghi rồi đọc lại traffic_df_final.csv."""
+    traffic_df = get_historical_data(num_lags, minutes_resample, engine)
+    return group_camera_id(traffic_df, minutes_resample).reset_index()
 
-def filtered_data():
+
+def filtered_data(df=None):
+    """
+    Lag mới nhất của từng camera. Không còn chạy truy vấn lúc import module:
+    dịch vụ dự đoán dùng LagStateStore (lag_store.py), hàm này chỉ giữ lại để đối chiếu.
+    """
+    if df is None:
+        df = load_latest_lag_frame()
 
     df['created_at'] = pd.to_datetime(df['created_at'])
 
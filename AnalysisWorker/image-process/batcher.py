@@ -0,0 +1,108 @@
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+from metrics import observe_batch, observe_queue_lag, track
+from preprocess import predict_grouped
+
+# Một ảnh đang chờ được gom vào batch (enqueued_at dùng để tính hạn flush)
+PendingFrame = namedtuple('PendingFrame', ['enqueued_at', 'image', 'future', 'imgsz'], defaults=(None,))
+
+_STOP = object()
+
+
+def drain_batch(source: queue.Queue, max_size: int, max_wait: float) -> list:
+    """
+    Lấy tối đa `max_size` phần tử từ hàng đợi.
+    Hạn chờ tính từ lúc phần tử ĐẦU TIÊN được đưa vào hàng đợi (enqueued_at),
+    nên một ảnh không bao giờ phải chờ gom batch lâu hơn `max_wait` giây.
+    Trả về list rỗng nếu gặp tín hiệu dừng.
+    """
+    first = source.get()
+    if first is _STOP:
+        return []
+
+    batch = [first]
+    deadline = first.enqueued_at + max_wait
+
+    while len(batch) < max_size:
+        remaining = deadline - time.monotonic()
+        try:
+            # Hết hạn chờ thì vẫn lấy nốt các ảnh đã có sẵn, nhưng không chờ thêm
+            item = source.get(timeout=remaining) if remaining > 0 else source.get_nowait()
+        except queue.Empty:
+            break
+        if item is _STOP:
+            # Đưa tín hiệu dừng trở lại để vòng lặp kết thúc sau batch này
+            source.put(_STOP)
+            break
+        batch.append(item)
+
+    return batch
+
+
+class InferenceBatcher:
+    """
+    Gom ảnh từ nhiều callback chạy song song thành một lần gọi model([...]).
+    Mỗi callback nhận lại Future chứa kết quả YOLO của đúng ảnh mình gửi.
+    """
+
+    def __init__(self, model, max_batch_size: int = 8, max_wait_ms: float = 50):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='yolo-batcher', daemon=True)
+            self._thread.start()
+            logging.info(
+                f"🚀 Bộ gom batch YOLO đã chạy (batch tối đa: {self.max_batch_size}, chờ tối đa: {self.max_wait * 1000:.0f}ms)"
+            )
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, image, imgsz: int = None) -> Future:
+        """Đưa một ảnh vào hàng đợi, trả về Future của kết quả YOLO."""
+        future = Future()
+        self._queue.put(PendingFrame(time.monotonic(), image, future, imgsz))
+        return future
+
+    def _run(self):
+        while True:
+            batch = drain_batch(self._queue, self.max_batch_size, self.max_wait)
+            if not batch:
+                break
+            self._infer(batch)
+
+    def _infer(self, batch: list):
+        started = time.monotonic()
+        for item in batch:
+            observe_queue_lag('infer', started - item.enqueued_at)
+        observe_batch('infer', len(batch))
+        try:
+            with track('infer'):
+                # Ảnh khác imgsz (ROI từng camera) được chạy thành các lần gọi riêng
+                results_list = predict_grouped(
+                    self.model, [item.image for item in batch], [item.imgsz for item in batch]
+                )
+        except Exception as e:
+            logging.error(f"❌ LỖI YOLO khi xử lý batch {len(batch)} ảnh: {e}")
+            for item in batch:
+                item.future.set_exception(e)
+            return
+
+        for item, results in zip(batch, results_list):
+            item.future.set_result(results)
+
+        logging.info(f"🧠 Đã xử lý batch {len(batch)} ảnh trong {(time.monotonic() - started) * 1000:.0f}ms")
@@ -0,0 +1,311 @@
+"""
+Backend suy luận cho mô hình YOLO của image-process.
+
+DETECTOR_BACKEND chọn cách chạy best.pt:
+  - torch: PyTorch eager như trước
+  - onnx: xuất sang ONNX (batch động) và chạy bằng onnxruntime
+  - openvino: xuất sang OpenVINO IR và chạy bằng OpenVINO runtime
+DETECTOR_INT8=true lượng tử hoá int8 sau huấn luyện (onnx: onnxruntime quantize_static, openvino: NNCF),
+hiệu chuẩn trên ảnh camera trong DETECTOR_CALIBRATION_DIR. Bản xuất được lưu trong DETECTOR_EXPORT_DIR và
+dùng lại ở lần khởi động sau. Mọi backend đều nạp qua ultralytics.YOLO nên kết quả có cùng định dạng Results.
+
+    python detector.py export --backend onnx --int8 --frames ../predicts
+    python detector.py check --backend openvino --int8 --frames ../predicts   # so số đếm từng lớp với PyTorch
+    python detector.py bench --backends torch onnx openvino --int8 --frames ../predicts --batch 1 8
+"""
+import argparse
+import logging
+import os
+import shutil
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+BACKENDS = ('torch', 'onnx', 'openvino')
+
+DETECTOR_BACKEND = os.environ.get('DETECTOR_BACKEND', 'torch').lower()
+DETECTOR_INT8 = os.environ.get('DETECTOR_INT8', 'false').lower() == 'true'
+DETECTOR_WEIGHTS = os.environ.get('DETECTOR_WEIGHTS', 'best.pt')
+DETECTOR_IMGSZ = int(os.environ.get('DETECTOR_IMGSZ', 640))
+DETECTOR_EXPORT_DIR = os.environ.get('DETECTOR_EXPORT_DIR', 'exported')
+DETECTOR_CALIBRATION_DIR = os.environ.get('DETECTOR_CALIBRATION_DIR', 'calibration')
+# Số ảnh hiệu chuẩn tối đa cho int8
+CALIBRATION_MAX_FRAMES = 300
+
+
+def list_frames(frames_dir: str) -> list:
+    if not frames_dir or not os.path.isdir(frames_dir):
+        return []
+    return [
+        os.path.join(frames_dir, name)
+        for name in sorted(os.listdir(frames_dir))
+        if name.lower().endswith(('.jpg', '.jpeg', '.png'))
+    ]
+
+
+def read_frames(frames_dir: str) -> list:
+    """Đọc ảnh thành mảng BGR (giống decode_job của pipeline)."""
+    import cv2
+
+    frames = [cv2.imread(path) for path in list_frames(frames_dir)]
+    return [frame for frame in frames if frame is not None]
+
+
+def calibration_inputs(frames_dir: str, imgsz: int) -> list:
+    """Ảnh hiệu chuẩn đã tiền xử lý đúng như ultralytics: letterbox, BGR->RGB, CHW, chia 255, batch 1."""
+    from ultralytics.data.augment import LetterBox
+
+    letterbox = LetterBox((imgsz, imgsz), auto=False)
+    inputs = []
+    for frame in read_frames(frames_dir)[:CALIBRATION_MAX_FRAMES]:
+        image = letterbox(image=frame)[:, :, ::-1].transpose(2, 0, 1)
+        inputs.append(np.ascontiguousarray(image[None], dtype=np.float32) / 255.0)
+    return inputs
+
+
+def export_path(backend: str, int8: bool, weights: str = DETECTOR_WEIGHTS, imgsz: int = DETECTOR_IMGSZ,
+                export_dir: str = DETECTOR_EXPORT_DIR) -> str:
+    """Đường dẫn bản xuất; hậu tố .onnx / _openvino_model là cách ultralytics nhận ra backend."""
+    if backend == 'torch':
+        return weights
+    stem = f"{os.path.splitext(os.path.basename(weights))[0]}_{imgsz}{'_int8' if int8 else ''}"
+    if backend == 'onnx':
+        return os.path.join(export_dir, f'{stem}.onnx')
+    return os.path.join(export_dir, f'{stem}_openvino_model')
+
+
+def _quantize_onnx(fp32_path: str, int8_path: str, inputs: list):
+    import onnx
+    import onnxruntime
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    input_name = onnxruntime.InferenceSession(fp32_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self):
+            self._items = iter({input_name: item} for item in inputs)
+
+        def get_next(self):
+            return next(self._items, None)
+
+    # Chỉ lượng tử hoá Conv: phần giải mã box ở đầu ra giữ float để số đếm không lệch
+    quantize_static(
+        fp32_path,
+        int8_path,
+        FrameReader(),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        op_types_to_quantize=['Conv'],
+    )
+
+    # Giữ metadata (names, stride, imgsz) mà ultralytics ghi vào bản fp32
+    source, quantized = onnx.load(fp32_path), onnx.load(int8_path)
+    onnx.helper.set_model_props(quantized, {prop.key: prop.value for prop in source.metadata_props})
+    onnx.save(quantized, int8_path)
+
+
+def _quantize_openvino(fp32_dir: str, int8_dir: str, inputs: list):
+    import nncf
+    import openvino as ov
+
+    xml_name = next(name for name in os.listdir(fp32_dir) if name.endswith('.xml'))
+    model = ov.Core().read_model(os.path.join(fp32_dir, xml_name))
+    quantized = nncf.quantize(
+        model,
+        nncf.Dataset(inputs),
+        preset=nncf.QuantizationPreset.MIXED,
+        subset_size=len(inputs),
+        # Giống ultralytics: bỏ qua các phép giải mã box ở đầu Detect
+        ignored_scope=nncf.IgnoredScope(types=['Multiply', 'Subtract', 'Sigmoid']),
+    )
+    os.makedirs(int8_dir, exist_ok=True)
+    ov.save_model(quantized, os.path.join(int8_dir, xml_name))
+    shutil.copy(os.path.join(fp32_dir, 'metadata.yaml'), os.path.join(int8_dir, 'metadata.yaml'))
+
+
+def export_model(backend: str, int8: bool = False, weights: str = DETECTOR_WEIGHTS, imgsz: int = DETECTOR_IMGSZ,
+                 export_dir: str = DETECTOR_EXPORT_DIR, calibration_dir: str = DETECTOR_CALIBRATION_DIR) -> str:
+    """Xuất best.pt sang `backend` (nếu chưa có), lượng tử hoá int8 nếu cần; trả về đường dẫn bản xuất."""
+    if backend not in BACKENDS:
+        raise ValueError(f"DETECTOR_BACKEND không hợp lệ: {backend} (chọn {', '.join(BACKENDS)})")
+    target = export_path(backend, int8, weights, imgsz, export_dir)
+    if backend == 'torch' or os.path.exists(target):
+        return target
+
+    from ultralytics import YOLO
+
+    os.makedirs(export_dir, exist_ok=True)
+    fp32_target = export_path(backend, False, weights, imgsz, export_dir)
+    if not os.path.exists(fp32_target):
+        started = time.monotonic()
+        exported = YOLO(weights).export(format=backend, imgsz=imgsz, dynamic=True, half=False)
+        # ultralytics ghi cạnh file weights; chuyển vào thư mục export với tên có imgsz
+        shutil.move(str(exported), fp32_target)
+        logging.info(f"📦 Đã xuất {weights} sang {backend} ({fp32_target}) trong {time.monotonic() - started:.0f}s")
+
+    if not int8:
+        return fp32_target
+
+    inputs = calibration_inputs(calibration_dir, imgsz)
+    if not inputs:
+        raise FileNotFoundError(f"Cần ảnh hiệu chuẩn trong {calibration_dir} để lượng tử hoá int8")
+
+    started = time.monotonic()
+    if backend == 'onnx':
+        _quantize_onnx(fp32_target, target, inputs)
+    else:
+        _quantize_openvino(fp32_target, target, inputs)
+    logging.info(f"📦 Đã lượng tử hoá int8 ({len(inputs)} ảnh hiệu chuẩn): {target} trong {time.monotonic() - started:.0f}s")
+    return target
+
+
+def load_detector(backend: str = DETECTOR_BACKEND, int8: bool = DETECTOR_INT8, weights: str = DETECTOR_WEIGHTS,
+                  imgsz: int = DETECTOR_IMGSZ, export_dir: str = DETECTOR_EXPORT_DIR,
+                  calibration_dir: str = DETECTOR_CALIBRATION_DIR, fallback: bool = True):
+    """
+    Nạp mô hình YOLO theo backend đã chọn. Nếu xuất/nạp backend lỗi và `fallback`,
+    ghi log và quay về PyTorch để dịch vụ vẫn chạy.
+    """
+    from ultralytics import YOLO
+
+    try:
+        path = export_model(backend, int8, weights, imgsz, export_dir, calibration_dir)
+        model = YOLO(path, task='detect', verbose=False)
+    except Exception as e:
+        if not fallback or backend == 'torch':
+            raise
+        logging.error(f"❌ Không nạp được backend {backend}{' int8' if int8 else ''}, quay về PyTorch: {e}")
+        return YOLO(weights, verbose=False)
+
+    logging.info(f"🧠 Mô hình YOLO: backend {backend}{' int8' if int8 and backend != 'torch' else ''} ({path})")
+    return model
+
+
+def class_counts(results) -> Counter:
+    names = results.names
+    return Counter(names[int(class_id)] for class_id in results.boxes.cls.tolist())
+
+
+def compare_counts(reference_model, candidate_model, frames: list) -> dict:
+    """So số đếm từng lớp của hai mô hình trên cùng các ảnh (chỉ số mà image-process lưu vào CSDL)."""
+    reference = [class_counts(r) for r in reference_model(frames, verbose=False)]
+    candidate = [class_counts(r) for r in candidate_model(frames, verbose=False)]
+
+    classes = sorted(set().union(*reference, *candidate))
+    per_class = {}
+    for name in classes:
+        errors = [abs(ref[name] - cand[name]) for ref, cand in zip(reference, candidate)]
+        per_class[name] = {
+            'reference': sum(ref[name] for ref in reference),
+            'candidate': sum(cand[name] for cand in candidate),
+            'mean_abs_error': float(np.mean(errors)),
+        }
+
+    total_errors = [abs(sum(ref.values()) - sum(cand.values())) for ref, cand in zip(reference, candidate)]
+    return {
+        'frames': len(frames),
+        'exact_match': float(np.mean([ref == cand for ref, cand in zip(reference, candidate)])),
+        'total_mean_abs_error': float(np.mean(total_errors)),
+        'per_class': per_class,
+    }
+
+
+def benchmark(model, frames: list, batch_size: int, iterations: int, warmup: int = 3) -> dict:
+    """Độ trễ mỗi lần gọi model(batch) (ms) với batch lấy vòng từ `frames`."""
+    batch = [frames[i % len(frames)] for i in range(batch_size)]
+    for _ in range(warmup):
+        model(batch, verbose=False)
+
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        model(batch, verbose=False)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return {
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'per_frame_ms': float(np.percentile(latencies, 50)) / batch_size,
+    }
+
+
+def _command_export(args):
+    path = export_model(args.backend, args.int8, args.weights, args.imgsz, args.export_dir, args.frames)
+    print(f"✅ {path}")
+
+
+def _command_check(args):
+    from ultralytics import YOLO
+
+    frames = read_frames(args.frames)
+    if not frames:
+        raise SystemExit(f"Không có ảnh nào trong {args.frames}")
+    reference = YOLO(args.weights, verbose=False)
+    candidate = load_detector(args.backend, args.int8, args.weights, args.imgsz, args.export_dir, args.frames,
+                              fallback=False)
+    report = compare_counts(reference, candidate, frames)
+
+    print(f"{args.backend}{' int8' if args.int8 else ''} so với PyTorch trên {report['frames']} ảnh: "
+          f"{report['exact_match']:.0%} ảnh đếm trùng khớp, lệch tổng trung bình {report['total_mean_abs_error']:.2f}")
+    print(f"{'lớp':<14} {'PyTorch':>8} {args.backend:>8} {'lệch/ảnh':>9}")
+    for name, stats in report['per_class'].items():
+        print(f"{name:<14} {stats['reference']:>8} {stats['candidate']:>8} {stats['mean_abs_error']:>9.2f}")
+
+    if report['total_mean_abs_error'] > args.max_count_error:
+        print(f"❌ Lệch tổng {report['total_mean_abs_error']:.2f} > ngưỡng {args.max_count_error}")
+        sys.exit(1)
+
+
+def _command_bench(args):
+    frames = read_frames(args.frames)
+    if not frames:
+        raise SystemExit(f"Không có ảnh nào trong {args.frames}")
+
+    print(f"{'backend':<14} {'nạp (s)':>8} {'batch':>6} {'p50 (ms)':>10} {'p99 (ms)':>10} {'ms/ảnh':>8}")
+    for backend in args.backends:
+        int8 = args.int8 and backend != 'torch'
+        started = time.perf_counter()
+        model = load_detector(backend, int8, args.weights, args.imgsz, args.export_dir, args.frames, fallback=False)
+        model(frames[:1], verbose=False)
+        load_seconds = time.perf_counter() - started
+        label = f"{backend}{' int8' if int8 else ''}"
+        for batch_size in args.batch:
+            stats = benchmark(model, frames, batch_size, args.iterations)
+            print(f"{label:<14} {load_seconds:>8.1f} {batch_size:>6} {stats['p50_ms']:>10.1f} "
+                  f"{stats['p99_ms']:>10.1f} {stats['per_frame_ms']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--weights', default=DETECTOR_WEIGHTS)
+    parser.add_argument('--imgsz', type=int, default=DETECTOR_IMGSZ)
+    parser.add_argument('--export-dir', default=DETECTOR_EXPORT_DIR)
+    parser.add_argument('--frames', default=DETECTOR_CALIBRATION_DIR, help='thư mục ảnh camera (hiệu chuẩn / kiểm tra)')
+    parser.add_argument('--int8', action='store_true', default=DETECTOR_INT8)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help='xuất (và lượng tử hoá) mô hình')
+    export.add_argument('--backend', choices=BACKENDS, default=DETECTOR_BACKEND)
+    export.set_defaults(handler=_command_export)
+
+    check = commands.add_parser('check', help='so số đếm từng lớp với mô hình PyTorch')
+    check.add_argument('--backend', choices=BACKENDS, default=DETECTOR_BACKEND)
+    check.add_argument('--max-count-error', type=float, default=0.5, help='lệch tổng trung bình tối đa mỗi ảnh')
+    check.set_defaults(handler=_command_check)
+
+    bench = commands.add_parser('bench', help='đo thời gian nạp và độ trễ suy luận')
+    bench.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    bench.add_argument('--batch', type=int, nargs='+', default=[1, 8])
+    bench.add_argument('--iterations', type=int, default=20)
+    bench.set_defaults(handler=_command_bench)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
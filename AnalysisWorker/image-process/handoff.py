@@ -0,0 +1,115 @@
+import json
+import logging
+import os
+import socketserver
+import struct
+import threading
+from typing import Callable
+
+from metrics import observe_frame
+
+# Khung dữ liệu: [độ dài header (4 byte)][độ dài ảnh (4 byte)][header JSON][bytes ảnh]
+FRAME_PREFIX = struct.Struct('!II')
+
+
+class LocalMessage:
+    """
+    Thay cho tin nhắn Pub/Sub với ảnh nhận qua socket. Không có Pub/Sub gửi lại nên NACK gọi `redeliver()`
+    (đưa lại ảnh vào pipeline) sau `retry_delay * số lần đã thử` giây, tối đa `max_attempts` lần; quá số lần đó
+    (hoặc tiến trình dừng giữa chừng) thì ảnh bị bỏ: chế độ local là at-most-once sau các lần thử lại.
+    """
+
+    def __init__(self, message_id: str, redeliver: Callable[[], None] = None, delivery_attempt: int = 1,
+                 max_attempts: int = 3, retry_delay: float = 5.0):
+        self.message_id = message_id
+        self.redeliver = redeliver
+        self.delivery_attempt = delivery_attempt
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._settled = False
+        self._lock = threading.Lock()
+
+    def _settle(self) -> bool:
+        with self._lock:
+            if self._settled:
+                return False
+            self._settled = True
+            return True
+
+    def ack(self):
+        self._settle()
+
+    def nack(self):
+        if not self._settle():
+            return
+        if self.redeliver is None or self.delivery_attempt >= self.max_attempts:
+            logging.error(f"❌ Bỏ ảnh nhận qua socket {self.message_id} sau {self.delivery_attempt} lần xử lý lỗi")
+            observe_frame('local', 'dropped')
+            return
+
+        delay = self.retry_delay * self.delivery_attempt
+        logging.warning(f"🔁 Gửi lại ảnh nhận qua socket {self.message_id} sau {delay:.0f}s (lần {self.delivery_attempt + 1})")
+        observe_frame('local', 'retried')
+        # Luồng riêng: luồng gọi NACK (bộ ghi CSDL, pipeline) không được chặn khi pipeline đang đầy
+        timer = threading.Timer(delay, self.redeliver)
+        timer.daemon = True
+        timer.start()
+
+
+def _read_exactly(stream, size: int):
+    data = stream.read(size)
+    if len(data) < size:
+        return None
+    return data
+
+
+class _FrameHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        logging.info("🔌 camera-ingest đã kết nối qua socket.")
+        while True:
+            prefix = _read_exactly(self.rfile, FRAME_PREFIX.size)
+            if prefix is None:
+                break
+            header_len, image_len = FRAME_PREFIX.unpack(prefix)
+            header_bytes = _read_exactly(self.rfile, header_len)
+            image = _read_exactly(self.rfile, image_len)
+            if header_bytes is None or image is None:
+                logging.warning("Khung dữ liệu qua socket bị cắt ngang, bỏ qua.")
+                break
+            try:
+                # on_frame có thể chặn khi pipeline đầy -> socket ngừng đọc -> camera-ingest chậm lại
+                self.server.on_frame(json.loads(header_bytes), image)
+            except Exception as e:
+                logging.error(f"❌ Lỗi xử lý ảnh nhận qua socket: {e}")
+        logging.info("🔌 camera-ingest đã ngắt kết nối socket.")
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class FrameHandoffServer:
+    """Nhận ảnh trực tiếp từ camera-ingest chạy cùng máy qua Unix domain socket."""
+
+    def __init__(self, socket_path: str, on_frame: Callable[[dict, bytes], None]):
+        self.socket_path = socket_path
+        self.on_frame = on_frame
+        self._server = None
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.socket_path) or '.', exist_ok=True)
+        # Xoá socket cũ còn sót lại từ lần chạy trước
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        self._server = _ThreadingUnixServer(self.socket_path, _FrameHandler)
+        self._server.on_frame = self.on_frame
+        threading.Thread(target=self._server.serve_forever, name='frame-handoff', daemon=True).start()
+        logging.info(f"🚀 Đang nhận ảnh trực tiếp qua socket {self.socket_path}")
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,184 @@
+"""
+Pool tiến trình suy luận YOLO trong một container image-process (INFERENCE_WORKERS > 0).
+
+Tiến trình chính (subscriber + pipeline + ghi CSDL) nạp mô hình một lần rồi fork N tiến trình con:
+trọng số mô hình được chia sẻ copy-on-write thay vì mỗi bản `--scale` nạp một bản riêng. Mỗi tiến trình
+con được ghim vào một nhóm core (os.sched_setaffinity) và đặt số luồng torch bằng số core đó, nên
+các worker không tranh core của nhau. Ảnh đi qua Pipe của từng worker, kết quả YOLO trả về cùng Pipe.
+
+Phải start() TRƯỚC khi mở bất kỳ luồng hay kết nối nào (metrics server, pool CSDL, gRPC Pub/Sub):
+fork một tiến trình đã có luồng có thể để lại khoá đang bị giữ trong tiến trình con.
+"""
+import gc
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+from typing import Callable
+
+from preprocess import predict_grouped
+
+# Thời gian chờ tối đa mỗi lần hỏi worker rảnh (để phát hiện khi mọi worker đã chết)
+IDLE_POLL_SECONDS = 1.0
+
+
+def split_cores(cores: list, workers: int) -> list:
+    """Chia các core được phép dùng thành `workers` nhóm liên tiếp, kích thước chênh nhau tối đa 1."""
+    cores = sorted(cores)
+    workers = max(1, min(workers, len(cores)))
+    size, extra = divmod(len(cores), workers)
+    groups, start = [], 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(cores[start:end])
+        start = end
+    return groups
+
+
+def _worker_main(index: int, conn, model, cores: list, threads: int):
+    # Ctrl+C chỉ do tiến trình chính xử lý; worker dừng khi Pipe bị đóng
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    os.sched_setaffinity(0, cores)
+
+    import torch
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Đã được đặt trong tiến trình cha trước khi fork
+        pass
+    logging.info(f"🧠 Worker suy luận {index} (pid {os.getpid()}): core {cores}, {threads} luồng torch")
+
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            break
+        if request is None:
+            break
+
+        images, imgsizes = request
+        try:
+            results_list = predict_grouped(model, images, imgsizes)
+            for results in results_list:
+                # Không gửi lại ảnh gốc qua Pipe: summarize_results chỉ cần boxes và names
+                results.orig_img = None
+            conn.send(('ok', results_list))
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+
+
+class InferencePool:
+    """
+    N tiến trình con chạy YOLO. `predict()` an toàn khi gọi từ nhiều luồng: mỗi lời gọi mượn một worker
+    rảnh, gửi cả batch qua Pipe và chờ kết quả; pipeline chạy một luồng infer cho mỗi worker.
+    """
+
+    def __init__(self, model, workers: int, threads_per_worker: int = 0, on_exhausted: Callable = None):
+        self.model = model
+        self.core_groups = split_cores(list(os.sched_getaffinity(0)), workers)
+        if len(self.core_groups) < workers:
+            logging.warning(f"Chỉ có {len(self.core_groups)} core được phép dùng, giảm INFERENCE_WORKERS từ {workers}")
+        self.threads_per_worker = threads_per_worker
+        self.on_exhausted = on_exhausted
+        self._idle = queue.Queue()
+        self._processes = []
+        self._alive = 0
+        self._busy = 0
+        self._completed = 0
+        self._lock = threading.Lock()
+
+    @property
+    def workers(self) -> int:
+        return len(self.core_groups)
+
+    def start(self):
+        context = multiprocessing.get_context('fork')
+        # Đưa các object hiện có ra khỏi vùng quét của GC để tiến trình con không chạm (và sao chép) các trang nhớ đó
+        gc.freeze()
+        for index, cores in enumerate(self.core_groups):
+            parent_conn, child_conn = context.Pipe()
+            threads = self.threads_per_worker or len(cores)
+            process = context.Process(
+                target=_worker_main,
+                args=(index, child_conn, self.model, cores, threads),
+                name=f'inference-worker-{index}',
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            self._processes.append(process)
+            self._idle.put((index, parent_conn))
+        self._alive = len(self._processes)
+        logging.info(f"🚀 Pool suy luận đã chạy: {self.workers} tiến trình, core {self.core_groups}")
+        return self
+
+    def stop(self):
+        while True:
+            try:
+                _, conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            conn.close()
+        for process in self._processes:
+            process.join(timeout=5)
+
+    def predict(self, images: list, imgsizes: list) -> list:
+        """Chạy một batch trên worker rảnh đầu tiên, trả kết quả YOLO theo thứ tự `images`."""
+        index, conn = self._acquire()
+        with self._lock:
+            self._busy += 1
+        lost = False
+        try:
+            conn.send((images, imgsizes))
+            status, payload = conn.recv()
+        except (EOFError, OSError) as e:
+            # Chỉ Pipe hỏng mới là worker đã chết; lỗi khác (pickle, payload quá lớn...) không làm lệch Pipe
+            lost = True
+            self._lost(index, conn, e)
+            raise RuntimeError(f"Worker suy luận {index} đã dừng: {e}") from e
+        finally:
+            with self._lock:
+                self._busy -= 1
+            if not lost:
+                self._idle.put((index, conn))
+
+        if status == 'error':
+            raise RuntimeError(payload)
+        with self._lock:
+            self._completed += 1
+        return payload
+
+    def snapshot(self) -> dict:
+        return {'workers': self.workers, 'alive': self._alive, 'busy': self._busy, 'batches': self._completed}
+
+    def _acquire(self) -> tuple:
+        while True:
+            if self._alive == 0:
+                raise RuntimeError("Không còn worker suy luận nào hoạt động")
+            try:
+                return self._idle.get(timeout=IDLE_POLL_SECONDS)
+            except queue.Empty:
+                continue
+
+    def _lost(self, index: int, conn, error: Exception):
+        conn.close()
+        process = self._processes[index]
+        process.join(timeout=1)
+        with self._lock:
+            self._alive -= 1
+            alive = self._alive
+        logging.error(
+            f"❌ Worker suy luận {index} (pid {process.pid}) đã dừng (exitcode {process.exitcode}): {error}. "
+            f"Còn {alive}/{self.workers} worker."
+        )
+        # Không fork lại được khi tiến trình chính đã có luồng: để main quyết định (thường là thoát cho Docker khởi động lại)
+        if alive == 0 and self.on_exhausted:
+            self.on_exhausted()
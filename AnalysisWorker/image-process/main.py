@@ -1,16 +1,31 @@
 import os
+import sys
 import json
-import io
+import zlib
 from minio import Minio
-from ultralytics import YOLO
-from PIL import Image
+from minio.deleteobjects import DeleteObject
 from collections import Counter
 from google.cloud import pubsub_v1
 import datetime
 import logging
-import psycopg
+import threading
+from psycopg_pool import ConnectionPool
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+# Nạp .env trước khi import detector/preprocess vì các module này đọc cấu hình lúc import
 load_dotenv()
+# Module dùng chung AnalysisWorker/shared (trong Docker đã được COPY cạnh main.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+from metrics import observe_queue_lag, register_snapshot, start_metrics_server, timed
+from batcher import InferenceBatcher
+from pipeline import GroupedMessage, ImagePipeline, Job
+from writer import DetectionWriter
+from detector import load_detector
+from preprocess import FramePreprocessor, predict_grouped
+from inference_pool import InferencePool
+from motion import MotionGate, thumbnail
+from processed_keys import ProcessedKeyCache
+from handoff import FrameHandoffServer, LocalMessage
 
 # --- 1. Cấu hình & Khởi tạo ---
 # Thiết lập logging cơ bản
@@ -31,15 +46,81 @@ minio_client = Minio(
     secure=False
 )
 
-# Tải mô hình YOLO (Tắt verbose để chỉ in log bạn muốn)
-model = YOLO("best.pt", verbose=False)
+# Tải mô hình YOLO theo DETECTOR_BACKEND (torch | onnx | openvino, int8 tuỳ chọn)
+model = load_detector()
+
+# Giải mã giảm độ phân giải + ROI/imgsz riêng từng camera (PREPROCESS_CONFIG)
+preprocessor = FramePreprocessor.from_file()
+
+# Cấu hình gom batch YOLO: flush khi đủ YOLO_BATCH_SIZE ảnh hoặc hết YOLO_BATCH_WAIT_MS
+YOLO_BATCH_SIZE = int(os.environ.get('YOLO_BATCH_SIZE', 8))
+YOLO_BATCH_WAIT_MS = float(os.environ.get('YOLO_BATCH_WAIT_MS', 50))
+batcher = InferenceBatcher(model, YOLO_BATCH_SIZE, YOLO_BATCH_WAIT_MS)
+
+# Pool tiến trình suy luận (cần PIPELINE_ENABLED): fork INFERENCE_WORKERS tiến trình dùng chung trọng số mô hình,
+# mỗi tiến trình một nhóm core; INFERENCE_THREADS = số luồng torch mỗi worker (0 = bằng số core của nhóm)
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 0))
+INFERENCE_THREADS = int(os.environ.get('INFERENCE_THREADS', 0))
+inference_pool = None
+
+# Cấu hình pipeline nhiều công đoạn (tắt bằng PIPELINE_ENABLED=false để quay về callback tuần tự)
+PIPELINE_ENABLED = os.environ.get('PIPELINE_ENABLED', 'true').lower() == 'true'
+PIPELINE_IO_WORKERS = int(os.environ.get('PIPELINE_IO_WORKERS', 8))
+PIPELINE_DECODE_WORKERS = int(os.environ.get('PIPELINE_DECODE_WORKERS', 2))
+PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', 32))
+PIPELINE_METRICS_INTERVAL = float(os.environ.get('PIPELINE_METRICS_INTERVAL', 30))
+
+# Chế độ 'local': nhận ảnh thẳng từ camera-ingest cùng máy qua Unix socket (cần PIPELINE_ENABLED)
+HANDOFF_MODE = os.environ.get('HANDOFF_MODE', 'pubsub').lower()
+HANDOFF_SOCKET_PATH = os.environ.get('HANDOFF_SOCKET_PATH', '/run/datapolisx/frames.sock')
+# Ảnh qua socket không có Pub/Sub gửi lại: lỗi xử lý/ghi CSDL thì tự đưa lại vào pipeline tối đa chừng này lần
+HANDOFF_MAX_ATTEMPTS = int(os.environ.get('HANDOFF_MAX_ATTEMPTS', 3))
+HANDOFF_RETRY_DELAY_SECONDS = float(os.environ.get('HANDOFF_RETRY_DELAY_SECONDS', 5))
+
+# Cấu hình ghi CSDL theo lô: flush khi đủ DB_BATCH_SIZE dòng hoặc hết DB_FLUSH_INTERVAL_MS
+DB_BATCH_SIZE = int(os.environ.get('DB_BATCH_SIZE', 100))
+DB_FLUSH_INTERVAL_MS = float(os.environ.get('DB_FLUSH_INTERVAL_MS', 500))
+# Cập nhật bảng tổng hợp 10 phút camera_detection_buckets cùng lô ghi. Chỉ bật khi db-maintenance đã chạy
+# migration 0002: thiếu bảng/hàm tổng hợp thì mọi lô ghi đều lỗi và không kết quả nào được lưu
+ROLLUP_ENABLED = os.environ.get('ROLLUP_ENABLED', 'false').lower() == 'true'
+
+# Cổng chuyển động (cần PIPELINE_ENABLED và migration 0004 của db-maintenance): ảnh gần như không đổi so với
+# lần chạy YOLO gần nhất của camera thì ghi lại kết quả đó (carried_forward) thay vì suy luận lại
+MOTION_GATE_ENABLED = os.environ.get('MOTION_GATE_ENABLED', 'false').lower() == 'true'
+MOTION_THRESHOLD = float(os.environ.get('MOTION_THRESHOLD', 0.01))
+MOTION_PIXEL_DELTA = float(os.environ.get('MOTION_PIXEL_DELTA', 15))
+MOTION_MAX_STALENESS_SECONDS = float(os.environ.get('MOTION_MAX_STALENESS_SECONDS', 300))
+MOTION_THUMBNAIL_WIDTH = int(os.environ.get('MOTION_THUMBNAIL_WIDTH', 64))
+motion_gate = MotionGate(MOTION_THRESHOLD, MOTION_PIXEL_DELTA, MOTION_MAX_STALENESS_SECONDS) if MOTION_GATE_ENABLED else None
+
+# Cache key đã lưu CSDL, kiểm tra trước khi tải ảnh để ACK ngay tin nhắn gửi lại/trùng; 0 để tắt
+PROCESSED_KEY_CACHE_SIZE = int(os.environ.get('PROCESSED_KEY_CACHE_SIZE', 100_000))
+PROCESSED_KEY_LOOKUP_WAIT_MS = float(os.environ.get('PROCESSED_KEY_LOOKUP_WAIT_MS', 5))
+processed_keys = None
+
+# Endpoint Prometheus (/metrics); 0 để tắt
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 8002))
 
 # Cấu hình Pub/Sub
 SUBSCRIPTION_ID = os.environ.get('PUBSUB_SUBSCRIPTION_ID')
 timeout = 60.0
+# Giá trị attribute 'encoding' của payload gọn do camera-ingest gửi (PUBLISH_ENCODING=compact)
+COMPACT_ENCODING = 'zlib+json'
+# Số callback chạy song song phải >= kích thước batch thì batch mới đầy được
+SUBSCRIBER_MAX_WORKERS = int(os.environ.get('SUBSCRIBER_MAX_WORKERS', max(10, YOLO_BATCH_SIZE * 2)))
+# Số tin nhắn chưa ACK tối đa; ở chế độ pipeline callback trả về ngay nên cần đủ để lấp đầy các hàng đợi
+SUBSCRIBER_MAX_MESSAGES = int(os.environ.get(
+    'SUBSCRIBER_MAX_MESSAGES',
+    PIPELINE_QUEUE_SIZE * 2 if PIPELINE_ENABLED else SUBSCRIBER_MAX_WORKERS * 2
+))
+
+# Pool kết nối CSDL: mặc định bằng số callback chạy song song (+1 cho bộ ghi theo lô)
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', SUBSCRIBER_MAX_WORKERS + 1))
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', min(2, DB_POOL_MAX_SIZE)))
 
 
 # --- 2. Hàm Tải Object từ MinIO ---
+@timed('download', outcome=lambda data: 'ok' if data else 'error')
 def get_object_as_bytes(bucket_name, object_key):
     """Tải một object từ MinIO vào bộ nhớ (bytes)"""
     try:
@@ -57,98 +138,259 @@ def get_object_as_bytes(bucket_name, object_key):
 
 
 # --- 3. Hàm Xử lý Ảnh YOLO và Xuất JSON ---
-def image_process(bucket_name: str, object_key: str):
-    image_data = get_object_as_bytes(bucket_name, object_key)
+def parse_object_key(object_key: str):
+    """Tách camera_id và thời điểm chụp từ tên object (image_<camera_id>_<YYYYmmdd>_<HHMMSS>.jpeg)"""
+    parts = object_key.split("_")
 
-    if not image_data:
-        return {"status": "error", "message": "Failed to download image from MinIO."}
+    camera_id = parts[1]  # Ví dụ: 5deb576d1dc17d7c5515ad0c
+    date_part = parts[2]  # Ví dụ: 20251130
+
+    time_part_with_ext = parts[3]  # Ví dụ: 211419.jpeg
+    time_part = time_part_with_ext.split('.')[0]  # Ví dụ: 211419
+
+    datetime_string_raw = f"{date_part}_{time_part}"  # Ví dụ: 20251130_211419
+
+    datetime_object = datetime.datetime.strptime(datetime_string_raw, '%Y%m%d_%H%M%S')
+
+    return camera_id, datetime_object.isoformat()
 
-    try:
-        logging.info("Bắt đầu xử lý dữ liệu ảnh...")
-        image_pil = Image.open(io.BytesIO(image_data))
 
-        results_list = model(image_pil)
+def key_timestamp(object_key: str) -> datetime.datetime:
+    """Thời điểm chụp (= created_at trong CSDL) của một object key."""
+    return datetime.datetime.fromisoformat(parse_object_key(object_key)[1])
 
-        results = results_list[0]
 
-        boxes = results.boxes
-        class_ids = boxes.cls.tolist()
-        names = results.names
+def summarize_results(results, object_key: str) -> dict:
+    """Chuyển kết quả YOLO của một ảnh thành dict đếm phương tiện để lưu CSDL."""
+    boxes = results.boxes
+    class_ids = boxes.cls.tolist()
+    names = results.names
 
-        arr = [names[int(cls_id)] for cls_id in class_ids]
-        object_counts = dict(Counter(arr))
+    arr = [names[int(cls_id)] for cls_id in class_ids]
+    object_counts = dict(Counter(arr))
 
-        parts = object_key.split("_")
+    camera_id, create_at_string = parse_object_key(object_key)
 
-        camera_id = parts[1]  # Ví dụ: 5deb576d1dc17d7c5515ad0c
-        date_part = parts[2]  # Ví dụ: 20251130
+    output_data = {
+        "status": "success",
+        "minio_key": object_key,
+        "camera_id": camera_id,
+        "detections": object_counts,
+        "total_objects": len(boxes),
+        "create_at": create_at_string
+    }
 
-        time_part_with_ext = parts[3]  # Ví dụ: 211419.jpeg
-        time_part = time_part_with_ext.split('.')[0]  # Ví dụ: 211419
+    json_output = json.dumps(output_data, indent=4)
+    logging.info(f"\n--- 📝 KẾT QUẢ XỬ LÝ JSON ---\n{json_output}")
+    return output_data
 
-        datetime_string_raw = f"{date_part}_{time_part}"  # Ví dụ: 20251130_211419
 
-        datetime_object = datetime.datetime.strptime(datetime_string_raw, '%Y%m%d_%H%M%S')
+def image_process(bucket_name: str, object_key: str):
+    image_data = get_object_as_bytes(bucket_name, object_key)
 
-        create_at_string = datetime_object.isoformat()
-        output_data = {
-            "status": "success",
-            "minio_key": object_key,
-            "camera_id": camera_id,
-            "detections": object_counts,
-            "total_objects": len(boxes),
-            "create_at": create_at_string
-        }
+    if not image_data:
+        return {"status": "error", "message": "Failed to download image from MinIO."}
 
-        json_output = json.dumps(output_data, indent=4)
-        logging.info(f"\n--- 📝 KẾT QUẢ XỬ LÝ JSON ---\n{json_output}")
-        return output_data
+    try:
+        logging.info("Bắt đầu xử lý dữ liệu ảnh...")
+        camera_id, _ = parse_object_key(object_key)
+        image, imgsz = preprocessor.decode(image_data, camera_id)
+
+        # Gửi ảnh vào bộ gom batch và chờ kết quả của riêng ảnh này
+        results = batcher.submit(image, imgsz).result()
+
+        return summarize_results(results, object_key)
 
     except Exception as e:
         logging.error(f"❌ LỖI XỬ LÝ YOLO cho {object_key}: {e}")
         return {"status": "error", "message": f"YOLO processing failed: {e}"}
 
-def remove_minio_object(bucket_name: str, object_key: str):
-    """Xóa một object từ MinIO."""
+
+# --- 4. Các công đoạn của pipeline (download -> decode -> infer -> write) ---
+def download_job(job: Job):
+    return get_object_as_bytes(job.bucket, job.key)
+
+
+@timed('decode')
+def decode_job(job: Job):
+    """Giải mã JPEG (giảm độ phân giải, cắt/che ROI của camera) thành mảng BGR để luồng YOLO không phải tự giải mã."""
+    camera_id, _ = parse_object_key(job.key)
+    image, job.imgsz = preprocessor.decode(job.data, camera_id)
+    if motion_gate is not None:
+        job.thumbnail = thumbnail(image, MOTION_THUMBNAIL_WIDTH)
+        previous = motion_gate.check(camera_id, job.thumbnail)
+        if previous is not None:
+            # Đặt sẵn kết quả -> pipeline bỏ qua công đoạn infer
+            job.detection = carry_forward(previous, job.key)
+    return image
+
+
+def carry_forward(previous: dict, object_key: str) -> dict:
+    """Kết quả của lần suy luận gần nhất, ghi lại cho ảnh mới của cùng camera."""
+    camera_id, create_at_string = parse_object_key(object_key)
+    logging.info(f"⏩ {object_key}: khung hình không đổi so với {previous['minio_key']}, dùng lại kết quả")
+    return {
+        **previous,
+        "minio_key": object_key,
+        "camera_id": camera_id,
+        "create_at": create_at_string,
+        "carried_forward": True,
+    }
+
+
+@timed('infer')
+def infer_jobs(jobs: list) -> list:
+    images, imgsizes = [job.image for job in jobs], [job.imgsz for job in jobs]
+    if inference_pool is not None:
+        results_list = inference_pool.predict(images, imgsizes)
+    else:
+        results_list = predict_grouped(model, images, imgsizes)
+    detections = [summarize_results(results, job.key) for job, results in zip(jobs, results_list)]
+    if motion_gate is not None:
+        for job, detection in zip(jobs, detections):
+            # Ảnh vừa suy luận trở thành ảnh tham chiếu mới của camera
+            motion_gate.record(detection['camera_id'], job.thumbnail, detection)
+            job.thumbnail = None
+    return detections
+
+
+def persist_job(job: Job):
+    if job.error:
+        logging.warning(f"Không lưu CSDL vì xử lý ảnh thất bại cho key: {job.key} ({job.error})")
+        if job.source == 'local':
+            # Ảnh qua socket chỉ còn ở bộ nhớ: thử lại vài lần thay vì bỏ ngay
+            job.message.nack()
+        else:
+            job.message.ack()
+        return
+    # Chưa ACK ở đây: tin nhắn chỉ được ACK sau khi lô chứa nó đã commit
+    writer.add(job.detection, job)
+
+
+def on_batch_committed(batch: list, inserted_keys: set):
+    """Xoá ảnh của các dòng vừa INSERT khỏi MinIO rồi ACK toàn bộ tin nhắn trong lô."""
+    keys_by_bucket = {}
+    for row in batch:
+        job = row.context
+        if job.source == 'local':
+            # Ảnh nhận qua socket không nằm trên MinIO (hoặc là bản lưu trữ cần giữ lại)
+            continue
+        if job.key in inserted_keys:
+            keys_by_bucket.setdefault(job.bucket, []).append(job.key)
+        else:
+            logging.info(f"⏭️ minio_key '{job.key}' đã tồn tại trong CSDL, bỏ qua INSERT.")
+
+    for bucket_name, keys in keys_by_bucket.items():
+        remove_minio_objects(bucket_name, keys)
+
+    if processed_keys is not None:
+        # Cả key vừa INSERT lẫn key đã có sẵn đều đã nằm trong CSDL
+        processed_keys.add(row.context.key for row in batch)
+
+    for row in batch:
+        row.context.message.ack()
+    logging.info(f"ACKED {len(batch)} message sau khi commit lô.")
+
+
+def on_local_frame(header: dict, image: bytes, delivery_attempt: int = 1):
+    """Ảnh nhận qua socket đã có sẵn bytes nên bỏ qua bước tải từ MinIO."""
+    minio_key = header.get('minio_key')
+    logging.info(f"\n--- 📩 NHẬN ẢNH QUA SOCKET ---\nKey: {minio_key}")
+    message = LocalMessage(
+        minio_key,
+        redeliver=lambda: on_local_frame(header, image, delivery_attempt + 1),
+        delivery_attempt=delivery_attempt,
+        max_attempts=HANDOFF_MAX_ATTEMPTS,
+        retry_delay=HANDOFF_RETRY_DELAY_SECONDS,
+    )
+    pipeline.submit(Job(
+        message=message,
+        bucket=header.get('minio_bucket'),
+        key=minio_key,
+        data=image,
+        source='local',
+    ))
+
+
+def on_batch_failed(batch: list, error: Exception):
+    # NACK (không chỉ bỏ qua ACK) để Pub/Sub gửi lại ngay thay vì gia hạn lease tới hết thời hạn tối đa;
+    # ảnh nhận qua socket được LocalMessage tự đưa lại vào pipeline (có giới hạn số lần)
+    logging.warning(f"NACK {len(batch)} tin nhắn vì lô bị lỗi: {error}")
+    for row in batch:
+        row.context.message.nack()
+
+
+def handle_detection(message, bucket: str, minio_key: str, detection_data: dict):
+    """
+    Chế độ tuần tự (PIPELINE_ENABLED=false): đưa kết quả vào bộ ghi theo lô giống công đoạn write của pipeline.
+    Bản trùng được INSERT ... ON CONFLICT DO NOTHING bỏ qua; xoá ảnh MinIO và ACK sau khi lô commit.
+    """
+    job = Job(message=message, bucket=bucket, key=minio_key, detection=detection_data)
+    if not detection_data or detection_data.get('status') != 'success':
+        job.error = (detection_data or {}).get('message', 'không có kết quả')
+    persist_job(job)
+
+
+def remove_minio_objects(bucket_name: str, object_keys: list):
+    """Xóa nhiều object trong một request MinIO."""
     try:
-        minio_client.remove_object(bucket_name, object_key)
-        logging.info(f"🗑️ Đã xóa thành công object '{object_key}' khỏi bucket '{bucket_name}'.")
-        return True
+        errors = minio_client.remove_objects(bucket_name, [DeleteObject(key) for key in object_keys])
+        error_count = 0
+        for error in errors:
+            error_count += 1
+            logging.error(f"❌ Lỗi MinIO khi xóa object '{error.object_name}': {error.message}")
+        logging.info(f"🗑️ Đã xóa {len(object_keys) - error_count}/{len(object_keys)} object khỏi bucket '{bucket_name}'.")
+        return error_count == 0
     except Exception as err:
-        logging.error(f"❌ Lỗi MinIO khi xóa object '{object_key}': {err}")
+        logging.error(f"❌ Lỗi MinIO khi xóa {len(object_keys)} object: {err}")
         return False
 
+def decode_message(message) -> tuple:
+    """
+    Đọc (bucket, [minio_key, ...]) từ tin nhắn. Hỗ trợ:
+      - payload JSON cũ: {"minio_bucket", "minio_key", ...}
+      - payload gộp theo vòng: {"minio_bucket", "minio_keys": [...]}
+      - payload gọn (attribute encoding=zlib+json): {"b": bucket, "k": [...]} nén zlib
+    """
+    if message.attributes.get('encoding') == COMPACT_ENCODING:
+        payload = json.loads(zlib.decompress(message.data))
+        return payload['b'], payload['k']
+
+    payload = json.loads(message.data.decode('utf-8'))
+    keys = payload.get('minio_keys') or [payload.get('minio_key')]
+    return payload.get('minio_bucket'), keys
+
+
 def callback(message: pubsub_v1.subscriber.message.Message) -> None:
-    global connection
+    publish_time = getattr(message, 'publish_time', None)
+    if publish_time is not None:
+        # Thời gian tin nhắn nằm trên Pub/Sub (từ lúc publish tới lúc callback nhận)
+        observe_queue_lag('pubsub', (datetime.datetime.now(datetime.timezone.utc) - publish_time).total_seconds())
+
     try:
-        payload = json.loads(message.data.decode('utf-8'))
-        is_saved = False
-        minio_bucket = payload.get('minio_bucket')
-        minio_key = payload.get('minio_key')
-
-        logging.info(f"\n--- 📩 NHẬN TIN NHẮN TỪ TOPIC ---\nKey: {minio_key}, Bucket: {minio_bucket}")
-
-        detection_data = image_process(minio_bucket, minio_key)
-
-        if detection_data and detection_data.get('status') == 'success':
-            minio_key = detection_data.get('minio_key')
-            existing_record = check_record(connection, minio_key)
-            if existing_record:
-                # Key đã tồn tại trong CSDL
-                print(f"INFO: minio_key '{minio_key}' đã tồn tại trong CSDL. Bỏ qua INSERT.")
-
-                message.ack()  # Xác nhận đã xử lý (và xóa) tin nhắn
-            else:
-                save_detection_to_db(connection, detection_data)
-                is_saved = True
-        else:
-            logging.warning(f"Không lưu CSDL vì xử lý ảnh thất bại cho key: {minio_key}")
+        minio_bucket, minio_keys = decode_message(message)
+
+        logging.info(f"\n--- 📩 NHẬN TIN NHẮN TỪ TOPIC ---\nKeys: {minio_keys}, Bucket: {minio_bucket}")
 
-        if is_saved:
-            remove_minio_object("images", minio_key)
+        # Tin nhắn chứa nhiều ảnh chỉ được ACK khi tất cả ảnh đã xử lý xong
+        tracked_message = GroupedMessage(message, len(minio_keys)) if len(minio_keys) > 1 else message
 
-        message.ack()
-        logging.info(f"ACKED message ID: {message.message_id}")
+        # Ảnh đã lưu CSDL (tin nhắn gửi lại/trùng) được ACK ngay, không tải ảnh hay chạy YOLO lại
+        duplicates = processed_keys.processed(minio_keys) if processed_keys is not None else set()
+
+        for minio_key in minio_keys:
+            if minio_key in duplicates:
+                logging.info(f"⏭️ minio_key '{minio_key}' đã tồn tại trong CSDL, ACK ngay và bỏ qua xử lý.")
+                tracked_message.ack()
+                continue
+
+            if PIPELINE_ENABLED:
+                # Chỉ đưa vào pipeline, công đoạn write sẽ ACK sau khi lưu xong
+                pipeline.submit(Job(message=tracked_message, bucket=minio_bucket, key=minio_key))
+                continue
+
+            detection_data = image_process(minio_bucket, minio_key)
+            handle_detection(tracked_message, minio_bucket, minio_key, detection_data)
 
     except Exception as e:
         logging.error(f"Lỗi chung trong callback: {e}")
@@ -158,85 +400,130 @@ def callback(message: pubsub_v1.subscriber.message.Message) -> None:
 
 
 
-def check_record(conn: psycopg.Connection, minio_key):
-    check_sql = "SELECT 1 FROM camera_detections WHERE minio_key = %s"
-
-    # Thực thi truy vấn kiểm tra
-    with conn.cursor() as cur:
-        cur.execute(check_sql, (minio_key,))
-
-        # Lấy kết quả
-        existing_record = cur.fetchone()
-
-    return existing_record
-
 def initialize_database(conn_string: str):
-    conn = None
+    pool = None
     try:
-        conn = psycopg.connect(conn_string)
-        logging.info("✅ PostgreSQL đã kết nối thành công.")
-
-        # Mở Cursor và sử dụng Context Manager
-        with conn.cursor() as cur:
-            # Lệnh SQL để tạo bảng nếu chưa tồn tại
-            sql_create_table = f"""
-                CREATE TABLE IF NOT EXISTS camera_detections (
-                    id SERIAL PRIMARY KEY,
-                    minio_key VARCHAR(255) UNIQUE NOT NULL,  -- ĐÃ THÊM TRƯỜNG NÀY
-                    camera_id VARCHAR(50) NOT NULL,
-                    detections JSONB,
-                    total_objects INTEGER NOT NULL,
-                    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
-                );
-            """
-
-            cur.execute(sql_create_table)
-            conn.commit()
-            logging.info(f"✅ Bảng '{"camera_detections"}' đã sẵn sàng.")
-
-        return conn
+        # Pool dùng chung cho mọi luồng callback; check_connection kiểm tra kết nối trước khi cho mượn,
+        # kết nối hỏng sẽ bị loại và pool tự kết nối lại ở nền
+        pool = ConnectionPool(
+            conn_string,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            check=ConnectionPool.check_connection,
+            max_idle=300,
+            reconnect_timeout=300,
+            open=False,
+        )
+        pool.open(wait=True, timeout=30)
+        logging.info(f"✅ PostgreSQL đã kết nối thành công (pool {DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE} kết nối).")
+
+        with pool.connection() as conn:
+            # Mở Cursor và sử dụng Context Manager
+            with conn.cursor() as cur:
+                # Lệnh SQL để tạo bảng nếu chưa tồn tại
+                # (bố cục phân vùng + index do db-maintenance/migrations quản lý; migration tự chuyển bảng này sang)
+                sql_create_table = f"""
+                    CREATE TABLE IF NOT EXISTS camera_detections (
+                        id SERIAL PRIMARY KEY,
+                        minio_key VARCHAR(255) UNIQUE NOT NULL,  -- ĐÃ THÊM TRƯỜNG NÀY
+                        camera_id VARCHAR(50) NOT NULL,
+                        detections JSONB,
+                        total_objects INTEGER NOT NULL,
+                        created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+                    );
+                """
+
+                cur.execute(sql_create_table)
+                conn.commit()
+                logging.info(f"✅ Bảng '{"camera_detections"}' đã sẵn sàng.")
+
+        return pool
 
 
     except Exception as e:
         logging.error(f"❌ LỖI KHỞI TẠO CSDL HOẶC TẠO BẢNG: {e}")
-        if conn:
-            conn.close()
+        if pool:
+            pool.close()
         raise
 
 
-def save_detection_to_db(conn: psycopg.Connection, data: dict):
-    """Sử dụng kết nối đã mở để lưu kết quả phát hiện."""
-    try:
-        with conn.cursor() as cur:
-
-            sql = """
-                  -- Thứ tự cột: minio_key, camera_id, detections, total_objects, created_at
-                  INSERT INTO camera_detections (minio_key, camera_id, detections, total_objects, created_at) 
-                  VALUES (%s, %s, %s, %s, %s) 
-                  """
-
-            # ĐÃ SỬA: Thứ tự tham số PHẢI KHỚP với thứ tự cột
-            params = (
-                data['minio_key'],          # 1. minio_key
-                data['camera_id'],          # 2. camera_id
-                json.dumps(data['detections']), # 3. detections
-                data['total_objects'],      # 4. total_objects
-                data['create_at']           # 5. created_at
-            )
+# --- 5. Chạy Subscriber ---
+def on_inference_pool_exhausted():
+    # Không fork lại worker được khi đã có luồng: thoát để Docker (restart: always) khởi động lại container
+    logging.critical("❌ Mọi worker suy luận đã dừng, thoát tiến trình.")
+    os._exit(1)
 
-            cur.execute(sql, params)
-            conn.commit()
-            logging.info(f"💾 Đã lưu kết quả cho {data['minio_key']} vào CSDL thành công.")
 
-    except Exception as e:
-        logging.error(f"❌ Lỗi CSDL khi lưu kết quả: {e}")
-        if conn:
-            conn.rollback()
-        raise
-
-# --- 5. Chạy Subscriber ---
 if __name__ == "__main__":
-    connection = initialize_database(connection_string)
+    if MOTION_GATE_ENABLED and not PIPELINE_ENABLED:
+        raise RuntimeError("MOTION_GATE_ENABLED=true cần PIPELINE_ENABLED=true")
+
+    if INFERENCE_WORKERS > 0:
+        if not PIPELINE_ENABLED:
+            raise RuntimeError("INFERENCE_WORKERS > 0 cần PIPELINE_ENABLED=true")
+        # Fork trước khi mở metrics server, pool CSDL hay kết nối Pub/Sub
+        inference_pool = InferencePool(
+            model, INFERENCE_WORKERS, INFERENCE_THREADS, on_exhausted=on_inference_pool_exhausted
+        ).start()
+
+    start_metrics_server(METRICS_PORT)
+    db_pool = initialize_database(connection_string)
+
+    if PROCESSED_KEY_CACHE_SIZE > 0:
+        processed_keys = ProcessedKeyCache(
+            db_pool, key_timestamp, PROCESSED_KEY_CACHE_SIZE, PROCESSED_KEY_LOOKUP_WAIT_MS
+        ).start()
+        register_snapshot('processed_keys', processed_keys.snapshot)
+
+    # Cả pipeline lẫn chế độ tuần tự đều ghi CSDL theo lô
+    writer = DetectionWriter(
+        db_pool,
+        on_committed=on_batch_committed,
+        on_failed=on_batch_failed,
+        batch_size=DB_BATCH_SIZE,
+        flush_interval_ms=DB_FLUSH_INTERVAL_MS,
+        rollup=ROLLUP_ENABLED,
+        carried_forward=MOTION_GATE_ENABLED,
+    ).start()
+    register_snapshot('writer', writer.snapshot)
+
+    if PIPELINE_ENABLED:
+        if motion_gate:
+            register_snapshot('motion_gate', motion_gate.snapshot)
+        pipeline = ImagePipeline(
+            download=download_job,
+            decode=decode_job,
+            infer=infer_jobs,
+            persist=persist_job,
+            io_workers=PIPELINE_IO_WORKERS,
+            decode_workers=PIPELINE_DECODE_WORKERS,
+            batch_size=YOLO_BATCH_SIZE,
+            batch_wait_ms=YOLO_BATCH_WAIT_MS,
+            queue_size=PIPELINE_QUEUE_SIZE,
+            metrics_interval=PIPELINE_METRICS_INTERVAL,
+            infer_workers=inference_pool.workers if inference_pool else 1,
+        ).start()
+        # Độ sâu hàng đợi / số luồng bận / số job đã xong của từng công đoạn
+        register_snapshot('pipeline', pipeline.snapshot)
+        if inference_pool:
+            register_snapshot('inference_pool', inference_pool.snapshot)
+    else:
+        batcher.start()
+
+    if HANDOFF_MODE == 'local':
+        if not PIPELINE_ENABLED:
+            raise RuntimeError("HANDOFF_MODE=local cần PIPELINE_ENABLED=true")
+        handoff_server = FrameHandoffServer(HANDOFF_SOCKET_PATH, on_local_frame).start()
+
+        if not SUBSCRIPTION_ID:
+            # Không có Pub/Sub: chỉ nhận ảnh qua socket cho đến khi bị dừng
+            logging.info("Không có PUBSUB_SUBSCRIPTION_ID, chỉ nhận ảnh qua socket.")
+            try:
+                threading.Event().wait()
+            except KeyboardInterrupt:
+                logging.info("Dừng nhận ảnh qua socket bằng tay (Ctrl+C).")
+                handoff_server.stop()
+            raise SystemExit(0)
 
     subscriber = pubsub_v1.SubscriberClient()
     logging.info(f"Đã khởi tạo Subscriber Client.")
@@ -246,7 +533,17 @@ if __name__ == "__main__":
         streaming_pull_future = None  # Khởi tạo lại biến trong mỗi lần lặp
         try:
             # Bắt đầu lắng nghe và trả về một đối tượng Future
-            streaming_pull_future = subscriber.subscribe(SUBSCRIPTION_ID, callback=callback)
+            # Thread pool riêng cho callback để nhiều ảnh có thể cùng nằm trong một batch
+            scheduler = pubsub_v1.subscriber.scheduler.ThreadScheduler(
+                executor=ThreadPoolExecutor(max_workers=SUBSCRIBER_MAX_WORKERS)
+            )
+            flow_control = pubsub_v1.types.FlowControl(max_messages=SUBSCRIBER_MAX_MESSAGES)
+            streaming_pull_future = subscriber.subscribe(
+                SUBSCRIPTION_ID,
+                callback=callback,
+                flow_control=flow_control,
+                scheduler=scheduler,
+            )
             logging.info(f"Bắt đầu lắng nghe tin nhắn liên tục trên {SUBSCRIPTION_ID}...")
 
             streaming_pull_future.result()
@@ -0,0 +1,70 @@
+"""
+Cổng chuyển động cho image-process: khi ảnh mới của một camera gần như giống ảnh đã chạy YOLO gần nhất
+(ban đêm, kẹt xe đứng yên...), dùng lại kết quả của lần đó thay vì chạy YOLO.
+
+So sánh trên ảnh xám thu nhỏ (trung bình từng khối điểm ảnh, rẻ hơn nhiều so với một lần suy luận): tỉ lệ điểm ảnh
+thay đổi quá MOTION_PIXEL_DELTA mức xám phải vượt MOTION_THRESHOLD thì mới coi là có chuyển động. Kết quả cũ chỉ
+được dùng lại tối đa MOTION_MAX_STALENESS_SECONDS kể từ lần suy luận thật gần nhất.
+"""
+import threading
+import time
+from collections import namedtuple
+from typing import Optional
+
+import numpy as np
+
+# Ảnh xám thu nhỏ và kết quả phát hiện của lần chạy YOLO gần nhất của một camera
+Reference = namedtuple('Reference', ['thumbnail', 'detection', 'inferred_at'])
+
+# Trọng số BGR -> xám (ITU-R BT.601, như cv2.cvtColor)
+GRAY_WEIGHTS = np.array([0.114, 0.587, 0.299], dtype=np.float32)
+
+
+def thumbnail(image: np.ndarray, width: int = 64) -> np.ndarray:
+    """Ảnh xám thu nhỏ còn khoảng `width` cột bằng cách lấy trung bình từng khối vuông điểm ảnh."""
+    block = max(1, image.shape[1] // width)
+    height, width = image.shape[0] // block, image.shape[1] // block
+    gray = image[:height * block, :width * block] @ GRAY_WEIGHTS
+    return gray.reshape(height, block, width, block).mean(axis=(1, 3))
+
+
+class MotionGate:
+    """
+    Giữ ảnh tham chiếu của từng camera. `check()` trả về kết quả phát hiện cũ nếu ảnh chưa đổi đáng kể
+    (và kết quả chưa quá hạn), ngược lại None để ảnh được đưa vào YOLO; `record()` cập nhật tham chiếu sau suy luận.
+    """
+
+    def __init__(self, threshold: float = 0.01, pixel_delta: float = 15, max_staleness: float = 300):
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.max_staleness = max_staleness
+        self.inferred = 0
+        self.carried = 0
+        self._references = {}
+        self._lock = threading.Lock()
+
+    def changed_fraction(self, reference: np.ndarray, current: np.ndarray) -> float:
+        return float(np.mean(np.abs(current - reference) > self.pixel_delta))
+
+    def check(self, camera_id: str, current: np.ndarray) -> Optional[dict]:
+        with self._lock:
+            reference = self._references.get(camera_id)
+        if (
+            reference is None
+            or reference.thumbnail.shape != current.shape
+            or time.monotonic() - reference.inferred_at >= self.max_staleness
+            or self.changed_fraction(reference.thumbnail, current) >= self.threshold
+        ):
+            return None
+        with self._lock:
+            self.carried += 1
+        return reference.detection
+
+    def record(self, camera_id: str, current: np.ndarray, detection: dict):
+        with self._lock:
+            self._references[camera_id] = Reference(current, detection, time.monotonic())
+            self.inferred += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {'cameras': len(self._references), 'inferred': self.inferred, 'carried_forward': self.carried}
@@ -0,0 +1,255 @@
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from batcher import drain_batch
+from metrics import observe_batch, observe_queue_lag
+
+
+@dataclass
+class Job:
+    """Một ảnh đi qua pipeline: download -> decode -> infer -> write."""
+    message: Any
+    bucket: str
+    key: str
+    enqueued_at: float = field(default_factory=time.monotonic)
+    data: Optional[bytes] = None
+    image: Any = None
+    # imgsz YOLO của camera (preprocess.FramePreprocessor); None = mặc định của mô hình
+    imgsz: Optional[int] = None
+    # Ảnh xám thu nhỏ cho cổng chuyển động (motion.MotionGate)
+    thumbnail: Any = None
+    detection: Optional[dict] = None
+    error: Optional[str] = None
+    # 'pubsub': ảnh nằm trên MinIO; 'local': bytes ảnh nhận thẳng qua socket
+    source: str = 'pubsub'
+
+
+class GroupedMessage:
+    """Một tin nhắn Pub/Sub chứa nhiều ảnh: chỉ ACK tin nhắn thật khi mọi ảnh trong đó đã ACK."""
+
+    def __init__(self, message, count: int):
+        self.message = message
+        self.message_id = message.message_id
+        self._remaining = count
+        self._nacked = False
+        self._lock = threading.Lock()
+
+    def ack(self):
+        with self._lock:
+            self._remaining -= 1
+            done = self._remaining == 0 and not self._nacked
+        if done:
+            self.message.ack()
+
+    def nack(self):
+        with self._lock:
+            if self._nacked:
+                return
+            self._nacked = True
+        self.message.nack()
+
+
+class Stage:
+    """Một công đoạn với hàng đợi đầu vào có giới hạn và số luồng xử lý cố định."""
+
+    def __init__(self, name: str, maxsize: int, workers: int):
+        self.name = name
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.workers = workers
+        self.busy = 0
+        self.processed = 0
+        self._lock = threading.Lock()
+
+    def put(self, job: Job):
+        job.enqueued_at = time.monotonic()
+        # Hàng đợi đầy thì chặn lại -> tạo áp lực ngược lên công đoạn phía trước
+        self.queue.put(job)
+
+    def mark_busy(self, count: int = 1):
+        with self._lock:
+            self.busy += count
+
+    def mark_done(self, count: int = 1):
+        with self._lock:
+            self.busy -= count
+            self.processed += count
+
+    def snapshot(self) -> dict:
+        return {
+            'queue_depth': self.queue.qsize(),
+            'queue_capacity': self.queue.maxsize,
+            'busy': self.busy,
+            'workers': self.workers,
+            'processed': self.processed,
+        }
+
+
+class ImagePipeline:
+    """
+    Pipeline nhiều công đoạn cho image-process:
+      - download: pool I/O tải ảnh từ MinIO trước (prefetch)
+      - decode: pool giải mã JPEG thành mảng ảnh
+      - infer: gom batch và chạy YOLO liên tục; một luồng, hoặc một luồng cho mỗi worker của InferencePool
+      - write: lưu CSDL, xoá object và ACK tin nhắn
+    Các hàm xử lý được truyền vào từ main.py để pipeline không phụ thuộc vào model/CSDL.
+    """
+
+    def __init__(
+            self,
+            download: Callable[[Job], Optional[bytes]],
+            decode: Callable[[Job], Any],
+            infer: Callable[[list], list],
+            persist: Callable[[Job], None],
+            io_workers: int = 8,
+            decode_workers: int = 2,
+            batch_size: int = 8,
+            batch_wait_ms: float = 50,
+            queue_size: int = 32,
+            metrics_interval: float = 30,
+            infer_workers: int = 1,
+    ):
+        self._download = download
+        self._decode = decode
+        self._infer = infer
+        self._persist = persist
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait_ms / 1000.0
+        self.metrics_interval = metrics_interval
+
+        self.download_stage = Stage('download', queue_size, io_workers)
+        self.decode_stage = Stage('decode', queue_size, decode_workers)
+        infer_workers = max(1, infer_workers)
+        self.infer_stage = Stage('infer', max(queue_size, self.batch_size * 2 * infer_workers), infer_workers)
+        self.write_stage = Stage('write', queue_size, 1)
+        self.stages = [self.download_stage, self.decode_stage, self.infer_stage, self.write_stage]
+
+        self._threads = []
+
+    def start(self):
+        self._spawn(self.download_stage, self._download_loop)
+        self._spawn(self.decode_stage, self._decode_loop)
+        self._spawn(self.infer_stage, self._infer_loop)
+        self._spawn(self.write_stage, self._write_loop)
+        if self.metrics_interval > 0:
+            thread = threading.Thread(target=self._report_loop, name='pipeline-metrics', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        logging.info(
+            "🚀 Pipeline đã chạy: "
+            + ", ".join(f"{stage.name}={stage.workers} luồng" for stage in self.stages)
+        )
+        return self
+
+    def submit(self, job: Job):
+        """Đưa job vào công đoạn đầu tiên (chặn nếu pipeline đang đầy)."""
+        self.download_stage.put(job)
+
+    def snapshot(self) -> dict:
+        """Độ sâu hàng đợi và số job đã xử lý của từng công đoạn."""
+        return {stage.name: stage.snapshot() for stage in self.stages}
+
+    # --- Các vòng lặp của từng công đoạn ---
+
+    @staticmethod
+    def _take(stage: Stage) -> Job:
+        job = stage.queue.get()
+        observe_queue_lag(stage.name, time.monotonic() - job.enqueued_at)
+        return job
+
+    def _spawn(self, stage: Stage, target: Callable):
+        for i in range(stage.workers):
+            thread = threading.Thread(target=target, name=f'pipeline-{stage.name}-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _fail(self, job: Job, error: str):
+        # Job lỗi đi thẳng tới công đoạn write để được ghi log và ACK như luồng cũ
+        job.error = error
+        job.data = None
+        job.image = None
+        self.write_stage.put(job)
+
+    def _download_loop(self):
+        stage = self.download_stage
+        while True:
+            job = self._take(stage)
+            stage.mark_busy()
+            try:
+                if job.data is None:
+                    job.data = self._download(job)
+                if not job.data:
+                    self._fail(job, "Failed to download image from MinIO.")
+                else:
+                    self.decode_stage.put(job)
+            except Exception as e:
+                self._fail(job, f"Download failed: {e}")
+            finally:
+                stage.mark_done()
+
+    def _decode_loop(self):
+        stage = self.decode_stage
+        while True:
+            job = self._take(stage)
+            stage.mark_busy()
+            try:
+                job.image = self._decode(job)
+                job.data = None
+                if job.detection is not None:
+                    # Cổng chuyển động đã dùng lại kết quả trước đó: bỏ qua YOLO
+                    job.image = None
+                    self.write_stage.put(job)
+                else:
+                    self.infer_stage.put(job)
+            except Exception as e:
+                self._fail(job, f"Decode failed: {e}")
+            finally:
+                stage.mark_done()
+
+    def _infer_loop(self):
+        stage = self.infer_stage
+        while True:
+            batch = drain_batch(stage.queue, self.batch_size, self.batch_wait)
+            now = time.monotonic()
+            for job in batch:
+                observe_queue_lag(stage.name, now - job.enqueued_at)
+            observe_batch(stage.name, len(batch))
+            stage.mark_busy(len(batch))
+            try:
+                detections = self._infer(batch)
+                for job, detection in zip(batch, detections):
+                    job.image = None
+                    job.detection = detection
+                    self.write_stage.put(job)
+            except Exception as e:
+                logging.error(f"❌ LỖI YOLO khi xử lý batch {len(batch)} ảnh: {e}")
+                for job in batch:
+                    self._fail(job, f"YOLO processing failed: {e}")
+            finally:
+                stage.mark_done(len(batch))
+
+    def _write_loop(self):
+        stage = self.write_stage
+        while True:
+            job = self._take(stage)
+            stage.mark_busy()
+            try:
+                self._persist(job)
+            except Exception as e:
+                # Không ACK để tin nhắn được gửi lại sau
+                logging.error(f"Lỗi khi lưu kết quả cho {job.key}: {e}")
+            finally:
+                stage.mark_done()
+
+    def _report_loop(self):
+        while True:
+            time.sleep(self.metrics_interval)
+            depths = " | ".join(
+                f"{name}: {s['queue_depth']}/{s['queue_capacity']} chờ, {s['busy']} đang xử lý, {s['processed']} xong"
+                for name, s in self.snapshot().items()
+            )
+            logging.info(f"📊 Pipeline - {depths}")
@@ -0,0 +1,159 @@
+"""
+Tiền xử lý ảnh camera trước YOLO:
+  - giải mã JPEG ở độ phân giải giảm bằng chế độ draft của PIL (co giãn DCT 1/2, 1/4, 1/8 ngay khi giải mã),
+    vừa đủ để vùng quan tâm không nhỏ hơn imgsz
+  - cắt (crop) và/hoặc che (mask) vùng không đếm của từng camera: trời, nhà, làn đường ngược chiều...
+  - imgsz riêng cho từng camera
+
+Cấu hình đọc từ file JSON PREPROCESS_CONFIG, toạ độ chuẩn hoá 0..1 theo khung hình gốc:
+    {
+      "default": {"imgsz": 640},
+      "cameras": {
+        "5deb576d1dc17d7c5515ad0c": {
+          "crop": [0.0, 0.3, 1.0, 1.0],
+          "mask": [[0.0, 0.3], [0.55, 0.3], [0.35, 1.0], [0.0, 1.0]],
+          "imgsz": 416
+        }
+      }
+    }
+"mask" là đa giác vùng GIỮ LẠI; phần ngoài đa giác được tô màu xám letterbox của YOLO.
+"""
+import io
+import json
+import logging
+import math
+import os
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+PREPROCESS_CONFIG = os.environ.get('PREPROCESS_CONFIG', 'camera_roi.json')
+# Mặc định trùng kích thước xuất mô hình của detector.py
+PREPROCESS_IMGSZ = int(os.environ.get('PREPROCESS_IMGSZ', os.environ.get('DETECTOR_IMGSZ', 640)))
+
+# Màu nền letterbox của ultralytics (BGR)
+MASK_FILL = (114, 114, 114)
+# imgsz của YOLO phải là bội số của stride lớn nhất
+IMGSZ_STRIDE = 32
+
+
+@dataclass(frozen=True)
+class CameraROI:
+    crop: Optional[tuple] = None
+    mask: Optional[tuple] = None
+    imgsz: int = PREPROCESS_IMGSZ
+
+
+def _parse_roi(camera_id: str, config: dict, default: CameraROI) -> CameraROI:
+    crop = config.get('crop', default.crop)
+    if crop is not None:
+        x1, y1, x2, y2 = (float(v) for v in crop)
+        if not (0 <= x1 < x2 <= 1 and 0 <= y1 < y2 <= 1):
+            raise ValueError(f"crop không hợp lệ cho camera {camera_id}: {crop}")
+        crop = (x1, y1, x2, y2)
+
+    mask = config.get('mask', default.mask)
+    if mask is not None:
+        mask = tuple((float(x), float(y)) for x, y in mask)
+        if len(mask) < 3:
+            raise ValueError(f"mask của camera {camera_id} cần ít nhất 3 điểm")
+
+    imgsz = int(config.get('imgsz', default.imgsz))
+    # Làm tròn lên bội số stride để ultralytics không phải tự sửa (và cảnh báo) mỗi lần gọi
+    imgsz = max(IMGSZ_STRIDE, math.ceil(imgsz / IMGSZ_STRIDE) * IMGSZ_STRIDE)
+    return CameraROI(crop=crop, mask=mask, imgsz=imgsz)
+
+
+class FramePreprocessor:
+    """
+    Giải mã + cắt/che ảnh theo cấu hình của từng camera, trả về (mảng BGR, imgsz).
+    Dùng chung cho mọi luồng decode; mặt nạ đa giác được dựng một lần cho mỗi (camera, kích thước ảnh).
+    """
+
+    def __init__(self, config: dict = None, imgsz: int = PREPROCESS_IMGSZ):
+        config = config or {}
+        self.default = _parse_roi('default', config.get('default', {}), CameraROI(imgsz=imgsz))
+        self.cameras = {
+            camera_id: _parse_roi(camera_id, camera_config, self.default)
+            for camera_id, camera_config in config.get('cameras', {}).items()
+        }
+        self._masks = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: str = PREPROCESS_CONFIG, imgsz: int = PREPROCESS_IMGSZ) -> 'FramePreprocessor':
+        if not path or not os.path.exists(path):
+            logging.info(f"Không có file ROI '{path}': dùng toàn khung hình, imgsz {imgsz}")
+            return cls(imgsz=imgsz)
+        with open(path, encoding='utf-8') as f:
+            preprocessor = cls(json.load(f), imgsz)
+        logging.info(f"🖼️ Đã nạp ROI cho {len(preprocessor.cameras)} camera từ '{path}'")
+        return preprocessor
+
+    def roi_for(self, camera_id: str) -> CameraROI:
+        return self.cameras.get(camera_id, self.default)
+
+    def decode(self, data: bytes, camera_id: str = None) -> tuple:
+        roi = self.roi_for(camera_id)
+        image = Image.open(io.BytesIO(data))
+        width, height = image.size
+
+        x1, y1, x2, y2 = roi.crop or (0.0, 0.0, 1.0, 1.0)
+        scale = roi.imgsz / max((x2 - x1) * width, (y2 - y1) * height)
+        if scale < 1 and image.format == 'JPEG':
+            # draft chọn hệ số DCT lớn nhất mà ảnh vẫn không nhỏ hơn kích thước yêu cầu
+            image.draft('RGB', (math.ceil(width * scale), math.ceil(height * scale)))
+        image = image.convert('RGB')
+
+        size = image.size
+        box = self._box(roi, size)
+        if box is not None:
+            image = image.crop(box)
+        frame = np.ascontiguousarray(np.asarray(image)[:, :, ::-1])
+        if roi.mask is not None:
+            frame[~self._mask(camera_id, roi, size, box)] = MASK_FILL
+        return frame, roi.imgsz
+
+    @staticmethod
+    def _box(roi: CameraROI, size: tuple) -> Optional[tuple]:
+        if roi.crop is None:
+            return None
+        width, height = size
+        x1, y1, x2, y2 = roi.crop
+        return round(x1 * width), round(y1 * height), round(x2 * width), round(y2 * height)
+
+    def _mask(self, camera_id: str, roi: CameraROI, size: tuple, box: Optional[tuple]) -> np.ndarray:
+        key = (camera_id, size)
+        mask = self._masks.get(key)
+        if mask is None:
+            width, height = size
+            image = Image.new('L', size, 0)
+            ImageDraw.Draw(image).polygon([(x * width, y * height) for x, y in roi.mask], fill=255)
+            if box is not None:
+                image = image.crop(box)
+            mask = np.asarray(image) > 0
+            with self._lock:
+                self._masks[key] = mask
+        return mask
+
+
+def group_by_imgsz(imgsizes: list) -> dict:
+    """{imgsz: [vị trí, ...]} để mỗi lần gọi model chỉ chứa ảnh cùng imgsz."""
+    groups = defaultdict(list)
+    for index, imgsz in enumerate(imgsizes):
+        groups[imgsz].append(index)
+    return groups
+
+
+def predict_grouped(model, images: list, imgsizes: list) -> list:
+    """Gọi model theo từng nhóm imgsz, trả kết quả theo đúng thứ tự `images`."""
+    results = [None] * len(images)
+    for imgsz, indexes in group_by_imgsz(imgsizes).items():
+        kwargs = {'imgsz': imgsz} if imgsz else {}
+        for index, result in zip(indexes, model([images[i] for i in indexes], **kwargs)):
+            results[index] = result
+    return results
@@ -0,0 +1,155 @@
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Callable
+
+from psycopg_pool import ConnectionPool
+
+from batcher import drain_batch
+from metrics import observe_cache, track
+
+# Một lần hỏi "key nào đã xử lý" của callback, chờ được gom với các lần hỏi khác vào một câu SELECT
+PendingLookup = namedtuple('PendingLookup', ['enqueued_at', 'keys', 'future'])
+
+# created_at suy ra từ chính minio_key nên khoảng [min, max] của lô giới hạn được số partition ngày phải quét
+EXISTS_SQL = """
+    SELECT minio_key FROM camera_detections
+    WHERE minio_key = ANY(%s) AND created_at BETWEEN %s AND %s
+"""
+# Ghi log lỗi tra CSDL tối đa một lần mỗi khoảng này (kèm số lần lỗi dồn lại)
+ERROR_LOG_INTERVAL_SECONDS = 60
+
+
+class ProcessedKeyCache:
+    """
+    Bộ nhớ các minio_key đã lưu CSDL, kiểm tra TRƯỚC khi tải ảnh để tin nhắn gửi lại/trùng được ACK ngay
+    thay vì tải ảnh và chạy YOLO rồi mới phát hiện trùng lúc INSERT.
+      - LRU trong bộ nhớ (`capacity` key gần nhất), được nạp khi lô ghi commit
+      - key không có trong LRU được tra CSDL bằng một câu `minio_key = ANY(...)` giới hạn created_at theo thời điểm
+        chụp `timestamp_of(key)` (bảng phân vùng theo ngày); các callback hỏi cùng lúc (trong `max_wait_ms`)
+        được gom chung một câu SELECT
+    Tra CSDL lỗi thì coi như chưa xử lý: INSERT ... ON CONFLICT DO NOTHING của bộ ghi vẫn chặn bản trùng.
+    Lỗi được đếm (snapshot 'lookup_errors', metrics result='lookup_error') và ghi log định kỳ.
+    """
+
+    def __init__(self, pool: ConnectionPool, timestamp_of: Callable[[str], datetime], capacity: int = 100_000,
+                 max_wait_ms: float = 5, max_batch: int = 100):
+        self.pool = pool
+        self.timestamp_of = timestamp_of
+        self.capacity = max(1, capacity)
+        self.max_wait = max_wait_ms / 1000.0
+        # Số lần hỏi tối đa gom vào một câu SELECT
+        self.max_batch = max(1, max_batch)
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+        self.cache_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.lookup_errors = 0
+        self._unlogged_errors = 0
+        self._last_error_log = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='processed-key-lookup', daemon=True)
+            self._thread.start()
+            logging.info(f"🚀 Cache key đã xử lý đã chạy (LRU {self.capacity} key, gom tra cứu {self.max_wait * 1000:.0f}ms)")
+        return self
+
+    def add(self, keys):
+        with self._lock:
+            for key in keys:
+                self._keys[key] = True
+                self._keys.move_to_end(key)
+            while len(self._keys) > self.capacity:
+                self._keys.popitem(last=False)
+
+    def processed(self, keys: list) -> set:
+        """Trả về tập các key trong `keys` đã có trong CSDL (LRU trước, phần còn lại tra CSDL)."""
+        hits, unknown = set(), []
+        with self._lock:
+            for key in keys:
+                if key in self._keys:
+                    self._keys.move_to_end(key)
+                    hits.add(key)
+                else:
+                    unknown.append(key)
+
+        found = set()
+        if unknown:
+            future = Future()
+            self._queue.put(PendingLookup(time.monotonic(), unknown, future))
+            found = future.result()
+            self.add(found)
+
+        with self._lock:
+            self.cache_hits += len(hits)
+            self.db_hits += len(found)
+            self.misses += len(unknown) - len(found)
+        observe_cache('processed_keys', 'hit', len(hits))
+        observe_cache('processed_keys', 'db_hit', len(found))
+        observe_cache('processed_keys', 'miss', len(unknown) - len(found))
+        return hits | found
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.cache_hits + self.db_hits + self.misses
+            return {
+                'size': len(self._keys),
+                'cache_hits': self.cache_hits,
+                'db_hits': self.db_hits,
+                'misses': self.misses,
+                'lookup_errors': self.lookup_errors,
+                # Tỉ lệ trả lời được ngay từ LRU / tỉ lệ key trùng (LRU hoặc CSDL)
+                'hit_rate': self.cache_hits / lookups if lookups else 0.0,
+                'duplicate_rate': (self.cache_hits + self.db_hits) / lookups if lookups else 0.0,
+            }
+
+    def _run(self):
+        while True:
+            batch = drain_batch(self._queue, self.max_batch, self.max_wait)
+            keys = list({key for lookup in batch for key in lookup.keys})
+            try:
+                existing = self._lookup(keys)
+            except Exception as e:
+                self._lookup_failed(len(keys), e)
+                existing = set()
+            for lookup in batch:
+                lookup.future.set_result(existing.intersection(lookup.keys))
+
+    def _lookup(self, keys: list) -> set:
+        timestamps = []
+        for key in keys:
+            try:
+                timestamps.append(self.timestamp_of(key))
+            except (ValueError, IndexError):
+                # Key không đúng định dạng thì không có dòng nào trong CSDL: để luồng xử lý thường ghi log lỗi
+                continue
+        if not timestamps:
+            return set()
+
+        with track('processed_key_lookup'):
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(EXISTS_SQL, (keys, min(timestamps), max(timestamps)))
+                    return {record[0] for record in cur.fetchall()}
+
+    def _lookup_failed(self, key_count: int, error: Exception):
+        observe_cache('processed_keys', 'lookup_error', key_count)
+        now = time.monotonic()
+        with self._lock:
+            self.lookup_errors += 1
+            self._unlogged_errors += 1
+            if now - self._last_error_log < ERROR_LOG_INTERVAL_SECONDS:
+                return
+            failures, self._unlogged_errors, self._last_error_log = self._unlogged_errors, 0, now
+        logging.error(
+            f"❌ Lỗi CSDL khi tra key đã xử lý ({failures} lần lỗi kể từ lần log trước, "
+            f"lần cuối với {key_count} key): {error}. Các key này được xử lý như key mới."
+        )
@@ -0,0 +1,201 @@
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from typing import Any, Callable
+
+from psycopg_pool import ConnectionPool
+
+from metrics import observe_batch, timed
+
+# Một dòng kết quả đang chờ ghi, kèm context (ví dụ tin nhắn Pub/Sub) để xử lý sau khi commit
+PendingRow = namedtuple('PendingRow', ['data', 'context'])
+
+INSERT_COLUMNS = ["minio_key", "camera_id", "detections", "total_objects", "created_at"]
+# Cột đánh dấu kết quả dùng lại từ cổng chuyển động (cần migration 0004 của db-maintenance)
+CARRIED_FORWARD_COLUMN = "carried_forward"
+# Khoá advisory giữ SHARED trong transaction của mỗi lô rollup; camera_detection_buckets_rebuild
+# (migration 0005 của db-maintenance) lấy EXCLUSIVE để không ghi đè tổng của lô chưa commit
+ROLLUP_LOCK_ID = 7_340_113
+
+
+def build_insert_sql(row_count: int, rollup: bool = False, carried_forward: bool = False) -> str:
+    """
+    INSERT nhiều dòng một lần, bỏ qua minio_key đã tồn tại thay cho bước SELECT kiểm tra trước.
+    Không chỉ định cột conflict để chạy được với cả UNIQUE (minio_key) của bảng cũ lẫn
+    UNIQUE (minio_key, created_at) của bảng phân vùng (db-maintenance/migrations).
+
+    Với rollup=True, các dòng thực sự được INSERT được cộng dồn vào camera_detection_buckets
+    trong cùng câu lệnh (cùng transaction), nên bucket không bao giờ lệch với dữ liệu thô đã commit.
+    Với carried_forward=True mỗi dòng có thêm cột carried_forward (xem row_params).
+    """
+    columns = INSERT_COLUMNS + [CARRIED_FORWARD_COLUMN] if carried_forward else INSERT_COLUMNS
+    placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    values = ", ".join([placeholders] * row_count)
+    returning = "minio_key, camera_id, detections, total_objects, created_at" if rollup else "minio_key"
+    insert_sql = f"""
+        INSERT INTO camera_detections ({', '.join(columns)})
+        VALUES {values}
+        ON CONFLICT DO NOTHING
+        RETURNING {returning}
+    """
+    if not rollup:
+        return insert_sql
+
+    # ORDER BY: các bản image-process khoá bucket theo cùng thứ tự để tránh deadlock
+    return f"""
+        WITH inserted AS ({insert_sql}),
+        rolled_up AS (
+            INSERT INTO camera_detection_buckets AS b
+                (camera_id, bucket_start, sample_count, sum_objects, max_objects, class_counts)
+            SELECT
+                camera_id,
+                date_bin('10 minutes', created_at, TIMESTAMP '2000-01-01'),
+                COUNT(*),
+                SUM(total_objects),
+                MAX(total_objects),
+                jsonb_sum_counts_agg(detections)
+            FROM inserted
+            GROUP BY 1, 2
+            ORDER BY 1, 2
+            ON CONFLICT (camera_id, bucket_start) DO UPDATE SET
+                sample_count = b.sample_count + EXCLUDED.sample_count,
+                sum_objects = b.sum_objects + EXCLUDED.sum_objects,
+                max_objects = GREATEST(b.max_objects, EXCLUDED.max_objects),
+                class_counts = jsonb_sum_counts(b.class_counts, EXCLUDED.class_counts),
+                finalized = false,
+                updated_at = now()
+        )
+        SELECT minio_key FROM inserted
+    """
+
+
+def row_params(data: dict, carried_forward: bool = False) -> tuple:
+    # Thứ tự tham số PHẢI KHỚP với thứ tự cột
+    params = (
+        data['minio_key'],
+        data['camera_id'],
+        json.dumps(data['detections']),
+        data['total_objects'],
+        data['create_at'],
+    )
+    if carried_forward:
+        params += (data.get('carried_forward', False),)
+    return params
+
+
+class DetectionWriter:
+    """
+    Gom kết quả phát hiện và ghi theo lô: một câu INSERT + một lần commit cho cả lô.
+    Lô được flush khi đủ `batch_size` dòng hoặc dòng cũ nhất đã chờ `flush_interval_ms`.
+    Sau khi commit, `on_committed(batch, inserted_keys)` được gọi để xoá ảnh và ACK tin nhắn;
+    nếu lỗi, `on_failed(batch, error)` được gọi và tin nhắn KHÔNG được ACK.
+    Với `rollup=True` bảng camera_detection_buckets được cập nhật cùng lô (cần migration 0002 của db-maintenance).
+    Với `carried_forward=True` cột carried_forward được ghi cùng dòng (cần migration 0004).
+    """
+
+    def __init__(
+            self,
+            pool: ConnectionPool,
+            on_committed: Callable[[list, set], None],
+            on_failed: Callable[[list, Exception], None],
+            batch_size: int = 100,
+            flush_interval_ms: float = 500,
+            max_pending: int = 1000,
+            rollup: bool = False,
+            carried_forward: bool = False,
+    ):
+        self.pool = pool
+        self.on_committed = on_committed
+        self.on_failed = on_failed
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_pending = max(self.batch_size, max_pending)
+        self.rollup = rollup
+        self.carried_forward = carried_forward
+
+        self._buffer = []
+        self._first_added_at = None
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='detection-writer', daemon=True)
+            self._thread.start()
+            logging.info(
+                f"🚀 Bộ ghi CSDL theo lô đã chạy (lô tối đa: {self.batch_size}, chờ tối đa: {self.flush_interval * 1000:.0f}ms)"
+            )
+        return self
+
+    def add(self, data: dict, context: Any = None):
+        """Thêm một dòng vào bộ đệm (chặn nếu bộ đệm đã đầy vì CSDL đang chậm)."""
+        with self._cond:
+            while len(self._buffer) >= self.max_pending:
+                self._cond.wait()
+            if not self._buffer:
+                self._first_added_at = time.monotonic()
+            self._buffer.append(PendingRow(data, context))
+            self._cond.notify_all()
+
+    def snapshot(self) -> dict:
+        """Số dòng đang chờ ghi (để theo dõi CSDL có theo kịp không)."""
+        with self._cond:
+            return {'pending': len(self._buffer), 'max_pending': self.max_pending}
+
+    def _take_batch(self) -> list:
+        with self._cond:
+            while True:
+                if self._buffer:
+                    if len(self._buffer) >= self.batch_size:
+                        break
+                    remaining = self._first_added_at + self.flush_interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(timeout=remaining)
+                else:
+                    self._cond.wait()
+
+            batch = self._buffer[:self.batch_size]
+            self._buffer = self._buffer[self.batch_size:]
+            # Dòng còn lại đã chờ từ trước nên được flush ngay ở vòng sau
+            if not self._buffer:
+                self._first_added_at = None
+            self._cond.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            self.flush(batch)
+
+    def flush(self, batch: list):
+        started = time.monotonic()
+        observe_batch('db_commit', len(batch))
+        try:
+            inserted = self.write_batch(batch)
+        except Exception as e:
+            logging.error(f"❌ Lỗi CSDL khi lưu lô {len(batch)} kết quả: {e}")
+            self.on_failed(batch, e)
+            return
+
+        logging.info(
+            f"💾 Đã lưu lô {len(batch)} kết quả ({len(inserted)} mới, {len(batch) - len(inserted)} trùng) "
+            f"trong {(time.monotonic() - started) * 1000:.0f}ms"
+        )
+        self.on_committed(batch, inserted)
+
+    @timed('db_commit')
+    def write_batch(self, batch: list) -> set:
+        """Ghi cả lô trong một transaction, trả về tập minio_key thực sự được INSERT."""
+        params = [value for row in batch for value in row_params(row.data, self.carried_forward)]
+        # Ra khỏi context pool.connection() sẽ commit, hoặc rollback nếu có lỗi
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                if self.rollup:
+                    # Câu lệnh riêng, trước INSERT: phải giữ khoá trước khi khoá dòng bucket nào
+                    cur.execute("SELECT pg_advisory_xact_lock_shared(%s)", (ROLLUP_LOCK_ID,))
+                cur.execute(build_insert_sql(len(batch), self.rollup, self.carried_forward), params)
+                inserted = {record[0] for record in cur.fetchall()}
+        return inserted
@@ -0,0 +1,170 @@
+"""
+Đo đạc dùng chung cho các worker (camera-ingest, image-process, image-predict): histogram thời gian và
+bộ đếm kết quả của từng công đoạn, độ trễ hàng đợi, và gauge lấy từ snapshot của các thành phần
+(pipeline, bộ lọc ảnh trùng, ...). Mỗi dịch vụ mở một endpoint HTTP định dạng Prometheus tại METRICS_PORT.
+
+Trong Docker file này được COPY cạnh main.py (compose `additional_contexts: shared`);
+khi chạy từ mã nguồn, các dịch vụ thêm AnalysisWorker/shared vào sys.path.
+"""
+import asyncio
+import contextlib
+import functools
+import logging
+import time
+from typing import Callable
+
+from prometheus_client import Counter, Histogram, start_http_server
+from prometheus_client.core import REGISTRY, GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'datapolisx'
+# Từ 5ms tới 2 phút: đủ cho tải ảnh, YOLO, commit CSDL lẫn một vòng dự đoán
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+STAGE_SECONDS = Histogram(
+    f'{PREFIX}_stage_seconds', 'Thời gian chạy của từng công đoạn', ['stage'], buckets=LATENCY_BUCKETS
+)
+STAGE_TOTAL = Counter(
+    f'{PREFIX}_stage', 'Số lần chạy của từng công đoạn theo kết quả', ['stage', 'outcome']
+)
+QUEUE_LAG_SECONDS = Histogram(
+    f'{PREFIX}_queue_lag_seconds', 'Thời gian một việc nằm trong hàng đợi trước khi được xử lý', ['queue'],
+    buckets=LATENCY_BUCKETS,
+)
+BATCH_SIZE = Histogram(
+    f'{PREFIX}_batch_size', 'Số phần tử của mỗi lô', ['stage'], buckets=BATCH_BUCKETS
+)
+FRAMES_TOTAL = Counter(
+    f'{PREFIX}_frames', 'Số ảnh theo nguồn và kết quả cuối (vd. ảnh qua socket được gửi lại / bị bỏ)', ['source', 'result']
+)
+CACHE_LOOKUPS = Counter(
+    f'{PREFIX}_cache_lookups', 'Số lần tra cứu cache theo kết quả (hit / miss / ...)', ['cache', 'result']
+)
+
+
+def start_metrics_server(port: int) -> int:
+    """Mở endpoint /metrics tại `port` (METRICS_PORT của từng dịch vụ); port <= 0 thì không mở."""
+    if port > 0:
+        start_http_server(port)
+        logger.info(f"📈 Metrics Prometheus tại http://0.0.0.0:{port}/metrics")
+    return port
+
+
+def observe(stage: str, seconds: float, outcome: str = 'ok'):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    STAGE_TOTAL.labels(stage, outcome).inc()
+
+
+def observe_queue_lag(queue: str, seconds: float):
+    QUEUE_LAG_SECONDS.labels(queue).observe(max(seconds, 0.0))
+
+
+def observe_batch(stage: str, size: int):
+    BATCH_SIZE.labels(stage).observe(size)
+
+
+def observe_frame(source: str, result: str):
+    FRAMES_TOTAL.labels(source, result).inc()
+
+
+def observe_cache(cache: str, result: str, count: int = 1):
+    if count:
+        CACHE_LOOKUPS.labels(cache, result).inc(count)
+
+
+@contextlib.contextmanager
+def track(stage: str):
+    """Đo một khối lệnh; lỗi được đếm với outcome='error' rồi ném tiếp."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        observe(stage, time.perf_counter() - started, 'error')
+        raise
+    observe(stage, time.perf_counter() - started)
+
+
+def timed(stage: str, outcome: Callable = None):
+    """
+    Decorator đo hàm thường hoặc async. `outcome(kết quả) -> str` phân loại kết quả trả về
+    (ví dụ hàm trả None khi lỗi thay vì ném exception); exception luôn được đếm là 'error'.
+    """
+
+    def label(result) -> str:
+        return str(outcome(result)) if outcome else 'ok'
+
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    result = await func(*args, **kwargs)
+                except asyncio.CancelledError:
+                    observe(stage, time.perf_counter() - started, 'cancelled')
+                    raise
+                except BaseException:
+                    observe(stage, time.perf_counter() - started, 'error')
+                    raise
+                observe(stage, time.perf_counter() - started, label(result))
+                return result
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                observe(stage, time.perf_counter() - started, 'error')
+                raise
+            observe(stage, time.perf_counter() - started, label(result))
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+class SnapshotCollector:
+    """
+    Xuất kết quả của `snapshot()` thành gauge `datapolisx_<name>_<trường>` mỗi lần Prometheus scrape.
+    Hỗ trợ dict phẳng {trường: số} và dict lồng {giá trị nhãn: {trường: số}} (nhãn tên `label`).
+    """
+
+    def __init__(self, name: str, snapshot: Callable[[], dict], label: str = 'stage'):
+        self.name = name
+        self.snapshot = snapshot
+        self.label = label
+
+    def collect(self):
+        try:
+            data = self.snapshot()
+        except Exception as e:
+            logger.error(f"Lỗi khi lấy snapshot '{self.name}' cho metrics: {e}")
+            return
+
+        families = {}
+        for key, value in data.items():
+            if isinstance(value, dict):
+                for field, number in value.items():
+                    if not isinstance(number, (int, float)):
+                        continue
+                    family = families.get(field)
+                    if family is None:
+                        family = families[field] = GaugeMetricFamily(
+                            f'{PREFIX}_{self.name}_{field}', f'{self.name}: {field}', labels=[self.label]
+                        )
+                    family.add_metric([str(key)], number)
+            elif isinstance(value, (int, float)):
+                families[key] = GaugeMetricFamily(f'{PREFIX}_{self.name}_{key}', f'{self.name}: {key}', value=value)
+        yield from families.values()
+
+
+def register_snapshot(name: str, snapshot: Callable[[], dict], label: str = 'stage') -> SnapshotCollector:
+    collector = SnapshotCollector(name, snapshot, label)
+    REGISTRY.register(collector)
+    return collector